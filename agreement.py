@@ -0,0 +1,193 @@
+"""How often members vote together, from a members x roll calls matrix"""
+
+import threading
+import time
+
+import numpy as np
+
+from models import db, GovMembers, MemberVote
+from stats import NO, YES, load_positions
+
+# Roll calls per matrix product, bounding the float32 copy of the matrix
+CHUNK = 4096
+
+
+def tallies(positions):
+    """`(shared, net)` for an int8 members x roll calls block of 1 (yes),
+    -1 (no) and 0: roll calls each pair both voted yes or no on, and how
+    many more of those they agreed on than not
+    """
+
+    shared = np.zeros((len(positions), len(positions)), dtype=np.int64)
+    net = np.zeros_like(shared)
+
+    for start in range(0, positions.shape[1], CHUNK):
+        block = positions[:, start:start + CHUNK].astype(np.float32)
+        shared += np.rint(np.abs(block) @ np.abs(block).T).astype(np.int64)
+        net += np.rint(block @ block.T).astype(np.int64)
+
+    return shared, net
+
+
+class Agreement:
+    """Pairwise agreement of members, as of one refresh of `AgreementMatrix`"""
+
+    def __init__(self, member_ids, shared, net):
+        self.member_ids = member_ids
+        self.numbers = {member_id: number for number, member_id in enumerate(member_ids)}
+        self.shared = shared
+        self.net = net
+
+    def __contains__(self, member_id):
+        return member_id in self.numbers
+
+    def between(self, member_a, member_b):
+        """`(agreed, shared)` yes / no votes of the two members, or None if
+        either has none stored
+        """
+
+        a = self.numbers.get(member_a)
+        b = self.numbers.get(member_b)
+        if a is None or b is None:
+            return None
+
+        shared = int(self.shared[a, b])
+        return (shared + int(self.net[a, b])) // 2, shared
+
+    def similar(self, member_id, limit=10, least=False, min_shared=1):
+        """Members who vote most (or `least`) like `member_id`, as
+        `(member_id, agreed, shared)`, over at least `min_shared` shared votes
+        """
+
+        number = self.numbers.get(member_id)
+        if number is None:
+            return []
+
+        shared = self.shared[number]
+        agreed = (shared + self.net[number]) // 2
+        candidates = np.flatnonzero(shared >= max(min_shared, 1))
+        candidates = candidates[candidates != number]
+
+        rate = agreed[candidates] / shared[candidates]
+        # Best rate first, then most shared votes
+        order = np.lexsort((-shared[candidates], rate if least else -rate))[:limit]
+
+        return [(self.member_ids[other], int(agreed[other]), int(shared[other]))
+                for other in candidates[order]]
+
+
+class AgreementMatrix:
+    """Members x roll calls matrix of stored yes / no votes, and the pairwise
+    `Agreement` computed from it in one pass of matrix products.
+
+    At most every `check_every` seconds a request looks for members whose
+    votes were synced since and recounts only the roll calls synced for
+    them: their columns' old tallies are subtracted and the new ones added.
+    Each refresh swaps in a new `Agreement`, so requests meanwhile keep
+    reading the previous one.
+    """
+
+    def __init__(self, check_every=60):
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._current = None
+        self._checked_at = None
+        self._synced = {}
+        self._member_ids = []
+        self._columns = {}
+        self._positions = np.zeros((0, 0), dtype=np.int8)
+        self._shared = self._net = np.zeros((0, 0), dtype=np.int64)
+
+    def get(self):
+        current = self._current
+        if current is not None and time.monotonic() - self._checked_at < self.check_every:
+            return current
+
+        if not self._lock.acquire(blocking=current is None):
+            # Another request is already refreshing; read what we have
+            return current
+
+        try:
+            if self._current is None or time.monotonic() - self._checked_at >= self.check_every:
+                self._refresh()
+                self._checked_at = time.monotonic()
+            return self._current
+        finally:
+            self._lock.release()
+
+    def _refresh(self):
+        synced = dict(db.session.query(GovMembers.id, GovMembers.votes_synced_through)
+                      .filter(GovMembers.votes_synced_through.isnot(None)))
+        changed = [member_id for member_id, through in synced.items()
+                   if self._synced.get(member_id) != through]
+
+        if changed or self._current is None:
+            self._recount(self._synced_roll_calls(changed))
+            self._synced.update((member_id, synced[member_id]) for member_id in changed)
+            self._current = Agreement(list(self._member_ids), self._shared, self._net)
+
+    def _synced_roll_calls(self, changed):
+        """Roll calls synced for `changed` members since the last refresh.
+
+        Members already counted are read from the earliest of their
+        previous high-water marks; recounting a roll call twice is harmless.
+        """
+
+        new = [member_id for member_id in changed if member_id not in self._synced]
+        known = [member_id for member_id in changed if member_id in self._synced]
+
+        criteria = []
+        if new:
+            criteria.append(MemberVote.member_id.in_(new))
+        if known:
+            criteria.append(db.and_(
+                MemberVote.member_id.in_(known),
+                MemberVote.voted_at >= min(self._synced[member_id] for member_id in known)))
+
+        return db.select([MemberVote.vote_key]).where(db.or_(db.false(), *criteria))
+
+    def _recount(self, roll_calls):
+        member_ids, member, roll_call, code, _ = load_positions(
+            MemberVote.vote_key.in_(roll_calls))
+
+        # Rows for members and columns for roll calls seen for the first time
+        numbers = {member_id: number for number, member_id in enumerate(self._member_ids)}
+        for member_id in member_ids:
+            if member_id not in numbers:
+                numbers[member_id] = len(self._member_ids)
+                self._member_ids.append(member_id)
+
+        for number in np.unique(roll_call).tolist():
+            self._columns.setdefault(number, len(self._columns))
+
+        size = len(self._member_ids)
+        if self._positions.shape != (size, len(self._columns)):
+            positions = np.zeros((size, len(self._columns)), dtype=np.int8)
+            positions[:self._positions.shape[0], :self._positions.shape[1]] = self._positions
+            self._positions = positions
+
+        # The recounted columns, before and after
+        rows = np.array([numbers[member_id] for member_id in member_ids], dtype=np.int64)[member]
+        columns = np.array([self._columns[number] for number in roll_call.tolist()],
+                           dtype=np.int64)
+        recounted = np.unique(columns)
+
+        before = self._positions[:, recounted]
+        after = np.zeros_like(before)
+        after[rows, np.searchsorted(recounted, columns)] = (
+            (code == YES).astype(np.int8) - (code == NO).astype(np.int8))
+        self._positions[:, recounted] = after
+
+        shared = np.zeros((size, size), dtype=np.int64)
+        net = np.zeros_like(shared)
+        previous = len(self._shared)
+        shared[:previous, :previous] = self._shared
+        net[:previous, :previous] = self._net
+
+        shared_after, net_after = tallies(after)
+        shared_before, net_before = tallies(before)
+        self._shared = shared + shared_after - shared_before
+        self._net = net + net_after - net_before
@@ -1,53 +1,281 @@
 import os
-import requests
 import json
-from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify, Blueprint, url_for
-from flask_debugtoolbar import DebugToolbarExtension
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify, Blueprint, url_for, get_template_attribute, current_app
+from flask.cli import with_appcontext
 from sqlalchemy.exc import IntegrityError
-from keys import key
-from flask_paginate import Pagination, get_page_parameter
-from urllib.parse import quote
 
+from agreement import AgreementMatrix
+from cache import TTLCache, LRUBackend, DiskBackend, TieredBackend, make_backend
 from forms import UserAddForm, LoginForm
-from models import db, connect_db, User, GovMembers, Likes
-
-BASE_URL = 'https://api.propublica.org/congress/v1/'
-MEMBERS_API_URL = 'https://api.propublica.org/congress/v1/116/senate/members.json'
-ALL_MEMBERS = 'https://api.propublica.org/congress/v1/116/senate/members.json'
-MEMBER_VOTE_POSITION_API = 'https://api.propublica.org/congress/v1/members/'
-BILL_API = 'https://api.propublica.org/congress/v1/bills/search.json'
+from fragments import RosterFragments
+from hashing import hasher, HashingOverloaded
+from identity import IdentityCache, LazyUser
+import instrumentation
+from models import (db, connect_db, upgrade_schema, use_primary, statement_timeout, REPLICA,
+                    User, GovMembers, Likes, MemberVote, MemberVoteStats, Bill)
+from pagination import (PAGE_SIZE, DeferredPage, Page, UpstreamPager, cursor_offset,
+                        decode_cursor, encode_cursor, offset_cursor)
+from propublica import (BASE_URL, CURRENT_CONGRESS, NotFound, ProPublicaClient, ProPublicaError,
+                        QuotaExhausted, UpstreamTimeout)
+from quota import DatabaseQuotaStore, LocalQuotaStore, background
+from stats import MIN_PARTY_VOTERS, refresh_vote_stats
+from streaming import render_page
+from sync import (sync_rosters, sync_followed_votes, run_vote_sync_worker,
+                  load_bills, member_vote_key)
+from typeahead import MemberIndex
 
 
 CURR_USER_KEY = 'curr_user'
+# Replaced by a new token whenever the user's follows change, see
+# identity.IdentityCache
+IDENTITY_VERSION_KEY = 'identity_version'
+# Until when (epoch seconds) the user's requests read from the primary
+PRIMARY_UNTIL_KEY = 'primary_until'
 
+pages = Blueprint('pages', __name__)
 mod = Blueprint('members_data', __name__)
 
-app = Flask(__name__)
-
-# Get DB_URI from environ variable. If not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///informed_voter_db')
-)
-
+# Per-worker services, configured by create_app
+propublica = ProPublicaClient()
+identity_cache = IdentityCache()
+roster_cache = TTLCache(LRUBackend(), ttl=60 * 60)
+api_cache = TTLCache(LRUBackend(maxsize=256), ttl=300)
+roster_fragments = RosterFragments()
+# Pages of upstream vote histories and bill searches (see pagination.py), and
+# the member details shown above vote history pages
+page_cache = TTLCache(LRUBackend(maxsize=1024), ttl=300)
+pager = UpstreamPager(page_cache, lambda prefetch: propublica.executor.submit(prefetch))
+# Bill and nomination details, in memory in front of a store shared on disk
+detail_cache = TTLCache(LRUBackend(maxsize=512), ttl=60 * 60)
+# Prefix index of both rosters for the member typeahead
+member_index = MemberIndex()
+# How often members with synced votes vote together
+agreement_matrix = AgreementMatrix()
+
+
+def create_app(config=None):
+    """Create the app, with `config` overriding settings from the environment.
+
+    Nothing here talks to the database or upstream, so it is cheap to call
+    in tests and in a gunicorn master before forking (see gunicorn.conf.py).
+    Create the schema with `flask init-db`.
+    """
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '#secert_voter2020')
+    app = Flask(__name__)
+
+    # Get DB_URI from environ variable. If not set there, use development local db.
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgres:///informed_voter_db')
+    )
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Database connections per worker (pool_size, plus up to max_overflow
+    # more under load), how long (seconds) a request waits for one, and how
+    # long (ms) a statement may run before Postgres cancels it, 0 for no limit
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 30 * 60)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'connect_args': {'options': '-c statement_timeout=%d' % int(
+            os.environ.get('DB_STATEMENT_TIMEOUT', 15000))},
+    }
+    # Optional read replica for queries that only read (see
+    # models.RoutingSession). After a write, the user's requests keep reading
+    # from the primary for DB_REPLICA_STICKY_SECONDS, to cover replica lag.
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA: replica_url} if replica_url else {}
+    app.config['DB_REPLICA_STICKY_SECONDS'] = float(
+        os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '#secert_voter2020')
+
+    # Rosters change a handful of times per session of congress, so serve them from
+    # cache and refresh in the background once they are older than the TTL.
+    app.config['ROSTER_CACHE_TTL'] = int(os.environ.get('ROSTER_CACHE_TTL', 60 * 60))
+    app.config['ROSTER_CACHE_BACKEND'] = os.environ.get('ROSTER_CACHE_BACKEND', 'lru')
+    app.config['ROSTER_CACHE_PATH'] = os.environ.get(
+        'ROSTER_CACHE_PATH', '/tmp/informed_voter_cache.sqlite3')
+
+    # Upstream API root, e.g. benchmarks.mock_propublica for offline runs, and
+    # key; unset, the key is read from keys.py on the first upstream call
+    app.config['PROPUBLICA_BASE_URL'] = os.environ.get('PROPUBLICA_BASE_URL', BASE_URL)
+    app.config['PROPUBLICA_API_KEY'] = os.environ.get('PROPUBLICA_API_KEY')
+    # Upstream connection pool, timeouts (seconds) and retries
+    app.config['PROPUBLICA_POOL_SIZE'] = int(os.environ.get('PROPUBLICA_POOL_SIZE', 10))
+    app.config['PROPUBLICA_CONNECT_TIMEOUT'] = float(
+        os.environ.get('PROPUBLICA_CONNECT_TIMEOUT', 3.05))
+    app.config['PROPUBLICA_READ_TIMEOUT'] = float(
+        os.environ.get('PROPUBLICA_READ_TIMEOUT', 10))
+    app.config['PROPUBLICA_RETRIES'] = int(os.environ.get('PROPUBLICA_RETRIES', 2))
+    # Share identical in-flight upstream calls across workers through lock files
+    # in this directory; unset, they are only shared between threads of a worker
+    app.config['PROPUBLICA_COALESCE_DIR'] = os.environ.get('PROPUBLICA_COALESCE_DIR')
+    # Upstream budget: calls per second (bursting to PROPUBLICA_BURST) and per
+    # UTC day, 0 for no limit. Background syncs and refreshes may use
+    # PROPUBLICA_BACKGROUND_SHARE of the daily budget; page views get the rest.
+    # 'database' counts it in one row every web and sync worker shares;
+    # 'local' gives each process the whole budget.
+    app.config['PROPUBLICA_RATE_LIMIT'] = float(os.environ.get('PROPUBLICA_RATE_LIMIT', 10))
+    app.config['PROPUBLICA_BURST'] = int(os.environ.get('PROPUBLICA_BURST', 20))
+    app.config['PROPUBLICA_DAILY_LIMIT'] = int(os.environ.get('PROPUBLICA_DAILY_LIMIT', 5000))
+    app.config['PROPUBLICA_BACKGROUND_SHARE'] = float(
+        os.environ.get('PROPUBLICA_BACKGROUND_SHARE', 0.8))
+    app.config['PROPUBLICA_QUOTA_STORE'] = os.environ.get('PROPUBLICA_QUOTA_STORE', 'database')
+    # Deadline for pages that fetch several upstream resources at once
+    app.config['PROPUBLICA_FANOUT_TIMEOUT'] = float(
+        os.environ.get('PROPUBLICA_FANOUT_TIMEOUT', 12))
+
+    # bcrypt work factor, how many passwords each worker hashes at once, and
+    # how many more may wait before logins and signups are turned away
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['BCRYPT_POOL_WORKERS'] = int(os.environ.get('BCRYPT_POOL_WORKERS', 1))
+    app.config['BCRYPT_MAX_QUEUE'] = int(os.environ.get('BCRYPT_MAX_QUEUE', 16))
+
+    # Per-worker cache of usernames and follow state
+    app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+    app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+
+    # Serialized JSON API payloads, and how long clients may reuse them (seconds)
+    app.config['API_CACHE_TTL'] = int(os.environ.get('API_CACHE_TTL', 300))
+    app.config['API_MAX_AGE'] = int(os.environ.get('API_MAX_AGE', 60))
+
+    # Routes (endpoint names) whose pages are streamed as they render
+    app.config['STREAMED_ROUTES'] = set(os.environ.get(
+        'STREAMED_ROUTES',
+        'pages.get_congress_member,pages.get_member_info').split(','))
+
+    # How long pages of upstream lists, and member details, are served before
+    # they refresh
+    app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+
+    # Bill and nomination details: how many each worker keeps in memory, where
+    # and how much all workers keep on disk, and how long they stay fresh,
+    # by whether the bill or nomination can still change
+    app.config['DETAIL_CACHE_MEMORY_SIZE'] = int(os.environ.get('DETAIL_CACHE_MEMORY_SIZE', 512))
+    app.config['DETAIL_CACHE_DIR'] = os.environ.get(
+        'DETAIL_CACHE_DIR', '/tmp/informed_voter_details')
+    app.config['DETAIL_CACHE_MAX_BYTES'] = int(
+        os.environ.get('DETAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    app.config['DETAIL_CACHE_TTL_ACTIVE'] = int(os.environ.get('DETAIL_CACHE_TTL_ACTIVE', 60 * 60))
+    app.config['DETAIL_CACHE_TTL_FINAL'] = int(
+        os.environ.get('DETAIL_CACHE_TTL_FINAL', 30 * 24 * 60 * 60))
+
+    # How often (seconds) the member typeahead checks whether the rosters changed
+    app.config['MEMBER_INDEX_CHECK_EVERY'] = float(
+        os.environ.get('MEMBER_INDEX_CHECK_EVERY', 30))
+
+    # How often (seconds) member agreement picks up newly synced votes, and
+    # the fewest shared votes for a member to be listed as similar or not
+    app.config['AGREEMENT_CHECK_EVERY'] = float(os.environ.get('AGREEMENT_CHECK_EVERY', 60))
+    app.config['AGREEMENT_MIN_SHARED'] = int(os.environ.get('AGREEMENT_MIN_SHARED', 10))
+
+    # How far back (in pages of 20) to load a newly followed member's votes
+    app.config['VOTE_SYNC_MAX_PAGES'] = int(os.environ.get('VOTE_SYNC_MAX_PAGES', 25))
+
+    # Per-request timing breakdown in a Server-Timing header, histograms at /metrics
+    app.config['SERVER_TIMING_ENABLED'] = (
+        os.environ.get('SERVER_TIMING_ENABLED', 'true').lower() == 'true')
+    app.config['METRICS_PATH'] = os.environ.get('METRICS_PATH', '/metrics')
+
+    app.config.update(config or {})
+
+    if app.debug:
+        # Only debug runs pay for importing the toolbar
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    instrumentation.init_app(app)
+    connect_db(app)
+    hasher.init_app(app)
+    propublica.init_app(app)
+    propublica.quota.store = (
+        DatabaseQuotaStore(lambda: db.get_engine(app))
+        if app.config['PROPUBLICA_QUOTA_STORE'] == 'database' else LocalQuotaStore())
+    identity_cache.init_app(app)
+
+    roster_cache.backend = make_backend(app.config['ROSTER_CACHE_BACKEND'],
+                                        path=app.config['ROSTER_CACHE_PATH'])
+    roster_cache.ttl = app.config['ROSTER_CACHE_TTL']
+    api_cache.ttl = app.config['API_CACHE_TTL']
+    page_cache.ttl = page_cache.max_stale = app.config['PAGE_CACHE_TTL']
+
+    detail_cache.backend = TieredBackend(
+        LRUBackend(maxsize=app.config['DETAIL_CACHE_MEMORY_SIZE']),
+        DiskBackend(app.config['DETAIL_CACHE_DIR'],
+                    max_bytes=app.config['DETAIL_CACHE_MAX_BYTES']))
+    detail_cache.ttl = detail_ttl(app.config['DETAIL_CACHE_TTL_ACTIVE'],
+                                  app.config['DETAIL_CACHE_TTL_FINAL'])
+    member_index.check_every = app.config['MEMBER_INDEX_CHECK_EVERY']
+    agreement_matrix.check_every = app.config['AGREEMENT_CHECK_EVERY']
+
+    instrumentation.collect(
+        'informed_voter_upstream_budget',
+        'Upstream calls made, denied and served stale, and budget left today.',
+        'measure', lambda: propublica.quota.metrics() if propublica.quota else {})
+    instrumentation.collect(
+        'informed_voter_detail_cache',
+        'Bill and nomination detail reads by where they were answered, and '
+        'what is stored on disk.',
+        'measure', lambda: detail_cache.backend.metrics())
+    instrumentation.collect(
+        'informed_voter_password_hashing',
+        'Password hashes computed and rejected, and seconds spent hashing and '
+        'queued for a worker.',
+        'measure', hasher.metrics)
+
+    app.register_blueprint(pages)
+    app.register_blueprint(mod, url_prefix='/api/v1')
+
+    for command in (init_db_command, sync_rosters_command, load_bills_command,
+                    sync_votes_command, refresh_stats_command):
+        app.cli.add_command(command)
+
+    return app
 
-connect_db(app)
-db.create_all()
 
 # *************************************************
 # User signup, login, like, and logout
 
 
-@app.before_request
+@pages.before_app_request
+def read_own_writes():
+    """Read from the primary for a while after this user's last write"""
+
+    if session.get(PRIMARY_UNTIL_KEY, 0) > time.time():
+        use_primary()
+
+
+@pages.after_app_request
+def remember_writes(response):
+    if current_app.config['SQLALCHEMY_BINDS'] and db.session.info.get('wrote'):
+        session[PRIMARY_UNTIL_KEY] = (time.time() +
+                                      current_app.config['DB_REPLICA_STICKY_SECONDS'])
+
+    return response
+
+
+@pages.before_app_request
 def add_user_to_g():
-    """If user logged in, add curr user to Flask global"""
+    """If user logged in, add curr user to Flask global.
+
+    The user is only loaded from the database when a route needs more than
+    the cached identity.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = LazyUser(session[CURR_USER_KEY],
+                          session.get(IDENTITY_VERSION_KEY, 0),
+                          identity_cache)
     else:
         g.user = None
 
@@ -65,7 +293,31 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=['GET', 'POST'])
+def identity_changed():
+    """Drop the current user's cached identity after their follows change"""
+
+    identity_cache.invalidate(g.user.id, g.user.version)
+    # Unique, so another device's session never reuses this one's entries
+    session[IDENTITY_VERSION_KEY] = uuid.uuid4().hex
+
+
+def account_exists():
+    """True if a user is logged in and their account is still there.
+
+    Check before writing for `g.user`: its cached identity can outlive an
+    account deleted through another worker. Such a user is logged out.
+    """
+
+    if g.user and g.user.load() is not None:
+        return True
+
+    if g.user is not None:
+        do_logout()
+        g.user = None
+    return False
+
+
+@pages.route('/signup', methods=['GET', 'POST'])
 def signup():
     """Handle user signup.
 
@@ -92,6 +344,10 @@ def signup():
             flash('Username already exists', 'danger')
             return render_template('users/signup.html', form=form)
 
+        except HashingOverloaded:
+            flash('We are very busy right now, please try again in a moment', 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
         return redirect('/')
 
@@ -99,16 +355,22 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@pages.route('/login', methods=['GET', 'POST'])
 def login():
     """Handle user login"""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data, form.password.data)
+        try:
+            user = User.authenticate(form.username.data, form.password.data)
+        except HashingOverloaded:
+            flash('We are very busy right now, please try again in a moment', 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # keep a hash upgraded to the configured work factor
+            db.session.commit()
             do_login(user)
             flash(f"Welcome back {user.username}!", 'success')
             return redirect('/')
@@ -118,75 +380,107 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/users/like', methods=['GET', 'POST'])
+@pages.route('/users/like', methods=['GET', 'POST'])
 def add_like():
     """Toggle a liked item for currently logged in user"""
 
-    if not g.user:
+    if not account_exists():
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
-    member_id = request.args.get('member_id')
-    first_name = request.args.get('first_name')
-    last_name = request.args.get('last_name')
+    member = {
+        'id': request.args.get('member_id'),
+        'first_name': request.args.get('first_name'),
+        'last_name': request.args.get('last_name'),
+    }
 
-    if GovMembers.query.get(member_id):
-        new_like = Likes(user_id=g.user.id, item_id=member_id)
-    else:
-        new_govmember_like = GovMembers(id=member_id,
-                                        first_name=first_name,
-                                        last_name=last_name)
-
-        new_like = Likes(user_id=g.user.id, item_id=member_id)
-        db.session.add(new_govmember_like)
-        db.session.commit()
+    if not all(member.values()):
+        abort(400)
 
-    db.session.add(new_like)
+    Likes.follow(g.user.id, [member])
     db.session.commit()
+    identity_changed()
 
     return redirect('/')
 
 
-@app.route('/users/like/<like_id>/delete', methods=['GET', 'POST'])
+@pages.route('/users/like/<like_id>/delete', methods=['GET', 'POST'])
 def remove_like(like_id):
     """Remove govmember from favorites"""
 
-    if not g.user:
+    if not account_exists():
         flash("Access unauthorized", "danger")
         return redirect('/')
 
-    liked_member = GovMembers.query.get_or_404(like_id)
+    if not Likes.unfollow(g.user.id, [like_id]):
+        # Not followed yet: the star toggles it on
+        GovMembers.query.get_or_404(like_id)
+        Likes.follow(g.user.id, [like_id])
 
-    user_likes = g.user.likes
+    db.session.commit()
+    identity_changed()
 
-    if liked_member in user_likes:
-        g.user.likes = [
-            like for like in user_likes if like != liked_member
-        ]
-    else:
-        g.user.likes.append(liked_member)
+    return redirect('/')
+
+
+def is_member_ref(member):
+    """A member id, or an object with the member's id and names"""
+
+    if isinstance(member, dict):
+        return all(isinstance(member.get(field), str)
+                   for field in ('id', 'first_name', 'last_name'))
+
+    return isinstance(member, str)
+
+
+@pages.route('/users/likes', methods=['POST'])
+def update_likes():
+    """Follow and unfollow many members in one transaction.
+
+    Takes JSON like `{"follow": [...], "unfollow": ["S000033", ...]}`, where
+    each entry to follow is a member id or an object with `id`,
+    `first_name` and `last_name`. Returns the number of follows changed.
+    """
+
+    if not account_exists():
+        return jsonify(error='Access unauthorized'), 401
+
+    data = request.get_json(silent=True)
+    follow = data.get('follow', []) if isinstance(data, dict) else None
+    unfollow = data.get('unfollow', []) if isinstance(data, dict) else None
+
+    if not (isinstance(follow, list) and isinstance(unfollow, list) and
+            all(map(is_member_ref, follow)) and
+            all(isinstance(m, str) for m in unfollow)):
+        return jsonify(error='Expected lists of members to follow and unfollow'), 400
+
+    unfollowed = Likes.unfollow(g.user.id, unfollow) if unfollow else 0
+    followed = Likes.follow(g.user.id, follow) if follow else 0
 
     db.session.commit()
-    return redirect('/')
+    identity_changed()
 
+    return jsonify(followed=followed, unfollowed=unfollowed)
 
-@app.route('/users/delete', methods=['POST'])
+
+@pages.route('/users/delete', methods=['POST'])
 def delete_user():
     """Delete user"""
 
-    if not g.user:
+    if not account_exists():
         flash("Access unauthorized", "danger")
         return redirect('/')
 
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(g.user.load())
     db.session.commit()
+    identity_cache.invalidate(g.user.id, g.user.version)
 
     return redirect('/signup')
 
 
-@app.route('/logout')
+@pages.route('/logout')
 def logout():
     """Handle user logout"""
 
@@ -200,7 +494,7 @@ def logout():
 # Homepage and error pages
 
 
-@app.route('/')
+@pages.route('/')
 def show_homepage():
     """Return Homepage
 
@@ -208,30 +502,14 @@ def show_homepage():
     - logged in: show last 10 history searches and favorites
     """
     if g.user:
-        username = g.user.username
-
-        govmembers = GovMembers.query.all()
-
-        liked_member_ids = [govmember.id for govmember in g.user.likes]
-
-        liked_member_name = [
-            member.first_name for member in govmembers if member in g.user.likes]
-
-        liked_member_last_name = [
-            member.last_name for member in govmembers if member in g.user.likes]
-
-        print(liked_member_ids)
-        print(liked_member_name)
-        print(liked_member_last_name)
-
-        return render_template('home.html', username=username, liked_member_ids=liked_member_ids,
-                               liked_member_name=liked_member_name, liked_member_last_name=liked_member_last_name)
+        return render_template('home.html', username=g.user.username,
+                               followed_members=g.user.followed_members())
 
     else:
         return render_template('homepage.html')
 
 
-@app.errorhandler(404)
+@pages.app_errorhandler(404)
 def page_not_found(e):
     """Return page not found if error"""
     return render_template('404.html'), 404
@@ -241,158 +519,733 @@ def page_not_found(e):
 # General search routes and specific item search routes
 
 
-@app.route('/search')
-def get_gov_official():
-    """Gather list of government officials"""
+def get_roster(chamber, **filters):
+    """Return members of `chamber` ('senate' or 'house') by last name.
+
+    Optional `party` / `state` filters are applied in the query. Members are
+    read from `govmembers`; until `flask sync-rosters` has loaded the chamber,
+    fall back to the cached upstream roster.
+    """
 
-    res = requests.get(ALL_MEMBERS,
-                       headers={'X-API-Key': key})
+    filters = {column: value.upper()
+               for column, value in filters.items() if value}
 
-    data = res.json()
+    members = (GovMembers.query
+               .filter_by(chamber=chamber, **filters)
+               .order_by(GovMembers.last_name, GovMembers.first_name)
+               .all())
 
-    id = [member['id'] for member in data['results'][0]['members']]
-    first_name = [member['first_name']
-                  for member in data['results'][0]['members']]
-    last_name = [member['last_name']
-                 for member in data['results'][0]['members']]
+    if members or GovMembers.query.filter_by(chamber=chamber).first():
+        return members
 
-    members = data['results'][0]['members']
+    members = roster_cache.get(f"roster:{chamber}",
+                               lambda: propublica.members(chamber))
 
-    if g.user:
-        liked_members_ids = [govmember.id for govmember in g.user.likes]
-        return render_template('search/gov-officials.html',
-                               members=members, liked_members_ids=liked_members_ids)
+    return [member for member in members
+            if all(member.get(column) == value
+                   for column, value in filters.items())]
+
+
+MEMBER_FIELDS = ('id', 'first_name', 'last_name', 'party', 'state', 'in_office')
 
-    return render_template('search/gov-officials.html', id=id, first_name=first_name, last_name=last_name, members=members)
 
+def member_to_dict(member):
+    """Plain view of a roster entry, from `govmembers` or the upstream roster"""
 
-@app.route('/search/congress')
+    if isinstance(member, dict):
+        return {field: member.get(field) for field in MEMBER_FIELDS}
+
+    return {field: getattr(member, field) for field in MEMBER_FIELDS}
+
+
+def roster_version(chamber):
+    """Changes whenever the chamber's synced rows do; None before the first sync"""
+
+    count, updated_at = (db.session.query(db.func.count(GovMembers.id),
+                                          db.func.max(GovMembers.updated_at))
+                         .filter_by(chamber=chamber)
+                         .one())
+
+    return f"{count}@{updated_at.isoformat()}" if count else None
+
+
+def search_members(query, limit=10):
+    """Members of either chamber whose id, names or state start with each
+    word of `query`, best matches first
+    """
+
+    def version():
+        # An unsynced chamber changes when its cached upstream roster does
+        return tuple(roster_version(chamber) or
+                     (roster_cache.backend.get(f"roster:{chamber}") or (None, None))[1]
+                     for chamber in ('senate', 'house'))
+
+    def load():
+        return [dict(member_to_dict(member), chamber=chamber)
+                for chamber in ('senate', 'house') for member in get_roster(chamber)]
+
+    return member_index.get(version, load).search(query, limit)
+
+
+def render_roster_rows(chamber, party=None, state=None):
+    """Table rows for a roster page, with the current user's follow stars.
+
+    The rows are rendered once per roster version and cached; see
+    `fragments.RosterRows`. On a miss they render as the template iterates
+    them, so a streamed page sends them as they are ready.
+    """
+
+    def load_members():
+        return [member_to_dict(member) for member in
+                get_roster(chamber, party=party, state=state)]
+
+    members = load_members
+    version = roster_version(chamber)
+
+    if version is None:
+        # Unsynced chambers come from the upstream roster cache; key on content
+        members = load_members()
+        version = hash(tuple(tuple(member.values()) for member in members))
+
+    return roster_fragments.rows(
+        (chamber, (party or '').upper(), (state or '').upper(), version),
+        members,
+        get_template_attribute('search/_roster.html', 'roster_row'),
+        g.user.liked_member_ids if g.user else None)
+
+
+@pages.route('/search')
+def get_gov_official():
+    """Gather list of government officials"""
+
+    roster_rows = render_roster_rows('senate',
+                                     party=request.args.get('party'),
+                                     state=request.args.get('state'))
+
+    return render_page('search/gov-officials.html', roster_rows=roster_rows)
+
+
+@pages.route('/search/congress')
 def get_congress_member():
     """Gather list of congress members"""
 
-    res = requests.get(f"{BASE_URL}116/house/members.json",
-                       headers={'X-API-Key': key})
+    roster_rows = render_roster_rows('house',
+                                     party=request.args.get('party'),
+                                     state=request.args.get('state'))
+
+    return render_page('search/congress.html', roster_rows=roster_rows)
 
-    data = res.json()
 
-    id = [member['id'] for member in data['results'][0]['members']]
-    first_name = [member['first_name']
-                  for member in data['results'][0]['members']]
-    last_name = [member['last_name']
-                 for member in data['results'][0]['members']]
+def vote_cursor(direction, key):
+    """Cursor to the synced votes `direction` ('before' or 'after') of `key`,
+    a `MemberVote.key`
+    """
 
-    members = data['results'][0]['members']
+    if key is None:
+        return None
 
-    govmembers = GovMembers.query.all()
+    voted_at, vote_key = key
+    return encode_cursor({direction: [voted_at.isoformat(), vote_key]})
 
-    if g.user:
-        liked_members_ids = [govmember.id for govmember in g.user.likes]
-        print(liked_members_ids)
-        return render_template('search/congress.html',
-                               members=members, liked_members_ids=liked_members_ids)
 
-    return render_template('search/congress.html',
-                           members=members)
+def cursor_vote_key(position, direction):
+    """The `MemberVote.key` a decoded cursor pages `direction` of, or None"""
 
+    try:
+        voted_at, vote_key = position[direction]
+        return datetime.fromisoformat(voted_at), vote_key
+    except (KeyError, TypeError, ValueError):
+        return None
 
-@app.route('/search/member/<member_id>')
-def get_member_info(member_id):
-    """Retrieve individual government official data on link click"""
 
-    response = requests.get(f"{BASE_URL}/members/{member_id}.json",
-                            headers={'X-API-Key': key})
+def is_synced(member_id):
+    """Whether the member's votes are served from `member_votes`: someone
+    follows them, so they are kept synced, and the first sync is done
+    """
+
+    followed = db.session.query(Likes.query.filter_by(item_id=member_id).exists()).scalar()
+    return followed and db.session.query(
+        GovMembers.votes_synced_through).filter_by(id=member_id).scalar() is not None
 
-    response_data = response.json()
-    member_contact_data = response_data['results'][0]
 
-    res_object = []
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    offset = page * 20
+def stored_votes_end(member_id):
+    """`(key, offset)`: the key of the member's oldest synced vote, and the
+    upstream offset to page on from past it, None if every vote they cast is
+    synced
+    """
 
-    res = requests.get(
-        f"{MEMBER_VOTE_POSITION_API}{member_id}/votes.json?offset={offset}", headers={'X-API-Key': key})
-    data = res.json()
-    res_object.append(data)
+    stored = MemberVote.query.filter_by(member_id=member_id)
+    oldest = stored.order_by(MemberVote.voted_at, MemberVote.vote_key).first()
+    if oldest is None:
+        return None, None
 
-    members_data = res_object
+    if db.session.query(GovMembers.votes_complete).filter_by(id=member_id).scalar():
+        return oldest.key, None
 
-    # if the results returned are equal 20, that is the limit, you set the total pagination to be offset + 20
-    if len(members_data[0]['results'][0]['votes']) == 20:
-        total = offset + 20
-    else:
-        # otherwise, set the total to be equal the current offset, so you don't have a next page
-        total = offset
+    # Votes cast since the last sync push the rest further down upstream;
+    # start early rather than skip any, and drop the ones already shown
+    count = stored.count()
+    return oldest.key, count - count % PAGE_SIZE
+
+
+def synced_votes_page(member_id, cursor):
+    """A `Page` of the member's synced votes at `cursor`, newest first, or
+    None unless their votes are synced, i.e. someone follows them.
+
+    A first sync stops after VOTE_SYNC_MAX_PAGES pages; past the oldest vote
+    stored then, pages go on from upstream.
+    """
 
-    pagination = Pagination(page=page, per_page=20, total=total,
-                            css_framework='bootstrap4', prev_label='Previous', next_label='Next')
+    if not is_synced(member_id):
+        return None
 
-    return render_template('search/officials_voting.html',
-                           members_data=members_data,
+    position = decode_cursor(cursor)
+    if 'offset' in position:
+        return older_votes_page(member_id, cursor_offset(position))
+
+    before = cursor_vote_key(position, 'before')
+    after = cursor_vote_key(position, 'after')
+
+    votes, newer, older = MemberVote.page(member_id, before=before, after=after)
+
+    if not (votes or before or after):
+        return None
+
+    older_cursor = vote_cursor('before', older)
+    if older is None or after is not None:
+        oldest, offset = stored_votes_end(member_id)
+        if not votes or votes[-1].key == oldest:
+            older_cursor = None if offset is None else offset_cursor(offset)
+
+    return Page([vote.to_dict() for vote in votes],
+                vote_cursor('after', newer), older_cursor)
+
+
+def older_votes_page(member_id, offset):
+    """A `Page` of the member's votes from upstream at `offset`, less the
+    ones synced
+    """
+
+    page = upstream_votes_page(member_id, offset_cursor(offset))
+    oldest, first_offset = stored_votes_end(member_id)
+    if oldest is None:
+        return page
+
+    votes = [vote for vote in page.items if member_vote_key(vote) < oldest]
+
+    prev_cursor = page.prev_cursor
+    if first_offset is None or offset <= first_offset:
+        # Back to the last page of synced votes, ending at the oldest
+        prev_cursor = vote_cursor('after', (oldest[0], ''))
+
+    return Page(votes, prev_cursor, page.next_cursor)
+
+
+def upstream_error_status(error):
+    """Status for a failed upstream call: 404 only if upstream has no such
+    record, 503 over the upstream budget, 504 if it took too long, else 502
+    """
+
+    if isinstance(error, NotFound):
+        return 404
+    if isinstance(error, QuotaExhausted):
+        return 503
+    if isinstance(error, UpstreamTimeout):
+        return 504
+    return 502
+
+
+def member_detail(member_id):
+    """Biographical and contact data for a member, cached for paging"""
+
+    return page_cache.get(f"member:{member_id}",
+                          lambda: propublica.member(member_id))
+
+
+def upstream_votes_page(member_id, cursor):
+    """A `Page` of the member's most recent votes from upstream"""
+
+    return pager.page(f"votes:{member_id}",
+                      lambda offset: propublica.member_votes(member_id, offset=offset),
+                      cursor)
+
+
+@pages.route('/search/member/<member_id>')
+def get_member_info(member_id):
+    """Retrieve individual government official data on link click.
+
+    The page goes out once the member's details are in; their votes load
+    as the template reaches them (see `DeferredPage`).
+    """
+
+    cursor = request.args.get('cursor')
+
+    # Followed members' votes are synced locally; page through them by key
+    if is_synced(member_id):
+        try:
+            member_contact_data = member_detail(member_id)
+        except ProPublicaError as e:
+            current_app.logger.warning('Member %s unavailable: %s', member_id, e)
+            abort(upstream_error_status(e))
+
+        return render_page('search/officials_voting.html',
+                           page=DeferredPage(
+                               lambda: synced_votes_page(member_id, cursor) or Page([]),
+                               errors=ProPublicaError),
                            member_id=member_id,
                            member_contact_data=member_contact_data,
-                           res_object=res_object,
-                           pagination=pagination
+                           vote_stats=MemberVoteStats.query.get(member_id),
+                           party_line_min_voters=MIN_PARTY_VOTERS
                            )
 
+    # Don't hold a pooled connection while waiting on upstream; under gevent
+    # far more requests wait at once than the pool has connections
+    db.session.close()
+
+    # Contact data and vote history are independent; fetch them side by side
+    timeout = current_app.config['PROPUBLICA_FANOUT_TIMEOUT']
+    deadline = time.monotonic() + timeout
+    votes = propublica.submit(lambda: upstream_votes_page(member_id, cursor))
+
+    results, errors = propublica.gather({
+        'member': lambda: member_detail(member_id),
+    }, timeout=timeout)
 
-@app.route('/search/bill')
+    if 'member' in errors:
+        votes.cancel()
+        current_app.logger.warning('Member %s unavailable: %s',
+                           member_id, errors['member'])
+        abort(upstream_error_status(errors['member']))
+
+    return render_page('search/officials_voting.html',
+                       page=DeferredPage(
+                           lambda: propublica.result(votes, max(0, deadline - time.monotonic())),
+                           errors=ProPublicaError),
+                       member_id=member_id,
+                       member_contact_data=results['member'],
+                       vote_stats=None
+                       )
+
+
+def search_bills(search_term, cursor=None):
+    """A `Page` of bills matching `search_term`, most relevant first"""
+
+    # Search the local index first; only terms that match no ingested bill go upstream
+    offset = cursor_offset(decode_cursor(cursor))
+    bills = Bill.search(search_term, offset=offset, limit=PAGE_SIZE + 1)
+
+    if bills or (offset and Bill.search(search_term, limit=1)):
+        # a 21st row means there is at least one more page
+        return Page.at_offset([bill.payload for bill in bills[:PAGE_SIZE]],
+                              offset, len(bills) > PAGE_SIZE)
+
+    return pager.page(f"bills:{search_term}",
+                      lambda offset: propublica.search_bills(search_term, offset=offset),
+                      cursor)
+
+
+def member_agreement(member_id):
+    """The current `Agreement`; 404 unless `member_id` has synced votes"""
+
+    agreement = agreement_matrix.get()
+    if member_id not in agreement:
+        abort(404)
+
+    return agreement
+
+
+def similar_members(agreement, member_id, least=False, limit=10):
+    """Plain view of `Agreement.similar`, with names"""
+
+    similar = agreement.similar(member_id, limit=limit, least=least,
+                                min_shared=current_app.config['AGREEMENT_MIN_SHARED'])
+    members = {member.id: member for member in
+               GovMembers.query.filter(GovMembers.id.in_([other for other, *_ in similar]))}
+
+    return [{'id': other,
+             'first_name': getattr(members.get(other), 'first_name', None),
+             'last_name': getattr(members.get(other), 'last_name', None),
+             'agreed': agreed,
+             'shared': shared,
+             'agreement': agreed / shared}
+            for other, agreed, shared in similar]
+
+
+@pages.route('/compare/<member_a>')
+@pages.route('/compare/<member_a>/<member_b>')
+def compare_members(member_a, member_b=None):
+    """How often two members vote together, and who votes most and least
+    like the first
+    """
+
+    agreement = member_agreement(member_a)
+
+    pair = None
+    if member_b is not None:
+        pair = agreement.between(member_a, member_b)
+        if pair is None:
+            abort(404)
+
+    members = {member.id: member for member in
+               GovMembers.query.filter(GovMembers.id.in_(
+                   [member_id for member_id in (member_a, member_b) if member_id]))}
+
+    return render_page('search/compare.html',
+                       member_a=members.get(member_a),
+                       member_b=members.get(member_b),
+                       member_a_id=member_a,
+                       member_b_id=member_b,
+                       pair=pair,
+                       most_similar=similar_members(agreement, member_a),
+                       least_similar=similar_members(agreement, member_a, least=True))
+
+
+@pages.route('/search/bill')
 def get_bill_info():
     """Retrieve all bill information"""
 
     search_term = request.args['search-form-input']
-    parsed_search_term = quote(search_term)
 
-    res_object = []
-    page = request.args.get(get_page_parameter(), type=int, default=1)
-    offset = page * 20
+    try:
+        page = search_bills(search_term, request.args.get('cursor'))
+    except ProPublicaError as e:
+        abort(upstream_error_status(e))
 
-    res = requests.get(f"{BILL_API}?query=\"{parsed_search_term}\"&offset={offset}", headers={
-        'X-API-key': key})
-    data = res.json()
-    res_object.append(data)
+    return render_template('search/bill-voting.html', bill_data=page.items,
+                           page=page, search_term=search_term)
 
-    search_results = data['results']
-    bill_data = data['results'][0]['bills']
 
-    search_data = res_object
+# Nominations that have been decided or sent back
+FINAL_NOMINATION_STATUSES = {'Confirmed', 'Withdrawn', 'Returned', 'Failed'}
 
-    if len(search_data[0]['results'][0]['bills']) == 20:
-        total = offset + 20
-    else:
-        # otherwise, set the total to be equal the current offset, so you don't have a next page
-        total = offset
 
-    pagination = Pagination(page=page, per_page=20, total=total,
-                            css_framework='bootstrap4', prev_label='Previous', next_label='Next')
+def detail_is_final(kind, data):
+    """True once a bill or nomination can no longer change: enacted, vetoed
+    or failed bills, bills of past congresses, and decided nominations
+    """
 
-    return render_template('search/bill-voting.html', bill_data=bill_data, search_results=search_results, search_data=search_data, pagination=pagination)
+    if kind == 'nomination':
+        return data.get('status') in FINAL_NOMINATION_STATUSES
 
+    if data.get('enacted') or data.get('vetoed'):
+        return True
 
-@app.route('/search/bill/<bill_id>')
-def get_bill_by_id(bill_id):
-    """Retrieve individually selected bill"""
+    if 'failed of passage' in (data.get('latest_major_action') or '').lower():
+        return True
 
     try:
-        id_no = bill_id.split('-')[0]
-        congress_no = bill_id.split('-')[1]
+        return int(data.get('congress')) < CURRENT_CONGRESS
+    except (TypeError, ValueError):
+        return False
+
+
+def detail_ttl(active, final):
+    """`detail_cache` TTL: `final` seconds for details that can no longer
+    change, `active` for the rest
+    """
+
+    return lambda entry: final if detail_is_final(*entry) else active
+
+
+def get_bill_or_nomination(bill_id):
+    """Return `('nomination', data)` for ids like 'pn1-116', else `('bill', data)`"""
+
+    id_no, congress_no = bill_id.split('-')[:2]
+
+    def load():
         if bill_id[0] == "p":
-            id_no = bill_id.split('-')[0].upper()
+            return ['nomination', propublica.nominee(id_no.upper(), congress_no)]
 
-            res = requests.get(
-                f"{BASE_URL}{congress_no}/nominees/{id_no}.json", headers={'X-API-Key': key})
+        return ['bill', propublica.bill(id_no, congress_no)]
 
-            data = res.json()
-            nomination_data = data['results'][0]
+    kind, data = detail_cache.get(f"detail:{id_no.lower()}-{congress_no}", load)
+    return kind, data
 
-            return render_template("search/nomination.html", nomination_data=nomination_data)
 
-        else:
-            res = requests.get(
-                f"{BASE_URL}{congress_no}/bills/{id_no}.json", headers={'X-API-Key': key})
+@pages.route('/search/bill/<bill_id>')
+def get_bill_by_id(bill_id):
+    """Retrieve individually selected bill"""
+
+    try:
+        kind, data = get_bill_or_nomination(bill_id)
 
-            data = res.json()
-            bill_data = data['results'][0]
+        if kind == 'nomination':
+            return render_template("search/nomination.html", nomination_data=data)
 
-            return render_template('search/individual-bill.html', bill_data=bill_data)
+        else:
+            return render_template('search/individual-bill.html', bill_data=data)
     except:
         return render_template('404.html')
+
+
+# *****************************************************
+# JSON API, mounted at /api/v1
+
+
+def encode_api_payload(payload):
+    """Serialize `payload` and derive its strong ETag"""
+
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return body, hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def api_response(body, etag):
+    """JSON response that answers a matching If-None-Match with 304"""
+
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['API_MAX_AGE']
+
+    return response.make_conditional(request)
+
+
+def cached_api_response(cache_key, build):
+    """Serve `build()`'s payload from `api_cache`, serializing it once per refresh"""
+
+    app = current_app._get_current_object()
+
+    def load():
+        with app.app_context():
+            return encode_api_payload(build())
+
+    body, etag = api_cache.get(cache_key, load)
+    return api_response(body, etag)
+
+
+@mod.route('/rosters/<chamber>')
+def api_roster(chamber):
+    """Members of 'senate' or 'house', filtered by ?party= and ?state="""
+
+    if chamber not in ('senate', 'house'):
+        abort(404)
+
+    party = request.args.get('party', '').upper()
+    state = request.args.get('state', '').upper()
+
+    def build():
+        members = get_roster(chamber, party=party, state=state)
+        return {'chamber': chamber,
+                'members': [member_to_dict(member) for member in members]}
+
+    try:
+        return cached_api_response(f"roster:{chamber}:{party}:{state}", build)
+    except ProPublicaError as e:
+        # An unsynced chamber's roster comes from upstream
+        current_app.logger.warning('Roster of %s unavailable: %s', chamber, e)
+        abort(503)
+
+
+@mod.route('/members/search')
+def api_member_search():
+    """Members matching ?q= as it is typed, best first; at most ?limit= (10)"""
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify(error='Missing search term ?q='), 400
+
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+    try:
+        members = search_members(query, limit)
+    except ProPublicaError as e:
+        current_app.logger.warning('Member search unavailable: %s', e)
+        abort(503)
+
+    return api_response(*encode_api_payload({
+        'q': query,
+        'members': members,
+    }))
+
+
+@mod.route('/members/<member_id>/votes')
+def api_member_votes(member_id):
+    """A page of the member's votes, newest first.
+
+    Page with the `newer` / `older` cursors as ?cursor=; either is null at
+    that end.
+    """
+
+    cursor = request.args.get('cursor')
+
+    try:
+        page = synced_votes_page(member_id, cursor)
+        if page is None:
+            page = upstream_votes_page(member_id, cursor)
+    except ProPublicaError as e:
+        abort(upstream_error_status(e))
+
+    return api_response(*encode_api_payload({
+        'member_id': member_id,
+        'votes': page.items,
+        'newer': page.prev_cursor,
+        'older': page.next_cursor,
+    }))
+
+
+@mod.route('/members/<member_id>/similar')
+def api_similar_members(member_id):
+    """Members who vote most like `member_id`, or least with ?order=least;
+    at most ?limit= (10)
+    """
+
+    least = request.args.get('order') == 'least'
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+
+    return api_response(*encode_api_payload({
+        'member_id': member_id,
+        'order': 'least' if least else 'most',
+        'members': similar_members(member_agreement(member_id), member_id,
+                                   least=least, limit=limit),
+    }))
+
+
+@mod.route('/members/<member_a>/agreement/<member_b>')
+def api_member_agreement(member_a, member_b):
+    """Yes / no votes two members share, and how many they agreed on"""
+
+    pair = member_agreement(member_a).between(member_a, member_b)
+    if pair is None:
+        abort(404)
+
+    agreed, shared = pair
+    return api_response(*encode_api_payload({
+        'members': [member_a, member_b],
+        'agreed': agreed,
+        'shared': shared,
+        'agreement': agreed / shared if shared else None,
+    }))
+
+
+@mod.route('/bills/search')
+def api_bill_search():
+    """A page of bills matching ?q=, most relevant first.
+
+    Page with the `prev` / `next` cursors as ?cursor=.
+    """
+
+    search_term = request.args.get('q', '').strip()
+    if not search_term:
+        return jsonify(error='Missing search term ?q='), 400
+
+    try:
+        page = search_bills(search_term, request.args.get('cursor'))
+    except ProPublicaError as e:
+        abort(upstream_error_status(e))
+
+    return api_response(*encode_api_payload({
+        'q': search_term,
+        'bills': page.items,
+        'prev': page.prev_cursor,
+        'next': page.next_cursor,
+    }))
+
+
+@mod.route('/bills/<bill_id>')
+def api_bill(bill_id):
+    """A bill, or a nomination for ids like 'pn1-116'"""
+
+    def build():
+        kind, data = get_bill_or_nomination(bill_id)
+        return {'kind': kind, kind: data}
+
+    try:
+        return cached_api_response(f"bill:{bill_id}", build)
+    except ProPublicaError as e:
+        abort(upstream_error_status(e))
+    except ValueError:
+        abort(404)
+
+
+@mod.errorhandler(404)
+def api_not_found(e):
+    return jsonify(error='Not found'), 404
+
+
+@mod.errorhandler(503)
+def api_unavailable(e):
+    return jsonify(error='Unavailable right now, please try again shortly'), 503
+
+
+@mod.errorhandler(502)
+def api_bad_gateway(e):
+    return jsonify(error='Upstream request failed'), 502
+
+
+@mod.errorhandler(504)
+def api_gateway_timeout(e):
+    return jsonify(error='Upstream did not answer in time'), 504
+
+
+# *****************************************************
+# CLI commands
+
+
+@contextmanager
+def batch_job():
+    """Run a CLI job's queries on the primary, without a statement timeout"""
+
+    use_primary()
+    with statement_timeout(0):
+        yield
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create any missing tables and bring existing ones up to date"""
+
+    with batch_job():
+        upgrade_schema()
+    print("Created and upgraded tables")
+
+
+@click.command('sync-rosters')
+@with_appcontext
+def sync_rosters_command():
+    """Load the full senate and house rosters into govmembers"""
+
+    with batch_job(), background():
+        count = sync_rosters(propublica)
+    print(f"Synced {count} members")
+
+
+@click.command('load-bills')
+@with_appcontext
+@click.option('--pages', type=int, default=50,
+              help='Pages of 20 bills to load per list.')
+def load_bills_command(pages):
+    """Index recently introduced and updated bills for local search"""
+
+    with batch_job(), background():
+        count = load_bills(propublica, max_pages=pages)
+    print(f"Indexed {count} bills")
+
+
+@click.command('sync-votes')
+@with_appcontext
+@click.option('--every', type=int, default=None,
+              help='Keep running, syncing every N seconds.')
+def sync_votes_command(every):
+    """Load new votes for every followed member into member_votes"""
+
+    max_pages = current_app.config['VOTE_SYNC_MAX_PAGES']
+
+    with batch_job(), background():
+        if every:
+            run_vote_sync_worker(propublica, every, max_pages=max_pages)
+        else:
+            count = sync_followed_votes(propublica, max_pages=max_pages)
+            print(f"Synced {count} votes")
+
+
+@click.command('refresh-stats')
+@with_appcontext
+@click.option('--full', is_flag=True,
+              help='Recompute every member, not just those with new votes.')
+def refresh_stats_command(full):
+    """Recompute member_vote_stats from member_votes"""
+
+    with batch_job():
+        count = refresh_vote_stats(full=full)
+    print(f"Refreshed stats for {count} members")
@@ -0,0 +1,157 @@
+"""Concurrent-connection capacity per worker, sync vs gevent
+
+Serves the app from one gunicorn worker of each class in turn, against the
+offline ProPublica stand-in with `--latency` seconds per upstream call, and
+drives the upstream-bound search routes from an increasing number of
+concurrent clients. A worker's capacity is the most concurrent clients it
+served with p95 latency under `--slo-ms` and no errors.
+
+run it from the repo root like:
+    python -m benchmarks.bench_async
+    python -m benchmarks.bench_async --levels 1 10 50 100 --latency 0.3
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+import requests
+from faker import Faker
+
+from benchmarks.load_test import HttpClient, anon_get, run_scenario, seed
+from benchmarks.mock_propublica import Fixtures, create_mock_app, serve_in_thread
+from pagination import PAGE_SIZE, offset_cursor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECOND_PAGE = offset_cursor(PAGE_SIZE)
+
+# Routes that spend their time waiting on upstream
+SCENARIOS = [
+    ('member (upstream)', anon_get(
+        lambda w: f"/search/member/{w.member()['id']}?cursor={SECOND_PAGE}")),
+    ('bill detail', anon_get(
+        lambda w: f"/search/bill/{w.rand.choice(w.seeded['bills'])}")),
+    ('nomination', anon_get(
+        lambda w: f"/search/bill/pn{w.rand.randrange(1, 5000)}-116")),
+]
+
+
+class Visitor:
+    """An anonymous client; all the scenarios above need"""
+
+    def __init__(self, url, seeded, rand):
+        self.anon = HttpClient(url)
+        self.seeded = seeded
+        self.rand = rand
+
+    def member(self):
+        return self.rand.choice(self.seeded['members'])
+
+
+def start_server(worker_class, port, env):
+    """Start one gunicorn worker of `worker_class`; return the process"""
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'wsgi:app'], cwd=ROOT,
+        env=dict(env, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY='1',
+                 PORT=str(port)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    server.terminate()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='postgresql:///voter-bench')
+    parser.add_argument('--workers', nargs='+', default=['sync', 'gevent'],
+                        help='gunicorn worker classes to compare.')
+    parser.add_argument('--levels', type=int, nargs='+',
+                        default=[1, 4, 16, 32, 64],
+                        help='Numbers of concurrent clients to try.')
+    parser.add_argument('--requests', type=int, default=4,
+                        help='Requests per client per level.')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Stand-in upstream latency, in seconds.')
+    parser.add_argument('--slo-ms', type=float, default=1000.0)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mock = create_mock_app(Fixtures(seed=args.seed), latency=args.latency,
+                           seed=args.seed)
+    mock_server, upstream = serve_in_thread(mock)
+
+    env = dict(os.environ, PROPUBLICA_BASE_URL=upstream,
+               DATABASE_URL=args.database)
+    env.setdefault('PROPUBLICA_API_KEY', 'offline')
+    # Measure the workers, not the upstream budget
+    env.setdefault('PROPUBLICA_RATE_LIMIT', '0')
+    env.setdefault('PROPUBLICA_DAILY_LIMIT', '0')
+    # and every page view waiting on upstream, not the page cache
+    env.setdefault('PAGE_CACHE_TTL', '0')
+    env.setdefault('GUNICORN_WORKER_CONNECTIONS', str(max(args.levels) * 2))
+    os.environ.update(env)
+
+    from app import create_app, propublica
+
+    app = create_app({'SQLALCHEMY_ECHO': False})
+    rand = random.Random(args.seed)
+    fake = Faker()
+    fake.seed_instance(args.seed)
+
+    with app.app_context():
+        seeded = seed(propublica, users=1, max_follows=0, vote_pages=0,
+                      bill_pages=5, fake=fake, rand=rand)
+
+    print(f"upstream latency {args.latency * 1000:.0f} ms, one worker each\n")
+    print(f"{'worker':<8} {'clients':>7} {'p50':>8} {'p95':>8} {'req/s':>8} errors")
+
+    capacity = {}
+    for worker_class in args.workers:
+        server = start_server(worker_class, args.port, env)
+        url = f"http://127.0.0.1:{args.port}"
+        capacity[worker_class] = 0
+
+        try:
+            for level in args.levels:
+                visitors = [Visitor(url, seeded, random.Random(rand.random()))
+                            for _ in range(level)]
+                totals = [run_scenario(visitors, scenario,
+                                       level * args.requests)
+                          for label, scenario in SCENARIOS]
+
+                p50 = max(total['p50_ms'] for total in totals)
+                p95 = max(total['p95_ms'] for total in totals)
+                rps = sum(total['rps'] for total in totals) / len(totals)
+                errors = sum(total['errors'] for total in totals)
+                print(f"{worker_class:<8} {level:>7} {p50:8.1f} {p95:8.1f} "
+                      f"{rps:8.1f} {errors}")
+
+                if p95 > args.slo_ms or errors:
+                    break
+                capacity[worker_class] = level
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"\nconcurrent clients per worker with p95 under {args.slo_ms:.0f} ms:")
+    for worker_class, clients in capacity.items():
+        print(f"  {worker_class:<8} {clients}")
+
+    mock_server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Homepage regression benchmark
+
+Seeds `govmembers` and `likes` at increasing sizes and times the logged-in
+homepage for a user who follows a handful of members. The page should cost
+the same no matter how many rows other users have created.
+
+run it from the repo root like:
+    python -m benchmarks.bench_homepage
+    python -m benchmarks.bench_homepage --sizes 1000 100000 300000 --max-ratio 2
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from faker import Faker
+from sqlalchemy.dialects.postgresql import insert
+
+from app import create_app, CURR_USER_KEY
+from models import db, User, GovMembers, Likes
+
+BATCH = 5000
+FOLLOWED = 10
+
+
+def insert_batches(table, rows):
+    for start in range(0, len(rows), BATCH):
+        db.session.execute(insert(table).values(rows[start:start + BATCH])
+                           .on_conflict_do_nothing())
+    db.session.commit()
+
+
+def seed(size, fake):
+    """Fill the tables with `size` members and `size` likes from other users"""
+
+    db.drop_all()
+    db.create_all()
+
+    members = [{'id': f"M{n:07d}", 'first_name': fake.first_name(),
+                'last_name': fake.last_name()} for n in range(size)]
+    insert_batches(GovMembers.__table__, members)
+
+    users = [{'id': n, 'email': f"user{n}@example.com",
+              'username': f"user{n}", 'password': 'not-a-hash'}
+             for n in range(1, size // 10 + 2)]
+    insert_batches(User.__table__, users)
+
+    likes = [{'user_id': random.randrange(2, len(users) + 1),
+              'item_id': f"M{random.randrange(size):07d}"}
+             for _ in range(size)]
+    likes += [{'user_id': 1, 'item_id': f"M{n:07d}"}
+              for n in random.sample(range(size), FOLLOWED)]
+    insert_batches(Likes.__table__, likes)
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def time_homepage(app, requests):
+    """Median seconds per logged-in GET / over `requests` requests"""
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = 1
+
+    client.get('/')
+    timings = []
+
+    for _ in range(requests):
+        start = time.perf_counter()
+        res = client.get('/')
+        timings.append(time.perf_counter() - start)
+        assert res.status_code == 200
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='postgresql:///voter-bench')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--max-ratio', type=float, default=2.0,
+                        help='Fail if the largest size is this much slower '
+                             'than the smallest.')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database,
+                      'SQLALCHEMY_ECHO': False,
+                      'WTF_CSRF_ENABLED': False})
+
+    random.seed(0)
+    fake = Faker()
+    results = []
+
+    for size in args.sizes:
+        seed(size, fake)
+        median = time_homepage(app, args.requests)
+        results.append(median)
+        print(f"{size:>9} rows  {median * 1000:8.2f} ms")
+
+    ratio = results[-1] / results[0]
+    print(f"largest / smallest: {ratio:.2f}x")
+
+    return 0 if ratio <= args.max_ratio else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,442 @@
+"""End-to-end load test of every route
+
+Seeds the database from the offline ProPublica stand-in
+(benchmarks.mock_propublica) plus Faker users who follow random members,
+then drives each route from `--concurrency` threads and reports p50, p95
+and p99 latency and throughput per route. Results can be saved as a
+baseline and later runs compared against it.
+
+run it from the repo root like:
+    python -m benchmarks.load_test --save before
+    python -m benchmarks.load_test --compare before --max-regression 1.25
+    python -m benchmarks.load_test --routes /search --latency 0.1 --error-rate 0.02
+
+By default the app runs in-process. To load a running server instead, point
+it and this script at the same database and stand-in, and pass its URL:
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 \\
+        --upstream http://127.0.0.1:5001/congress/v1/
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+from faker import Faker
+from sqlalchemy.dialects.postgresql import insert
+
+from benchmarks.mock_propublica import Fixtures, create_mock_app, serve_in_thread
+from pagination import PAGE_SIZE, offset_cursor
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+PASSWORD = 'load-test-password'
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+SECOND_PAGE = offset_cursor(PAGE_SIZE)
+
+
+class AppClient:
+    """Requests against the app in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json=None):
+        res = self.client.open(path, method=method, data=data, json=json)
+        return res.status_code, res.get_data(as_text=True)
+
+
+class HttpClient:
+    """Requests against a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, json=None):
+        res = self.session.request(method, f"{self.base_url}{path}", data=data,
+                                   json=json, allow_redirects=False)
+        return res.status_code, res.text
+
+
+class Worker:
+    """One simulated visitor: an anonymous client, a client logged in as a
+    seeded user, and a scratch client for routes that log in or out.
+    """
+
+    def __init__(self, make_client, seeded, rand):
+        self.seeded = seeded
+        self.rand = rand
+        self.fake = Faker()
+        self.fake.seed_instance(rand.random())
+        self.username = rand.choice(seeded['usernames'])
+
+        self.anon = make_client()
+        self.scratch = make_client()
+        self.user = make_client()
+        self.submit(self.user, '/login', self.credentials())
+
+    def credentials(self):
+        return {'username': self.username, 'password': PASSWORD}
+
+    def form(self, client, path, fields):
+        """GET the form at `path` and return `fields` with its CSRF token"""
+
+        status, body = client.request('GET', path)
+        match = CSRF_INPUT.search(body)
+        return dict(fields, csrf_token=match.group(1)) if match else fields
+
+    def submit(self, client, path, fields):
+        return client.request('POST', path, data=self.form(client, path, fields))
+
+    def new_user(self):
+        name = f"{self.fake.user_name()}{self.rand.randrange(10 ** 9)}"
+        return {'email': f"{name}@example.com", 'username': name,
+                'password': PASSWORD}
+
+    def member(self):
+        return self.rand.choice(self.seeded['members'])
+
+
+# Each scenario does any untimed setup, then returns the request to time as
+# (client, method, path, options). Labels are what the report groups by.
+
+def anon_get(path):
+    return lambda w: (w.anon, 'GET', path(w) if callable(path) else path, {})
+
+
+def user_get(path):
+    return lambda w: (w.user, 'GET', path(w) if callable(path) else path, {})
+
+
+def post_signup(w):
+    w.scratch.request('GET', '/logout')
+    return w.scratch, 'POST', '/signup', {
+        'data': w.form(w.scratch, '/signup', w.new_user())}
+
+
+def post_login(w):
+    w.scratch.request('GET', '/logout')
+    return w.scratch, 'POST', '/login', {
+        'data': w.form(w.scratch, '/login', w.credentials())}
+
+
+def get_logout(w):
+    w.submit(w.scratch, '/login', w.credentials())
+    return w.scratch, 'GET', '/logout', {}
+
+
+def follow(w):
+    member = w.member()
+    return w.user, 'GET', (f"/users/like?member_id={member['id']}"
+                           f"&first_name={member['first_name']}"
+                           f"&last_name={member['last_name']}"), {}
+
+
+def toggle_follow(w):
+    return w.user, 'GET', f"/users/like/{w.member()['id']}/delete", {}
+
+
+def update_likes(w):
+    members = w.rand.sample(w.seeded['members'], 4)
+    return w.user, 'POST', '/users/likes', {'json': {
+        'follow': [m['id'] for m in members[:2]],
+        'unfollow': [m['id'] for m in members[2:]],
+    }}
+
+
+def delete_user(w):
+    w.scratch.request('GET', '/logout')
+    w.submit(w.scratch, '/signup', w.new_user())
+    return w.scratch, 'POST', '/users/delete', {}
+
+
+def followed_pair(w):
+    return w.rand.sample(w.seeded['followed'], 2)
+
+
+def search_term(w):
+    return w.rand.choice(('health', 'energy', 'education', 'taxation',
+                          'ballot', 'human rights'))
+
+
+SCENARIOS = [
+    ('GET /', anon_get('/')),
+    ('GET / (logged in)', user_get('/')),
+    ('GET /signup', anon_get('/signup')),
+    ('POST /signup', post_signup),
+    ('GET /login', anon_get('/login')),
+    ('POST /login', post_login),
+    ('GET /logout', get_logout),
+    ('GET /search', anon_get('/search')),
+    ('GET /search (logged in)', user_get('/search')),
+    ('GET /search/congress', anon_get('/search/congress')),
+    ('GET /search/congress (logged in)', user_get('/search/congress')),
+    ('GET /search/member/<id> (synced)', anon_get(
+        lambda w: f"/search/member/{w.rand.choice(w.seeded['followed'])}")),
+    ('GET /search/member/<id> (upstream)', anon_get(
+        lambda w: f"/search/member/{w.member()['id']}?cursor={SECOND_PAGE}")),
+    ('GET /compare/<a>', anon_get(
+        lambda w: f"/compare/{w.rand.choice(w.seeded['followed'])}")),
+    ('GET /compare/<a>/<b>', anon_get(
+        lambda w: "/compare/{}/{}".format(*followed_pair(w)))),
+    ('GET /search/bill', anon_get(
+        lambda w: f"/search/bill?search-form-input={search_term(w)}")),
+    ('GET /search/bill/<bill_id>', anon_get(
+        lambda w: f"/search/bill/{w.rand.choice(w.seeded['bills'])}")),
+    ('GET /search/bill/<nomination_id>', anon_get(
+        lambda w: f"/search/bill/pn{w.rand.randrange(1, 2000)}-116")),
+    ('GET /users/like', follow),
+    ('GET /users/like/<id>/delete', toggle_follow),
+    ('POST /users/likes', update_likes),
+    ('POST /users/delete', delete_user),
+    ('GET <404>', anon_get('/no-such-page')),
+    ('GET /api/v1/rosters/<chamber>', anon_get(
+        lambda w: f"/api/v1/rosters/{w.rand.choice(('senate', 'house'))}")),
+    ('GET /api/v1/members/search', anon_get(
+        lambda w: f"/api/v1/members/search?q={w.member()['last_name'][:3]}")),
+    ('GET /api/v1/members/<id>/votes', anon_get(
+        lambda w: f"/api/v1/members/{w.rand.choice(w.seeded['followed'])}/votes")),
+    ('GET /api/v1/members/<id>/similar', anon_get(
+        lambda w: f"/api/v1/members/{w.rand.choice(w.seeded['followed'])}/similar")),
+    ('GET /api/v1/members/<a>/agreement/<b>', anon_get(
+        lambda w: "/api/v1/members/{}/agreement/{}".format(*followed_pair(w)))),
+    ('GET /api/v1/bills/search', anon_get(
+        lambda w: f"/api/v1/bills/search?q={search_term(w)}")),
+    ('GET /api/v1/bills/<bill_id>', anon_get(
+        lambda w: f"/api/v1/bills/{w.rand.choice(w.seeded['bills'])}")),
+]
+
+
+def seed(propublica, users, max_follows, vote_pages, bill_pages, fake, rand):
+    """Load rosters, bills and followed members' votes from the stand-in and
+    create `users` synthetic users. Returns ids the scenarios pick from.
+    """
+
+    from hashing import hasher
+    from models import db, User, Likes, GovMembers
+    from sync import sync_rosters, sync_followed_votes, load_bills
+
+    db.drop_all()
+    db.create_all()
+
+    sync_rosters(propublica)
+    load_bills(propublica, max_pages=bill_pages)
+
+    members = [{'id': m.id, 'first_name': m.first_name, 'last_name': m.last_name}
+               for m in GovMembers.query.all()]
+    member_ids = [m['id'] for m in members]
+
+    # One hash for everyone: seeding should not take users * 250ms
+    password = hasher.generate_password_hash(PASSWORD)
+    usernames = [f"{fake.user_name()}{n}" for n in range(users)]
+    db.session.execute(insert(User.__table__).values([
+        {'email': f"{name}@example.com", 'username': name, 'password': password}
+        for name in usernames
+    ]))
+
+    user_ids = [user.id for user in User.query.all()]
+    likes = [{'user_id': user_id, 'item_id': item_id}
+             for user_id in user_ids
+             for item_id in rand.sample(member_ids, rand.randint(0, max_follows))]
+    if likes:
+        db.session.execute(insert(Likes.__table__).values(likes)
+                           .on_conflict_do_nothing())
+    db.session.commit()
+
+    sync_followed_votes(propublica, max_pages=vote_pages)
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+    return {
+        'usernames': usernames,
+        'members': members,
+        'followed': sorted({like['item_id'] for like in likes}) or member_ids,
+        'bills': [bill_id for (bill_id,) in
+                  db.session.execute('SELECT bill_id FROM bills')],
+    }
+
+
+def percentile(timings, q):
+    return statistics.quantiles(timings, n=100, method='inclusive')[q - 1]
+
+
+def run_scenario(workers, scenario, requests_per_route, expected=()):
+    """Time `requests_per_route` requests spread over `workers` threads.
+
+    Responses with a 4xx or 5xx status not in `expected` count as errors.
+    """
+
+    timings = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(requests_per_route))
+
+    def drive(worker):
+        nonlocal errors
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+
+            client, method, path, options = scenario(worker)
+            start = time.perf_counter()
+            status, body = client.request(method, path, **options)
+            took = time.perf_counter() - start
+
+            with lock:
+                timings.append(took)
+                if status >= 400 and status not in expected:
+                    errors += 1
+
+    threads = [threading.Thread(target=drive, args=(worker,))
+               for worker in workers]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'rps': len(timings) / elapsed,
+    }
+
+
+def compare(results, baseline, max_regression, noise_ms):
+    """Routes whose p95 regressed beyond `max_regression` times the baseline"""
+
+    regressed = []
+    for label, result in results.items():
+        before = baseline['routes'].get(label)
+        if before is None:
+            continue
+
+        ratio = result['p95_ms'] / max(before['p95_ms'], 1e-9)
+        marker = ''
+        if (ratio > max_regression and
+                result['p95_ms'] - before['p95_ms'] > noise_ms):
+            regressed.append(label)
+            marker = '  REGRESSED'
+
+        print(f"{label:<40} p95 {before['p95_ms']:8.2f} -> "
+              f"{result['p95_ms']:8.2f} ms  ({ratio:.2f}x){marker}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='postgresql:///voter-bench')
+    parser.add_argument('--url', help='Load a running server instead.')
+    parser.add_argument('--upstream',
+                        help='API root of an already running stand-in.')
+    parser.add_argument('--routes', nargs='*', default=[],
+                        help='Only run routes whose label contains one of these.')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--max-follows', type=int, default=15)
+    parser.add_argument('--vote-pages', type=int, default=2,
+                        help='Pages of votes to sync per followed member.')
+    parser.add_argument('--bill-pages', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Stand-in upstream latency, in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='NAME',
+                        help='Save results as baselines/NAME.json.')
+    parser.add_argument('--compare', metavar='NAME',
+                        help='Compare with baselines/NAME.json.')
+    parser.add_argument('--max-regression', type=float, default=1.25)
+    parser.add_argument('--noise-ms', type=float, default=2.0,
+                        help='Ignore p95 increases smaller than this.')
+    args = parser.parse_args()
+
+    scenarios = [(label, scenario) for label, scenario in SCENARIOS
+                 if not args.routes or any(r in label for r in args.routes)]
+
+    upstream = args.upstream
+    if upstream is None:
+        mock = create_mock_app(Fixtures(vote_pages=args.vote_pages + 8,
+                                        seed=args.seed),
+                               latency=args.latency, jitter=args.jitter,
+                               error_rate=args.error_rate, seed=args.seed)
+        server, upstream = serve_in_thread(mock)
+
+    # create_app reads these
+    os.environ['PROPUBLICA_BASE_URL'] = upstream
+    os.environ.setdefault('PROPUBLICA_API_KEY', 'offline')
+    # Measure the app, not the upstream budget, unless asked to
+    os.environ.setdefault('PROPUBLICA_RATE_LIMIT', '0')
+    os.environ.setdefault('PROPUBLICA_DAILY_LIMIT', '0')
+    os.environ['DATABASE_URL'] = args.database
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rounds)
+
+    from app import create_app, propublica
+
+    app = create_app({'SQLALCHEMY_ECHO': False, 'DEBUG_TB_ENABLED': False})
+
+    rand = random.Random(args.seed)
+    fake = Faker()
+    fake.seed_instance(args.seed)
+
+    with app.app_context():
+        seeded = seed(propublica, args.users, args.max_follows,
+                      args.vote_pages, args.bill_pages, fake, rand)
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)  # nopep8
+    else:
+        make_client = lambda: AppClient(app)  # nopep8
+
+    workers = [Worker(make_client, seeded, random.Random(rand.random()))
+               for _ in range(args.concurrency)]
+
+    print(f"{'route':<40} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} errors")
+    results = {}
+    for label, scenario in scenarios:
+        expected = (404,) if '<404>' in label else ()
+        result = results[label] = run_scenario(workers, scenario,
+                                               args.requests, expected)
+        print(f"{label:<40} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+              f"{result['p99_ms']:8.2f} {result['rps']:8.1f} {result['errors']}")
+
+    status = 0
+
+    if args.compare:
+        with open(os.path.join(BASELINES, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.compare} ({baseline['meta']['created']}):")
+        regressed = compare(results, baseline, args.max_regression, args.noise_ms)
+        if regressed:
+            print(f"{len(regressed)} route(s) regressed")
+            status = 1
+
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        path = os.path.join(BASELINES, f"{args.save}.json")
+        meta = dict(vars(args), created=datetime.utcnow().isoformat())
+        with open(path, 'w') as f:
+            json.dump({'meta': meta, 'routes': results}, f, indent=2)
+        print(f"saved {path}")
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
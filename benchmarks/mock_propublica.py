@@ -0,0 +1,308 @@
+"""Offline stand-in for the ProPublica Congress API
+
+Serves the recorded payloads in benchmarks/fixtures for every endpoint the
+app calls, padded out with Faker so rosters, vote histories and bill lists
+are realistically large. Latency and upstream failures can be injected.
+Any API key is accepted, but one must be sent, as upstream requires.
+
+run it from the repo root like:
+    python -m benchmarks.mock_propublica --port 5001 --latency 0.2 --error-rate 0.01
+
+and point the app at it with
+    PROPUBLICA_BASE_URL=http://127.0.0.1:5001/congress/v1/
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+from faker import Faker
+from flask import Flask, abort, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+API_ROOT = '/congress/v1'
+STATES = ('AL', 'AK', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'KY', 'MD', 'MI',
+          'NY', 'NC', 'OH', 'PA', 'TX', 'VA', 'VT', 'WA', 'WI')
+SUBJECTS = ('Health', 'Taxation', 'Energy', 'Education', 'Immigration',
+            'Armed Forces and National Security', 'Transportation')
+PAGE_SIZE = 20
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, f"{name}.json")) as f:
+        return json.load(f)
+
+
+def envelope(results):
+    return {'status': 'OK', 'copyright': 'Offline fixtures', 'results': results}
+
+
+class Fixtures:
+    """Recorded payloads, expanded deterministically from `seed`"""
+
+    def __init__(self, senate_size=100, house_size=441, vote_pages=10,
+                 bill_count=400, seed=0):
+        self.vote_pages = vote_pages
+        self.member = load_fixture('member')['results'][0]
+        self.vote = load_fixture('votes')['results'][0]['votes']
+        self.bill = load_fixture('bill')['results'][0]
+        self.nominee = load_fixture('nominee')['results'][0]
+
+        fake = Faker()
+        fake.seed_instance(seed)
+        rand = random.Random(seed)
+
+        recorded = load_fixture('members')['results'][0]['members']
+        self.rosters = {
+            'senate': self._roster([m for m in recorded if 'senate_class' in m],
+                                   'S', senate_size, fake, rand),
+            'house': self._roster([m for m in recorded if 'district' in m],
+                                  'H', house_size, fake, rand),
+        }
+        self.members = {member['id']: member
+                        for roster in self.rosters.values() for member in roster}
+        self.chambers = {member['id']: chamber
+                         for chamber, roster in self.rosters.items()
+                         for member in roster}
+
+        recorded = load_fixture('bills')['results'][0]['bills']
+        self.bills = recorded + [self._bill(n, recorded[n % len(recorded)],
+                                            fake, rand)
+                                 for n in range(len(recorded), bill_count)]
+
+    @staticmethod
+    def _roster(recorded, prefix, size, fake, rand):
+        members = [dict(member) for member in recorded[:size]]
+
+        for n in range(len(members), size):
+            member = dict(rand.choice(recorded))
+            member.update({
+                'id': f"{prefix}{n:06d}",
+                'first_name': fake.first_name(),
+                'last_name': fake.last_name(),
+                'party': rand.choice(('D', 'R', 'R', 'D', 'ID')),
+                'state': rand.choice(STATES),
+                'in_office': rand.random() > 0.02,
+            })
+            members.append(member)
+
+        return members
+
+    @staticmethod
+    def _bill(n, recorded, fake, rand):
+        subject = rand.choice(SUBJECTS)
+        bill_type = rand.choice(('hr', 's', 'hres', 'sres'))
+        slug = f"{bill_type}{n}"
+
+        bill = dict(recorded)
+        bill.update({
+            'bill_id': f"{slug}-116",
+            'bill_type': bill_type,
+            'number': slug.upper(),
+            'short_title': f"{fake.catch_phrase()} {subject} Act",
+            'title': f"To {fake.bs()} in relation to {subject.lower()}.",
+            'summary': fake.paragraph(nb_sentences=4),
+            'primary_subject': subject,
+            'introduced_date': fake.date_between('-2y', 'today').isoformat(),
+            'active': rand.random() > 0.5,
+        })
+        return bill
+
+    def member_detail(self, member_id):
+        detail = copy.deepcopy(self.member)
+        detail.update({'id': member_id, 'member_id': member_id})
+
+        member = self.members.get(member_id)
+        if member is not None:
+            detail.update({key: member[key] for key in
+                           ('first_name', 'last_name', 'in_office')})
+            detail['current_party'] = member['party']
+            detail['roles'][0]['state'] = member['state']
+
+        return detail
+
+    def member_votes(self, member_id, offset):
+        """A page of votes, newest first, `vote_pages` pages deep"""
+
+        chamber = self.chambers.get(member_id, 'senate').title()
+        total = self.vote_pages * PAGE_SIZE
+        started = datetime(2020, 9, 24, 18, 0)
+
+        votes = []
+        for n in range(offset, min(offset + PAGE_SIZE, total)):
+            vote = copy.deepcopy(self.vote[n % len(self.vote)])
+            voted_at = started - timedelta(hours=6 * n)
+            vote.update({
+                'member_id': member_id,
+                'chamber': chamber,
+                'roll_call': str(total - n),
+                'date': voted_at.strftime('%Y-%m-%d'),
+                'time': voted_at.strftime('%H:%M:%S'),
+                'position': ('Yes', 'No', 'Yes', 'Not Voting')[
+                    zlib.crc32(f"{member_id}{n}".encode()) % 4],
+            })
+            votes.append(vote)
+
+        return votes
+
+    def bill_detail(self, slug, congress):
+        bill = copy.deepcopy(self.bill)
+        bill.update({'bill_id': f"{slug}-{congress}", 'bill_slug': slug,
+                     'congress': congress})
+        return bill
+
+    def nominee_detail(self, nomination_id):
+        nominee = copy.deepcopy(self.nominee)
+        nominee['id'] = nomination_id
+        return nominee
+
+
+def create_mock_app(fixtures=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                    rate_limit_rate=0.0, seed=0):
+    """Flask app that answers like the ProPublica API.
+
+    Every response is delayed by `latency` seconds (plus gaussian `jitter`).
+    A fraction `error_rate` of requests fail with 500 and `rate_limit_rate`
+    with 429. Request counts per path are served at /_stats.
+    """
+
+    fixtures = fixtures or Fixtures(seed=seed)
+    rand = random.Random(seed)
+    counts = Counter()
+    lock = threading.Lock()
+
+    app = Flask(__name__)
+
+    @app.before_request
+    def simulate_upstream():
+        if request.path == '/_stats':
+            return None
+
+        with lock:
+            counts[request.path] += 1
+            roll = rand.random()
+            delay = max(0.0, rand.gauss(latency, jitter)) if jitter else latency
+
+        if delay:
+            time.sleep(delay)
+
+        if not request.headers.get('X-API-Key'):
+            return jsonify(status='ERROR', errors=[{'error': 'Forbidden'}]), 403
+        if roll < error_rate:
+            return jsonify(status='ERROR', errors=[{'error': 'Internal error'}]), 500
+        if roll < error_rate + rate_limit_rate:
+            return jsonify(status='ERROR', errors=[{'error': 'Rate limited'}]), 429
+
+    @app.route('/_stats')
+    def stats():
+        with lock:
+            return jsonify(requests=sum(counts.values()), paths=dict(counts))
+
+    @app.route(f"{API_ROOT}/<congress>/<chamber>/members.json")
+    def members(congress, chamber):
+        if chamber not in fixtures.rosters:
+            abort(404)
+
+        roster = fixtures.rosters[chamber]
+        return jsonify(envelope([{'congress': congress,
+                                  'chamber': chamber.title(),
+                                  'num_results': len(roster), 'offset': 0,
+                                  'members': roster}]))
+
+    @app.route(f"{API_ROOT}/members/<member_id>.json")
+    def member(member_id):
+        return jsonify(envelope([fixtures.member_detail(member_id)]))
+
+    @app.route(f"{API_ROOT}/members/<member_id>/votes.json")
+    def member_votes(member_id):
+        offset = request.args.get('offset', 0, type=int)
+        votes = fixtures.member_votes(member_id, offset)
+
+        return jsonify(envelope([{'member_id': member_id,
+                                  'total_votes': str(len(votes)),
+                                  'offset': str(offset), 'votes': votes}]))
+
+    @app.route(f"{API_ROOT}/<congress>/bills/<slug>.json")
+    def bill(congress, slug):
+        return jsonify(envelope([fixtures.bill_detail(slug, congress)]))
+
+    @app.route(f"{API_ROOT}/<congress>/nominees/<nomination_id>.json")
+    def nominee(congress, nomination_id):
+        return jsonify(envelope([fixtures.nominee_detail(nomination_id)]))
+
+    def bill_page(bills):
+        offset = request.args.get('offset', 0, type=int)
+        page = bills[offset:offset + PAGE_SIZE]
+
+        return jsonify(envelope([{'num_results': len(page), 'offset': offset,
+                                  'bills': page}]))
+
+    @app.route(f"{API_ROOT}/<congress>/<chamber>/bills/<bill_type>.json")
+    def recent_bills(congress, chamber, bill_type):
+        return bill_page(fixtures.bills)
+
+    @app.route(f"{API_ROOT}/bills/search.json")
+    def search_bills():
+        terms = request.args.get('query', '').strip('"').lower().split()
+        return bill_page([bill for bill in fixtures.bills
+                          if all(term in json.dumps(bill).lower()
+                                 for term in terms)])
+
+    return app
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve_in_thread(app, host='127.0.0.1', port=0):
+    """Serve `app` from a daemon thread without request logging.
+
+    Returns `(server, api_base_url)`.
+    """
+
+    server = make_server(host, port, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://{host}:{server.server_port}{API_ROOT}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to delay every response.')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Standard deviation of the delay, in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests that fail with 500.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                        help='Fraction of requests that fail with 429.')
+    parser.add_argument('--vote-pages', type=int, default=10)
+    parser.add_argument('--bills', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_mock_app(
+        Fixtures(vote_pages=args.vote_pages, bill_count=args.bills,
+                 seed=args.seed),
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+
+    print(f"Serving the API at http://{args.host}:{args.port}{API_ROOT}/")
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
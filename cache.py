@@ -0,0 +1,387 @@
+"""TTL cache with stale-while-revalidate for upstream payloads"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from quota import background
+
+log = logging.getLogger(__name__)
+
+
+class LRUBackend:
+    """In-process store that drops the least recently used entry when full"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return `(value, stored_at)` for key, or None if missing"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Shared local store, visible to every worker on the same host.
+
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT value, stored_at FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), stored_at)
+            )
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache')
+
+
+class DiskBackend:
+    """Compressed, content-addressed store shared by every worker on a host.
+
+    Values are serialized to JSON, compressed, and written once to a file
+    under `directory` named by the SHA-256 of the JSON, so identical
+    payloads share a file. An SQLite index maps keys to files. Once the
+    files exceed `max_bytes`, the least recently read keys are evicted
+    until they fit in 90% of it.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries '
+                '(key TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, '
+                'stored_at REAL NOT NULL, read_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_read_at ON entries (read_at)')
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'), timeout=5)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT digest, stored_at FROM entries WHERE key = ?',
+                               (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE entries SET read_at = ? WHERE key = ?',
+                         (time.time(), key))
+
+        digest, stored_at = row
+        try:
+            with open(self._path(digest), 'rb') as f:
+                return json.loads(zlib.decompress(f.read())), stored_at
+        except (OSError, ValueError, zlib.error):
+            # Evicted by another worker since the index was read
+            return None
+
+    def set(self, key, value, stored_at):
+        raw = json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+
+        size = self._write(self._path(digest), raw)
+
+        with self._connect() as conn:
+            replaced = conn.execute('SELECT digest FROM entries WHERE key = ?',
+                                    (key,)).fetchall()
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, digest, size, stored_at, read_at) '
+                'VALUES (?, ?, ?, ?, ?)', (key, digest, size, stored_at, time.time())
+            )
+
+        self._remove_unreferenced({old for old, in replaced} - {digest})
+        self._evict()
+
+    def _write(self, path, raw):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(raw)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(temp, path)
+        return len(compressed)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            deleted = conn.execute('SELECT digest FROM entries WHERE key = ?',
+                                   (key,)).fetchall()
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+        self._remove_unreferenced({digest for digest, in deleted})
+
+    def clear(self):
+        with self._connect() as conn:
+            digests = {digest for digest, in conn.execute('SELECT digest FROM entries')}
+            conn.execute('DELETE FROM entries')
+
+        self._remove_unreferenced(digests)
+
+    def size(self):
+        """`(entries, bytes)` stored, counting shared files once"""
+
+        with self._connect() as conn:
+            entries, = conn.execute('SELECT COUNT(*) FROM entries').fetchone()
+            total, = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM '
+                '(SELECT DISTINCT digest, size FROM entries)').fetchone()
+        return entries, total
+
+    def _evict(self):
+        entries, total = self.size()
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        evicted = []
+        with self._connect() as conn:
+            # Keys sharing a file free less than this counts; close enough
+            for key, digest, size in conn.execute(
+                    'SELECT key, digest, size FROM entries ORDER BY read_at'):
+                if total <= target:
+                    break
+                evicted.append((key, digest))
+                total -= size
+            conn.executemany('DELETE FROM entries WHERE key = ?',
+                             [(key,) for key, digest in evicted])
+
+        self._remove_unreferenced({digest for key, digest in evicted})
+
+    def _remove_unreferenced(self, digests):
+        """Remove the files of `digests` that no key refers to any more"""
+
+        if not digests:
+            return
+
+        digests = list(digests)
+        referenced = set()
+        with self._connect() as conn:
+            # SQLite takes at most 999 parameters
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                referenced.update(digest for digest, in conn.execute(
+                    f'SELECT DISTINCT digest FROM entries WHERE digest IN ({placeholders})',
+                    chunk))
+
+        for digest in set(digests) - referenced:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+
+class TieredBackend:
+    """A small in-process `memory` backend in front of a shared `disk` one.
+
+    Reads try memory, then disk, copying disk hits into memory; writes go
+    to both. Counts where each read was answered.
+    """
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count('memory_hits')
+            return entry
+
+        entry = self.disk.get(key)
+        if entry is None:
+            self._count('misses')
+            return None
+
+        self._count('disk_hits')
+        self.memory.set(key, *entry)
+        return entry
+
+    def set(self, key, value, stored_at):
+        self.disk.set(key, value, stored_at)
+        self.memory.set(key, value, stored_at)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def metrics(self):
+        """Reads answered from memory, from disk and by neither, and what
+        is stored on disk
+        """
+
+        with self._lock:
+            metrics = dict(self._stats)
+        metrics['disk_entries'], metrics['disk_bytes'] = self.disk.size()
+        return metrics
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+
+def make_backend(name, **options):
+    """Build a cache backend from its config name ('lru' or 'sqlite')"""
+
+    if name == 'lru':
+        return LRUBackend(maxsize=options.get('maxsize', 128))
+    if name == 'sqlite':
+        return SQLiteBackend(options['path'])
+
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+class TTLCache:
+    """Cache entries for `ttl` seconds, then serve them stale while they refresh.
+
+    A fresh entry is returned as is. An expired entry is still returned, and a
+    single background thread reloads it. Only a missing entry, or one older
+    than `ttl + max_stale`, makes the caller wait on the loader.
+
+    `ttl` may also be a function of the cached value, returning seconds.
+    """
+
+    def __init__(self, backend, ttl, max_stale=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Return the value cached for key, calling `loader()` to (re)fill it"""
+
+        entry = self.backend.get(key)
+
+        if entry is None:
+            return self._load(key, loader)
+
+        value, stored_at = entry
+        age = time.time() - stored_at
+        ttl = self.ttl(value) if callable(self.ttl) else self.ttl
+
+        if age < ttl:
+            return value
+
+        if self.max_stale is None or age < ttl + self.max_stale:
+            self._refresh_in_background(key, loader)
+            return value
+
+        try:
+            return self._load(key, loader)
+        except Exception:
+            log.exception('Reload of %s failed, serving stale entry', key)
+            return value
+
+    def peek(self, key):
+        """Return the value cached for key, however old, without loading it;
+        None if missing
+        """
+
+        entry = self.backend.get(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time())
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def _load(self, key, loader):
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(target=self._refresh, args=(key, loader),
+                                  daemon=True)
+        thread.start()
+
+    def _refresh(self, key, loader):
+        try:
+            # Nobody waits on a refresh; it draws on the background budget
+            with background():
+                self._load(key, loader)
+        except Exception:
+            log.exception('Background refresh of %s failed', key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
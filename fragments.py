@@ -0,0 +1,74 @@
+"""Pre-rendered roster table rows with a per-user follow overlay"""
+
+from markupsafe import Markup
+
+from cache import LRUBackend
+
+
+class RosterRows:
+    """Rows of one roster, each rendered once in all three follow states.
+
+    Anonymous visitors get `anon`, a single cached string. For a logged-in
+    user `overlay` picks each row's followed or not-followed variant with a
+    set lookup, so no template code runs per request.
+    """
+
+    def __init__(self, member_ids, anon_rows, followed_rows, unfollowed_rows):
+        self.member_ids = member_ids
+        self.anon = Markup('').join(anon_rows)
+        self._followed = followed_rows
+        self._unfollowed = unfollowed_rows
+
+    def overlay(self, liked_member_ids):
+        return (followed if member_id in liked_member_ids else unfollowed
+                for member_id, followed, unfollowed
+                in zip(self.member_ids, self._followed, self._unfollowed))
+
+
+class RosterFragments:
+    """Per-worker cache of `RosterRows`, keyed by roster and roster version"""
+
+    def __init__(self, maxsize=32):
+        self.backend = LRUBackend(maxsize=maxsize)
+
+    def rows(self, key, members, render_row, liked_member_ids=None):
+        """The rows for `key`, as an iterable of Markup, for a user who
+        follows `liked_member_ids` (None for anonymous visitors).
+
+        `members` is a list of dicts, or a callable returning one, so a hit
+        does not need to load them. `render_row(member, follow)` returns one
+        row, `follow` being None for anonymous visitors. On a miss, members
+        are loaded and rendered as the rows are iterated, so a streamed page
+        sends each row as it is rendered; they are cached once all are.
+        """
+
+        entry = self.backend.get(key)
+        if entry is None:
+            return self._render(key, members, render_row, liked_member_ids)
+
+        if liked_member_ids is None:
+            return [entry[0].anon]
+
+        return entry[0].overlay(liked_member_ids)
+
+    def _render(self, key, members, render_row, liked_member_ids):
+        if callable(members):
+            members = members()
+
+        member_ids, anon_rows, followed_rows, unfollowed_rows = [], [], [], []
+
+        for member in members:
+            member_ids.append(member['id'])
+            anon_rows.append(render_row(member, None))
+            followed_rows.append(render_row(member, True))
+            unfollowed_rows.append(render_row(member, False))
+
+            if liked_member_ids is None:
+                yield anon_rows[-1]
+            elif member['id'] in liked_member_ids:
+                yield followed_rows[-1]
+            else:
+                yield unfollowed_rows[-1]
+
+        self.backend.set(key, RosterRows(member_ids, anon_rows, followed_rows,
+                                         unfollowed_rows), 0)
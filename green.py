@@ -0,0 +1,44 @@
+"""Cooperative serving mode on gevent workers.
+
+A search request spends nearly all its time waiting on ProPublica, so a
+sync worker sits idle while it is in flight. Under gevent a worker runs
+each request as a greenlet that yields whenever it would block on a socket,
+so one worker serves many waiting requests at once.
+
+That only holds if nothing blocks the whole worker. `patch()` makes the
+standard library cooperative (sockets, so `requests`; threads and locks;
+sleeps) and installs psycogreen's wait callback so psycopg2 queries yield
+too. Calls that block in C without a socket, bcrypt and `flock`, go through
+`run_blocking` to the hub's pool of native threads.
+
+On by default; GUNICORN_WORKER_CLASS=sync turns it off, see gunicorn.conf.py.
+"""
+
+import sys
+
+
+def patch():
+    """Make blocking I/O cooperative; call before importing the app"""
+
+    from gevent import monkey
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def is_patched():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def run_blocking(func, *args):
+    """Call `func(*args)`; when patched, on a native thread so the worker's
+    other greenlets keep running meanwhile
+    """
+
+    if not is_patched():
+        return func(*args)
+
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args)
@@ -0,0 +1,39 @@
+"""gunicorn settings, read automatically from the working directory.
+
+The app is built once in the master (`preload_app`) and forked, so workers
+boot without importing and configuring it again and share its memory
+copy-on-write. Building it opens no connections; anything that does is
+created lazily per process (see propublica.ProPublicaClient).
+
+By default (GUNICORN_WORKER_CLASS=gevent) each worker serves its requests
+as greenlets, up to GUNICORN_WORKER_CONNECTIONS at once (see green.py), so
+requests waiting on ProPublica or on a password hash do not hold up the
+rest. GUNICORN_WORKER_CLASS=sync serves one request per worker at a time.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+preload_app = True
+
+if worker_class == 'gevent':
+    # Patch before the app (and requests, psycopg2) is preloaded
+    import green
+    green.patch()
+
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+    # Fanned-out upstream calls are greenlets too; let every connection's
+    # calls be in flight at once rather than queue for the default 10
+    os.environ.setdefault('PROPUBLICA_POOL_SIZE', str(worker_connections * 2))
+
+
+def post_fork(server, worker):
+    # Never share pooled database connections with the master
+    from models import db
+    from wsgi import app
+
+    with app.app_context():
+        for bind in [None, *(app.config['SQLALCHEMY_BINDS'] or {})]:
+            db.get_engine(app, bind=bind).dispose()
@@ -0,0 +1,158 @@
+"""Password hashing on a bounded process pool"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+import green
+from instrumentation import timed
+
+
+class HashingOverloaded(Exception):
+    """Too many hashes are already queued; the caller should shed the request"""
+
+
+def _hash(password, rounds, submitted_at):
+    started_at = time.time()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return hashed, started_at - submitted_at, time.time() - started_at
+
+
+def _check(hashed, password, submitted_at):
+    started_at = time.time()
+    matches = bcrypt.checkpw(password, hashed)
+    return matches, started_at - submitted_at, time.time() - started_at
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def hash_rounds(hashed):
+    """Work factor a bcrypt hash was made with, e.g. 12 for '$2b$12$...'"""
+
+    return int(_to_bytes(hashed).split(b'$')[2])
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification off the request thread.
+
+    Under gevent (see green.py, the default in gunicorn.conf.py) hashing
+    runs on native threads, `workers` at a time; bcrypt releases the GIL,
+    so the worker's other requests carry on meanwhile. Otherwise work runs
+    on a per-process pool of `workers` processes. With `workers=0` hashing
+    runs inline.
+
+    At most `max_queue` calls may wait for their turn; beyond that calls
+    fail fast with `HashingOverloaded`. Both bounds are per process. A sync
+    gunicorn worker serves one request at a time, so it never queues and
+    still waits out every hash it offloads.
+
+    Configure from app config with `init_app`, like a Flask extension:
+    BCRYPT_LOG_ROUNDS, BCRYPT_POOL_WORKERS and BCRYPT_MAX_QUEUE.
+    """
+
+    def __init__(self, rounds=12, workers=1, max_queue=16):
+        self.configure(rounds, workers, max_queue)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'hashes': 0,
+            'hash_seconds': 0.0,
+            'queue_wait_seconds': 0.0,
+            'max_queue_wait_seconds': 0.0,
+            'rejected': 0,
+        }
+
+    def configure(self, rounds, workers, max_queue):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._running = threading.BoundedSemaphore(max(workers, 1))
+
+    def init_app(self, app):
+        self.configure(app.config.get('BCRYPT_LOG_ROUNDS', 12),
+                       app.config.get('BCRYPT_POOL_WORKERS', 1),
+                       app.config.get('BCRYPT_MAX_QUEUE', 16))
+
+    @property
+    def pool(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def generate_password_hash(self, password):
+        """Hash `password` with the configured work factor"""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        hashed = self._run(_hash, _to_bytes(password), self.rounds)
+        return hashed.decode('utf-8')
+
+    def check_password_hash(self, hashed, password):
+        """True if `password` matches the stored `hashed` value"""
+
+        if not hashed or not password:
+            return False
+
+        return self._run(_check, _to_bytes(hashed), _to_bytes(password))
+
+    def needs_rehash(self, hashed):
+        """True if `hashed` was made with a different work factor"""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def metrics(self):
+        """Counters for hashing latency, queue wait and rejected calls"""
+
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self, func, *args):
+        with timed('hash'):
+            return self._call(func, *args)
+
+    def _call(self, func, *args):
+        if self.workers == 0:
+            result, waited, took = green.run_blocking(func, *args, time.time())
+            self._record(waited, took)
+            return result
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingOverloaded(
+                f"More than {self.max_queue} password hashes queued")
+
+        try:
+            if green.is_patched():
+                # A process pool does not mix with monkey-patched threads
+                submitted_at = time.time()
+                with self._running:
+                    result, waited, took = green.run_blocking(func, *args, submitted_at)
+            else:
+                future = self.pool.submit(func, *args, time.time())
+                result, waited, took = future.result()
+        finally:
+            self._slots.release()
+
+        self._record(waited, took)
+        return result
+
+    def _record(self, waited, took):
+        with self._lock:
+            self._stats['hashes'] += 1
+            self._stats['hash_seconds'] += took
+            self._stats['queue_wait_seconds'] += waited
+            self._stats['max_queue_wait_seconds'] = max(
+                self._stats['max_queue_wait_seconds'], waited)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,119 @@
+"""Lazily loaded current user, backed by a small per-worker identity cache"""
+
+import time
+
+from sqlalchemy.orm import joinedload
+
+from cache import LRUBackend
+from models import User
+
+
+class IdentityCache:
+    """Username and followed member ids for recently seen users.
+
+    Entries are keyed by `(user_id, version)`. The version lives in the
+    user's session and is replaced by a unique token whenever their follows
+    change, so every worker misses and reloads on the session's next
+    request, not just this one. Other sessions of the same user keep their
+    version, and may see the change only once their entry is `ttl` old.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.backend = LRUBackend(maxsize=maxsize)
+        self.ttl = ttl
+
+    def init_app(self, app):
+        self.backend = LRUBackend(maxsize=app.config.get('IDENTITY_CACHE_SIZE', 1024))
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', 300)
+
+    def get(self, user_id, version):
+        entry = self.backend.get((user_id, version))
+
+        if entry is None:
+            return None
+
+        identity, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            self.backend.delete((user_id, version))
+            return None
+
+        return identity
+
+    def set(self, user_id, version, identity):
+        self.backend.set((user_id, version), identity, time.time())
+
+    def invalidate(self, user_id, version):
+        self.backend.delete((user_id, version))
+
+
+class LazyUser:
+    """Stands in for the logged-in `User` on `g.user`.
+
+    Truthiness, `id`, `username` and `liked_member_ids` are answered from the
+    identity cache; on a miss one query loads the user with their likes. Any
+    other attribute loads the `User` row and is read from it.
+    """
+
+    def __init__(self, user_id, version, cache):
+        self.id = user_id
+        self.version = version
+        self._cache = cache
+        self._identity = None
+        self._user = None
+        self._deleted = False
+
+    def __bool__(self):
+        return not self._deleted and self._get_identity() is not None
+
+    def __getattr__(self, name):
+        user = self.load()
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+    @property
+    def username(self):
+        return self._get_identity()['username']
+
+    @property
+    def liked_member_ids(self):
+        """Frozenset of the ids of members this user follows"""
+
+        return self._get_identity()['liked_member_ids']
+
+    def followed_members(self):
+        return User.followed_members(self)
+
+    def load(self):
+        """Return the `User` row, or None if the account no longer exists.
+
+        A missing account is dropped from the cache, and this user is falsy
+        from then on.
+        """
+
+        if self._user is None and not self._deleted:
+            self._user = User.query.get(self.id)
+            if self._user is None:
+                self._deleted = True
+                self._identity = None
+                self._cache.invalidate(self.id, self.version)
+        return self._user
+
+    def _get_identity(self):
+        if self._identity is None:
+            self._identity = self._cache.get(self.id, self.version)
+
+        if self._identity is None:
+            # Eager-load likes so follow state costs no extra query
+            user = User.query.options(joinedload(User.likes)).get(self.id)
+            if user is None:
+                return None
+
+            self._user = user
+            self._identity = {
+                'username': user.username,
+                'liked_member_ids': frozenset(member.id for member in user.likes),
+            }
+            self._cache.set(self.id, self.version, self._identity)
+
+        return self._identity
@@ -0,0 +1,264 @@
+"""Per-request timing breakdown and process-wide latency histograms.
+
+Code that talks to a slow dependency wraps the call in `timed(kind)`. The
+time is added to the current request's breakdown, sent back as a
+`Server-Timing` header, and observed in a histogram served in the
+Prometheus text format from /metrics.
+
+Histograms are per process; with several gunicorn workers each one serves
+its own, like any other per-worker state in this app.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds in seconds, roughly x2.5 apart, from 1ms to 10s
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# What each kind of span is called in Server-Timing and /metrics
+SPANS = {
+    'db': 'Database queries',
+    'upstream': 'ProPublica API calls',
+    'hash': 'Password hashing',
+    'render': 'Template rendering',
+}
+
+# The breakdown of the request being handled in this context. A ContextVar
+# rather than `g`, so calls fanned out to other threads can carry it along.
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value"""
+
+    def __init__(self, name, description, label, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            series = [(value, list(counts), total)
+                      for value, (counts, total) in sorted(self._series.items())]
+
+        for value, counts, total in series:
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+
+        return lines
+
+
+class Collected:
+    """Values read from `read()`, a dict of label value to number, when
+    /metrics is served
+    """
+
+    def __init__(self, name, description, label, read, type='gauge'):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.read = read
+        self.type = type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.type}"]
+        lines.extend(f'{self.name}{{{self.label}="{value}"}} {number}'
+                     for value, number in sorted(self.read().items()))
+        return lines
+
+
+class RequestTimings:
+    """Total seconds and number of calls per span kind for one request"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            total, count = self.spans.get(kind, (0.0, 0))
+            self.spans[kind] = (total + seconds, count + 1)
+
+    def server_timing(self):
+        """`Server-Timing` header value; each dur is the sum over calls, so
+        fanned-out upstream calls can add up to more than the wall time.
+        """
+
+        with self._lock:
+            spans = dict(self.spans)
+
+        entries = [f'{kind};dur={total * 1000:.1f};desc="{SPANS[kind]} ({count})"'
+                   for kind, (total, count) in spans.items()]
+        elapsed = time.perf_counter() - self.started_at
+        entries.append(f'total;dur={elapsed * 1000:.1f}')
+
+        return ', '.join(entries)
+
+
+span_seconds = Histogram(
+    'informed_voter_span_seconds',
+    'Time spent in one database query, API call, hash or template render.',
+    'kind')
+request_seconds = Histogram(
+    'informed_voter_request_seconds',
+    'Time to handle a request, up to the start of the response body.',
+    'endpoint')
+
+
+_collected = {}
+
+
+def collect(name, description, label, read, type='gauge'):
+    """Serve the values `read()` returns at /metrics too, replacing any
+    earlier metric called `name`
+    """
+
+    _collected[name] = Collected(name, description, label, read, type)
+
+
+def record(kind, seconds):
+    """Observe one `kind` span, adding it to the current request if any"""
+
+    span_seconds.observe(kind, seconds)
+
+    timings = _current.get()
+    if timings is not None:
+        timings.add(kind, seconds)
+
+
+@contextmanager
+def timed(kind):
+    """Time the body of the `with` block as one `kind` span"""
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - started_at)
+
+
+def carry_context(func):
+    """Wrap `func` to run in a copy of the caller's context, so its spans
+    count towards the caller's request when run on a pool thread.
+    """
+
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def render_metrics():
+    lines = span_seconds.render() + request_seconds.render()
+    for collected in _collected.values():
+        lines.extend(collected.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Hooks
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    record('db', time.perf_counter() - conn.info['query_started_at'].pop())
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started_at'):
+        conn.info['query_started_at'].pop()
+
+
+# Templates render on the request's thread, and may include others
+_rendering = threading.local()
+
+
+def _before_render_template(app, template, context):
+    _rendering.__dict__.setdefault('started_at', []).append(time.perf_counter())
+
+
+def _template_rendered(app, template, context):
+    started_at = getattr(_rendering, 'started_at', None)
+    if started_at:
+        record('render', time.perf_counter() - started_at.pop())
+
+
+def init_app(app):
+    """Time every request of `app`, hook database queries and template
+    rendering, and serve the histograms at METRICS_PATH.
+
+    Set SERVER_TIMING_ENABLED to False to stop sending the header.
+    """
+
+    app.config.setdefault('SERVER_TIMING_ENABLED', True)
+    app.config.setdefault('METRICS_PATH', '/metrics')
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.before_request
+    def start_request_timings():
+        _current.set(RequestTimings())
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = _current.get()
+        if timings is None:
+            return response
+
+        request_seconds.observe(request.endpoint or 'unmatched',
+                                time.perf_counter() - timings.started_at)
+        if app.config['SERVER_TIMING_ENABLED']:
+            response.headers['Server-Timing'] = timings.server_timing()
+
+        return response
+
+    @app.teardown_request
+    def stop_request_timings(exc):
+        _current.set(None)
+
+    def metrics():
+        return app.response_class(render_metrics(),
+                                  mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(app.config['METRICS_PATH'], 'metrics', metrics)
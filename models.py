@@ -1,12 +1,98 @@
 """SQLAlchemy models for Informed Voter"""
 
+from contextlib import contextmanager
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, insert
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import GenerativeSelect
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import hasher
+
+# Bind key of the optional read replica, see create_app
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the replica bind, when one is configured.
+
+    Statements that write go to the primary, and so does everything after
+    them in the same session, so it reads its own writes. `use_primary`
+    sends everything there.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif (isinstance(clause, GenerativeSelect)
+              and getattr(clause, '_for_update_arg', None) is None
+              and not self.info.get('wrote') and not self.info.get('primary')
+              and REPLICA in (self.app.config.get('SQLALCHEMY_BINDS') or {})):
+            return db.get_engine(self.app, bind=REPLICA)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def use_primary():
+    """Send the rest of this session's queries to the primary"""
+
+    db.session.info['primary'] = True
+
+
+def set_statement_timeout(connection, milliseconds):
+    if milliseconds is None:
+        connection.execute('SET LOCAL statement_timeout TO DEFAULT')
+    else:
+        connection.execute('SET LOCAL statement_timeout = %d' % int(milliseconds))
+
+
+@contextmanager
+def statement_timeout(milliseconds):
+    """Let the block's statements run for `milliseconds` (0 for no limit)
+    instead of the configured DB_STATEMENT_TIMEOUT.
+
+    The limit is set per transaction; if the block fails, the transaction
+    keeps it until rolled back.
+    """
+
+    info = db.session.info
+    previous = info.get('statement_timeout')
+    info['statement_timeout'] = milliseconds
+    for connection in info.get('connections', ()):
+        set_statement_timeout(connection, milliseconds)
+
+    try:
+        yield
+    except BaseException:
+        info['statement_timeout'] = previous
+        raise
+
+    info['statement_timeout'] = previous
+    for connection in info.get('connections', ()):
+        set_statement_timeout(connection, previous)
+
+
+@event.listens_for(RoutingSession, 'after_begin')
+def apply_statement_timeout(session, transaction, connection):
+    session.info.setdefault('connections', []).append(connection)
+    if session.info.get('statement_timeout') is not None:
+        set_statement_timeout(connection, session.info['statement_timeout'])
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def forget_connections(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('connections', None)
 
 
 class User(db.Model):
@@ -24,6 +110,18 @@ class User(db.Model):
         secondary="likes"
     )
 
+    def followed_members(self):
+        """Id and names of the members this user follows, in one query"""
+
+        return (db.session.query(GovMembers.id,
+                                 GovMembers.first_name,
+                                 GovMembers.last_name)
+                .join(Likes, Likes.item_id == GovMembers.id)
+                .filter(Likes.user_id == self.id)
+                .distinct()
+                .order_by(GovMembers.last_name, GovMembers.first_name)
+                .all())
+
     @classmethod
     def signup(cls, username, email, password):
         """Sign up user.
@@ -31,7 +129,7 @@ class User(db.Model):
         Hashes password and adds user into system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.generate_password_hash(password)
 
         user = User(
             email=email,
@@ -51,13 +149,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different work factor than the one
+        configured, it is replaced with a fresh hash; commit to keep it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check_password_hash(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.generate_password_hash(password)
                 return user
 
         return False
@@ -67,6 +170,9 @@ class Likes(db.Model):
     """Mapping user likes to goverment members"""
 
     __tablename__ = 'likes'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'item_id', name='uq_likes_user_item'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(
@@ -74,15 +180,289 @@ class Likes(db.Model):
     item_id = db.Column(db.String, db.ForeignKey(
         'govmembers.id', ondelete='cascade'))
 
+    @classmethod
+    def follow(cls, user_id, members):
+        """Make `user_id` follow `members`; following twice is a no-op.
+
+        Each member is either an id already in `govmembers`, or a dict with
+        `id`, `first_name` and `last_name`, added to `govmembers` if missing.
+        Unknown ids are skipped. Returns the number of new follows; commit
+        to keep them.
+        """
+
+        new_members = [
+            {'id': m['id'], 'first_name': m['first_name'],
+             'last_name': m['last_name']}
+            for m in members if isinstance(m, dict)
+        ]
+        member_ids = {m['id'] if isinstance(m, dict) else m for m in members}
+
+        if new_members:
+            db.session.execute(insert(GovMembers.__table__)
+                               .values(new_members)
+                               .on_conflict_do_nothing())
+
+        follows = db.select([db.literal(user_id), GovMembers.id]).where(
+            GovMembers.id.in_(member_ids))
+        result = db.session.execute(
+            insert(cls.__table__)
+            .from_select(['user_id', 'item_id'], follows)
+            .on_conflict_do_nothing(constraint='uq_likes_user_item'))
+
+        return result.rowcount
+
+    @classmethod
+    def unfollow(cls, user_id, member_ids):
+        """Stop `user_id` following `member_ids`.
+
+        Returns the number of follows removed; commit to keep it.
+        """
+
+        return (cls.query
+                .filter(cls.user_id == user_id, cls.item_id.in_(member_ids))
+                .delete(synchronize_session=False))
+
 
 class GovMembers(db.Model):
-    """Add liked gov Members"""
+    """Government members, synced from the congress rosters"""
 
     __tablename__ = 'govmembers'
+    __table_args__ = (
+        db.Index('ix_govmembers_chamber_last_name', 'chamber', 'last_name'),
+    )
 
     id = db.Column(db.String, primary_key=True)
     first_name = db.Column(db.String, nullable=False)
     last_name = db.Column(db.String, nullable=False)
+    party = db.Column(db.String, index=True)
+    state = db.Column(db.String, index=True)
+    chamber = db.Column(db.String)
+    in_office = db.Column(db.Boolean)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # High-water mark of the vote history synced into member_votes
+    votes_synced_through = db.Column(db.DateTime)
+    # Whether the first sync reached their first vote; if not, older ones
+    # are only upstream
+    votes_complete = db.Column(db.Boolean)
+
+
+class MemberVote(db.Model):
+    """A member's position on one roll call vote"""
+
+    __tablename__ = 'member_votes'
+    __table_args__ = (
+        db.Index('ix_member_votes_member_voted_at',
+                 'member_id', 'voted_at', 'vote_key'),
+        # Everyone's positions on a roll call, for party majorities
+        db.Index('ix_member_votes_vote_key', 'vote_key'),
+    )
+
+    member_id = db.Column(db.String, db.ForeignKey(
+        'govmembers.id', ondelete='cascade'), primary_key=True)
+    # '<congress>-<chamber>-<session>-<roll call>', unique per roll call
+    vote_key = db.Column(db.String, primary_key=True)
+    voted_at = db.Column(db.DateTime, nullable=False)
+    chamber = db.Column(db.String)
+    congress = db.Column(db.Integer)
+    session = db.Column(db.Integer)
+    roll_call = db.Column(db.Integer)
+    position = db.Column(db.String)
+    question = db.Column(db.Text)
+    description = db.Column(db.Text)
+    result = db.Column(db.String)
+    bill_id = db.Column(db.String)
+    bill_title = db.Column(db.Text)
+    bill_latest_action = db.Column(db.Text)
+
+    @classmethod
+    def page(cls, member_id, before=None, after=None, per_page=20):
+        """Return a page of the member's votes, newest first.
+
+        Keyset pagination on `(voted_at, vote_key)`: pass the key of the
+        last row seen as `before` for older votes, or the key of the first
+        row as `after` for newer ones. Returns `(votes, newer, older)` where
+        `newer` / `older` are the keys to page with, or None at either end.
+        """
+
+        key = db.tuple_(cls.voted_at, cls.vote_key)
+        query = cls.query.filter_by(member_id=member_id)
+
+        if after is not None:
+            rows = (query.filter(key > db.tuple_(*after))
+                    .order_by(cls.voted_at, cls.vote_key)
+                    .limit(per_page + 1).all())
+            has_newer = len(rows) > per_page
+            votes = rows[:per_page][::-1]
+            has_older = True
+        else:
+            if before is not None:
+                query = query.filter(key < db.tuple_(*before))
+            rows = (query.order_by(cls.voted_at.desc(), cls.vote_key.desc())
+                    .limit(per_page + 1).all())
+            votes = rows[:per_page]
+            has_newer = before is not None
+            has_older = len(rows) > per_page
+
+        newer = votes[0].key if votes and has_newer else None
+        older = votes[-1].key if votes and has_older else None
+
+        return votes, newer, older
+
+    @property
+    def key(self):
+        return (self.voted_at, self.vote_key)
+
+    def to_dict(self):
+        """Serialize in the shape of an upstream `votes.json` entry"""
+
+        return {
+            'member_id': self.member_id,
+            'chamber': self.chamber,
+            'congress': self.congress,
+            'session': self.session,
+            'roll_call': self.roll_call,
+            'bill': {
+                'bill_id': self.bill_id,
+                'title': self.bill_title,
+                'latest_action': self.bill_latest_action,
+            },
+            'question': self.question,
+            'description': self.description,
+            'result': self.result,
+            'date': self.voted_at.date().isoformat(),
+            'time': self.voted_at.time().isoformat(),
+            'position': self.position,
+        }
+
+
+class MemberVoteStats(db.Model):
+    """Aggregates of a member's stored votes, kept by stats.refresh_vote_stats"""
+
+    __tablename__ = 'member_vote_stats'
+
+    member_id = db.Column(db.String, db.ForeignKey(
+        'govmembers.id', ondelete='cascade'), primary_key=True)
+    total_votes = db.Column(db.Integer, nullable=False, default=0)
+    yes_votes = db.Column(db.Integer, nullable=False, default=0)
+    no_votes = db.Column(db.Integer, nullable=False, default=0)
+    present_votes = db.Column(db.Integer, nullable=False, default=0)
+    missed_votes = db.Column(db.Integer, nullable=False, default=0)
+    # Yes / no votes on roll calls where the member's party (among the other
+    # stored members) had a majority, and those that went with it
+    party_line_eligible = db.Column(db.Integer, nullable=False, default=0)
+    party_line_votes = db.Column(db.Integer, nullable=False, default=0)
+    # The member's votes_synced_through when these were computed
+    votes_through = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def missed_rate(self):
+        return self.missed_votes / self.total_votes if self.total_votes else None
+
+    @property
+    def party_line_rate(self):
+        if not self.party_line_eligible:
+            return None
+        return self.party_line_votes / self.party_line_eligible
+
+
+class Bill(db.Model):
+    """Bill metadata, indexed for local full-text search"""
+
+    __tablename__ = 'bills'
+    __table_args__ = (
+        db.Index('ix_bills_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+    )
+
+    bill_id = db.Column(db.String, primary_key=True)
+    congress = db.Column(db.Integer, nullable=False)
+    short_title = db.Column(db.Text)
+    title = db.Column(db.Text)
+    summary = db.Column(db.Text)
+    primary_subject = db.Column(db.Text)
+    introduced_date = db.Column(db.Date)
+    # Upstream bill entry as returned by ProPublica, rendered by the templates
+    payload = db.Column(JSONB, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Titles weigh more than the subject, which weighs more than the summary
+    search_vector = db.Column(TSVECTOR, db.Computed(
+        "setweight(to_tsvector('english', coalesce(short_title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(primary_subject, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(summary, '')), 'C')",
+        persisted=True
+    ))
+
+    @classmethod
+    def search(cls, term, offset=0, limit=20):
+        """Bills matching every word of `term`, most relevant first"""
+
+        query = db.func.plainto_tsquery('english', term)
+        rank = db.func.ts_rank_cd(cls.search_vector, query)
+
+        return (cls.query
+                .filter(cls.search_vector.op('@@')(query))
+                .order_by(rank.desc(), cls.introduced_date.desc().nullslast())
+                .offset(offset)
+                .limit(limit)
+                .all())
+
+
+class UpstreamBudget(db.Model):
+    """Upstream calls made today and rate limit tokens, shared by every
+    process through quota.DatabaseQuotaStore
+    """
+
+    __tablename__ = 'upstream_budget'
+
+    name = db.Column(db.String, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    used = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.Column(db.Float, nullable=False)
+    # Unix time the tokens were counted at
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+# Bring tables made by earlier releases up to date; `create_all` only adds
+# missing tables. Each statement is safe to run again.
+SCHEMA_UPGRADES = [
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS party VARCHAR',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS state VARCHAR',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS chamber VARCHAR',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS in_office BOOLEAN',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE',
+    'CREATE INDEX IF NOT EXISTS ix_govmembers_chamber_last_name '
+    'ON govmembers (chamber, last_name)',
+    'CREATE INDEX IF NOT EXISTS ix_govmembers_party ON govmembers (party)',
+    'CREATE INDEX IF NOT EXISTS ix_govmembers_state ON govmembers (state)',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS votes_synced_through '
+    'TIMESTAMP WITHOUT TIME ZONE',
+    'ALTER TABLE govmembers ADD COLUMN IF NOT EXISTS votes_complete BOOLEAN',
+    'CREATE INDEX IF NOT EXISTS ix_member_votes_vote_key ON member_votes (vote_key)',
+    # Keep the first of any duplicate follows, then forbid them
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_likes_user_item') THEN
+            DELETE FROM likes USING likes AS kept
+            WHERE likes.user_id = kept.user_id AND likes.item_id = kept.item_id
+                AND likes.id > kept.id;
+            ALTER TABLE likes ADD CONSTRAINT uq_likes_user_item UNIQUE (user_id, item_id);
+        END IF;
+    END $$
+    """,
+]
+
+
+def upgrade_schema():
+    """Create missing tables, then run `SCHEMA_UPGRADES` on existing ones"""
+
+    db.create_all()
+    for statement in SCHEMA_UPGRADES:
+        db.session.execute(statement)
+    db.session.commit()
 
 
 def connect_db(app):
@@ -0,0 +1,166 @@
+"""Cursor pagination for lists served 20 rows at a time.
+
+Pages link to their neighbours with cursors: opaque, URL-safe tokens for a
+position in a list, such as an upstream offset or a synced vote's key.
+What a cursor holds is not part of any URL contract and may change.
+
+`UpstreamPager` serves offset-paged upstream lists through a cache and,
+after serving page N, fetches page N+1 in the background, so following
+"Next" is answered from memory.
+"""
+
+import base64
+import json
+import logging
+
+from quota import background
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 20
+
+
+def encode_cursor(position):
+    """Opaque token for `position`, a JSON-serializable dict; None for None"""
+
+    if position is None:
+        return None
+
+    raw = json.dumps(position, sort_keys=True, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of `encode_cursor`; an empty dict for a missing or bad cursor"""
+
+    if not cursor:
+        return {}
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except ValueError:
+        return {}
+
+    return position if isinstance(position, dict) else {}
+
+
+def cursor_offset(position):
+    """The non-negative offset in a decoded cursor, 0 if it has none"""
+
+    offset = position.get('offset')
+    if isinstance(offset, int) and offset > 0:
+        return offset - offset % PAGE_SIZE
+
+    return 0
+
+
+def offset_cursor(offset):
+    return encode_cursor({'offset': offset})
+
+
+class Page:
+    """One page of `items`, with cursors to the pages either side (None at
+    either end of the list)
+    """
+
+    def __init__(self, items, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @classmethod
+    def at_offset(cls, items, offset, has_next):
+        prev_cursor = offset_cursor(offset - PAGE_SIZE) if offset else None
+        next_cursor = offset_cursor(offset + PAGE_SIZE) if has_next else None
+        return cls(items, prev_cursor, next_cursor)
+
+
+class DeferredPage:
+    """A `Page` from `load()`, called when the page is first used.
+
+    In a streamed template, everything above the list goes out while it
+    loads. If `load` raises one of `errors`, the page is empty and
+    `unavailable`.
+    """
+
+    def __init__(self, load, errors=()):
+        self._load = load
+        self._errors = errors
+        self._page = None
+        self._unavailable = False
+
+    def _resolve(self):
+        if self._page is None:
+            try:
+                self._page = self._load()
+            except self._errors as e:
+                log.warning('Page unavailable: %s', e)
+                self._page = Page([])
+                self._unavailable = True
+
+        return self._page
+
+    @property
+    def items(self):
+        return self._resolve().items
+
+    @property
+    def prev_cursor(self):
+        return self._resolve().prev_cursor
+
+    @property
+    def next_cursor(self):
+        return self._resolve().next_cursor
+
+    @property
+    def unavailable(self):
+        self._resolve()
+        return self._unavailable
+
+
+class UpstreamPager:
+    """Pages of upstream lists, cached in `cache` (a `cache.TTLCache`).
+
+    `fetch(offset)` returns up to PAGE_SIZE rows from `offset`. A full page
+    may have a next page: it gets a next cursor, and the next page is loaded
+    in the background at background upstream priority through `submit`
+    (e.g. an executor's `submit`). Once that comes back empty, the page
+    loses its next cursor.
+    """
+
+    def __init__(self, cache, submit):
+        self.cache = cache
+        self.submit = submit
+
+    def page(self, key, fetch, cursor=None):
+        """The page of the list called `key` at `cursor`"""
+
+        offset = cursor_offset(decode_cursor(cursor))
+        items = self._load(key, fetch, offset)
+
+        has_next = len(items) == PAGE_SIZE
+        if has_next:
+            following = self.cache.peek(self._key(key, offset + PAGE_SIZE))
+            if following is None:
+                self._prefetch(key, fetch, offset + PAGE_SIZE)
+            else:
+                has_next = bool(following)
+
+        return Page.at_offset(items, offset, has_next)
+
+    def _key(self, key, offset):
+        return f"{key}@{offset}"
+
+    def _load(self, key, fetch, offset):
+        return self.cache.get(self._key(key, offset), lambda: fetch(offset))
+
+    def _prefetch(self, key, fetch, offset):
+        def prefetch():
+            with background():
+                try:
+                    self._load(key, fetch, offset)
+                except Exception as e:
+                    log.info('Prefetch of %s at %s failed: %s', key, offset, e)
+
+        self.submit(prefetch)
@@ -0,0 +1,315 @@
+"""Client for the ProPublica Congress API"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from cache import LRUBackend
+from instrumentation import carry_context, timed
+from quota import QuotaScheduler
+from singleflight import FileFlightStore, SingleFlight
+
+BASE_URL = 'https://api.propublica.org/congress/v1/'
+CURRENT_CONGRESS = 116
+
+
+class ProPublicaError(Exception):
+    """Upstream request failed or returned an error status"""
+
+
+class QuotaExhausted(ProPublicaError):
+    """The upstream budget is spent and there is no stale result to serve"""
+
+
+class NotFound(ProPublicaError):
+    """Upstream has no such record, e.g. for an unknown member id"""
+
+
+class UpstreamTimeout(ProPublicaError):
+    """Upstream did not answer in time"""
+
+
+class BudgetedRetry(Retry):
+    """Retry that takes every retried request from `quota`, a
+    `quota.QuotaScheduler`, and gives up once it is denied
+    """
+
+    quota = None
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.quota = self.quota
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+
+        if self.quota is not None and not self.quota.acquire():
+            reason = error or ResponseError(
+                f"status {response.status}, no budget left to retry")
+            raise MaxRetryError(_pool, url, reason)
+
+        return retry
+
+
+def load_api_key():
+    """The key in keys.py, kept out of version control"""
+
+    from keys import key
+    return key
+
+
+class ProPublicaClient:
+    """Pooled, keep-alive client for the ProPublica Congress API.
+
+    Each worker process gets one `requests.Session`, so connections (and
+    their TLS handshakes) are reused across requests. Every call has a
+    connect/read timeout and idempotent GETs are retried with backoff.
+
+    Concurrent GETs of the same path and parameters share one upstream
+    call through `flights`, a `singleflight.SingleFlight`.
+
+    With a `quota` (a `quota.QuotaScheduler`) every upstream call, retries
+    included, must fit the budget. The last `stale_size` distinct results
+    are kept to answer with when it does not, or when the budget runs low.
+
+    Without an `api_key` the key is read from keys.py on the first call.
+    Configure from app config with `init_app`, like a Flask extension.
+    """
+
+    def __init__(self, api_key=None, base_url=BASE_URL, pool_size=10,
+                 connect_timeout=3.05, read_timeout=10, retries=2,
+                 backoff_factor=0.3, flights=None, quota=None,
+                 stale_size=512):
+        self.configure(api_key, base_url, pool_size, connect_timeout,
+                       read_timeout, retries, backoff_factor, flights, quota,
+                       stale_size)
+        self._session = None
+        self._session_pid = None
+        self._executor = None
+        self._executor_pid = None
+
+    def configure(self, api_key=None, base_url=BASE_URL, pool_size=10,
+                  connect_timeout=3.05, read_timeout=10, retries=2,
+                  backoff_factor=0.3, flights=None, quota=None,
+                  stale_size=512):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.flights = flights or SingleFlight()
+        self.quota = quota
+        self._stale = LRUBackend(maxsize=stale_size) if quota else None
+        # Sessions and pools are sized from the settings; rebuild on next use
+        self._session = None
+        self._executor = None
+
+    def init_app(self, app):
+        """Configure from PROPUBLICA_* settings, see app.create_app"""
+
+        config = app.config
+        coalesce_dir = config.get('PROPUBLICA_COALESCE_DIR')
+
+        self.configure(
+            config.get('PROPUBLICA_API_KEY'),
+            base_url=config.get('PROPUBLICA_BASE_URL', BASE_URL),
+            pool_size=config.get('PROPUBLICA_POOL_SIZE', 10),
+            connect_timeout=config.get('PROPUBLICA_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('PROPUBLICA_READ_TIMEOUT', 10),
+            retries=config.get('PROPUBLICA_RETRIES', 2),
+            flights=SingleFlight(
+                FileFlightStore(coalesce_dir) if coalesce_dir else None),
+            quota=QuotaScheduler(
+                per_second=config.get('PROPUBLICA_RATE_LIMIT', 10),
+                burst=config.get('PROPUBLICA_BURST', 20),
+                daily_limit=config.get('PROPUBLICA_DAILY_LIMIT', 5000),
+                background_share=config.get('PROPUBLICA_BACKGROUND_SHARE', 0.8)))
+
+    @property
+    def session(self):
+        """Return this process's session, creating it on first use"""
+
+        # A session created before a fork would share sockets with the parent
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = self._make_session()
+            self._session_pid = os.getpid()
+
+        return self._session
+
+    def _make_session(self):
+        # Retrying a 429 only spends more of the budget it says is spent
+        retry = BudgetedRetry(total=self.retries,
+                              backoff_factor=self.backoff_factor,
+                              status_forcelist=(500, 502, 503, 504))
+        retry.quota = self.quota
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.headers['X-API-Key'] = self.api_key or load_api_key()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def executor(self):
+        """Return this process's thread pool for concurrent fetches"""
+
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_size,
+                thread_name_prefix='propublica')
+            self._executor_pid = os.getpid()
+
+        return self._executor
+
+    def submit(self, call):
+        """Start the upstream call `call` on the thread pool; returns its future"""
+
+        return self.executor.submit(carry_context(call))
+
+    def result(self, future, timeout=None):
+        """The result of a `submit`ted call, waiting at most `timeout`
+        seconds; one that misses it is cancelled and raises UpstreamTimeout
+        """
+
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise UpstreamTimeout(f"Call did not finish within {timeout}s")
+
+    def gather(self, calls, timeout=None):
+        """Run independent upstream calls concurrently.
+
+        `calls` maps a name to a zero-argument callable, e.g.
+        `{'member': lambda: client.member(member_id)}`. Waits at most
+        `timeout` seconds for all of them and returns `(results, errors)`,
+        two dicts keyed by name. A call that raised or missed the deadline
+        appears in `errors` only.
+        """
+
+        futures = {name: self.submit(call) for name, call in calls.items()}
+        wait(futures.values(), timeout=timeout)
+
+        results = {}
+        errors = {}
+
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                errors[name] = UpstreamTimeout(
+                    f"{name} did not finish within {timeout}s")
+            elif future.exception() is not None:
+                errors[name] = future.exception()
+            else:
+                results[name] = future.result()
+
+        return results, errors
+
+    def get(self, path, **params):
+        """GET `path` relative to the API root and return its `results`.
+
+        Callers that coalesced onto one call get the same object back, so
+        treat it as read-only.
+        """
+
+        key = (path, tuple(sorted(params.items())))
+
+        with timed('upstream'):
+            return self.flights.do(key, lambda: self._get(key, path, params))
+
+    def _get(self, key, path, params):
+        if self.quota is not None:
+            entry = self._stale.get(key)
+
+            if entry is not None and self.quota.low():
+                self.quota.record_stale()
+                return entry[0]
+
+            if not self.quota.acquire():
+                if entry is None:
+                    raise QuotaExhausted(f"GET {path} is over the upstream budget")
+
+                self.quota.record_stale()
+                return entry[0]
+
+        try:
+            res = self.session.get(f"{self.base_url}{path}",
+                                   params=params or None,
+                                   timeout=self.timeout)
+            res.raise_for_status()
+            data = res.json()
+        except requests.Timeout as e:
+            raise UpstreamTimeout(f"GET {path} timed out: {e}") from e
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                raise NotFound(f"GET {path} found nothing") from e
+            raise ProPublicaError(f"GET {path} failed: {e}") from e
+        except (requests.RequestException, ValueError) as e:
+            raise ProPublicaError(f"GET {path} failed: {e}") from e
+
+        if data.get('status') == 'OK' and not data.get('results'):
+            raise NotFound(f"GET {path} returned no results")
+
+        if data.get('status') != 'OK':
+            if 'not found' in str(data.get('errors', '')).lower():
+                raise NotFound(f"GET {path} found nothing")
+            raise ProPublicaError(f"GET {path} returned status {data.get('status')}")
+
+        if self._stale is not None:
+            self._stale.set(key, data['results'], time.time())
+
+        return data['results']
+
+    # Typed accessors
+
+    def members(self, chamber, congress=CURRENT_CONGRESS):
+        """List of current members of `chamber` ('senate' or 'house')"""
+
+        return self.get(f"{congress}/{chamber}/members.json")[0]['members']
+
+    def member(self, member_id):
+        """Biographical and contact data for one member"""
+
+        return self.get(f"members/{member_id}.json")[0]
+
+    def member_votes(self, member_id, offset=0):
+        """A page (20 rows) of the member's most recent vote positions"""
+
+        return self.get(f"members/{member_id}/votes.json",
+                        offset=offset)[0]['votes']
+
+    def bill(self, bill_slug, congress=CURRENT_CONGRESS):
+        """Detail for one bill, e.g. `bill('hr1', 116)`"""
+
+        return self.get(f"{congress}/bills/{bill_slug}.json")[0]
+
+    def nominee(self, nomination_id, congress=CURRENT_CONGRESS):
+        """Detail for one nomination, e.g. `nominee('PN1', 116)`"""
+
+        return self.get(f"{congress}/nominees/{nomination_id}.json")[0]
+
+    def recent_bills(self, bill_type='introduced', chamber='both',
+                     congress=CURRENT_CONGRESS, offset=0):
+        """A page (20 rows) of the most recent bills of `bill_type`:
+        'introduced', 'updated', 'active', 'passed', 'enacted' or 'vetoed'
+        """
+
+        return self.get(f"{congress}/{chamber}/bills/{bill_type}.json",
+                        offset=offset)[0]['bills']
+
+    def search_bills(self, query, offset=0):
+        """A page (20 rows) of bills matching the phrase `query`"""
+
+        return self.get('bills/search.json', query=f'"{query}"',
+                        offset=offset)[0]['bills']
@@ -0,0 +1,249 @@
+"""Upstream request budget: a per-second token bucket and a daily allowance,
+shared out by priority.
+
+Interactive traffic (page views) may use the whole budget and waits briefly
+for a token. Background traffic (syncs, refreshes, prefetches) waits while
+any interactive call in this process is queued and stops short of the daily
+limit, leaving `1 - background_share` of the day's budget to page views.
+
+The counters live in a store. `LocalQuotaStore` counts for one process;
+`DatabaseQuotaStore` keeps them in a database row, so every web worker and
+the sync worker draw from one budget.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from sqlalchemy import text
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_priority = ContextVar('upstream_priority', default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def background():
+    """Make upstream calls in the `with` block at background priority"""
+
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _roll(state, rate, burst, now):
+    """Budget `state` as of `now`: the day's count reset at midnight UTC and
+    the tokens refilled since it was last updated
+    """
+
+    day, used, tokens, updated_at = state or (None, 0, burst, now)
+
+    today = datetime.utcfromtimestamp(now).date()
+    if day != today:
+        day, used = today, 0
+    if rate:
+        tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+    return day, used, tokens, now
+
+
+def _spend(state, limit, rate):
+    """Take one call from a rolled `state`.
+
+    Returns `(granted, wait, state)`: `wait` is how long until a token
+    comes, or None once `limit` calls were made today.
+    """
+
+    day, used, tokens, now = state
+
+    if limit and used >= limit:
+        return False, None, state
+    if rate:
+        if tokens < 1:
+            return False, (1 - tokens) / rate, state
+        tokens -= 1
+
+    return True, 0, (day, used + 1, tokens, now)
+
+
+class LocalQuotaStore:
+    """Budget counters of this process alone"""
+
+    def __init__(self):
+        self._state = None
+        self._lock = threading.Lock()
+
+    def take(self, limit, rate, burst):
+        """Spend one call if today's count is under `limit` (0 for none) and
+        the bucket has a token; returns `(granted, wait)`, see `_spend`
+        """
+
+        with self._lock:
+            state = _roll(self._state, rate, burst, time.time())
+            granted, wait, self._state = _spend(state, limit, rate)
+            return granted, wait
+
+    def usage(self, rate, burst):
+        """`(used_today, tokens)`"""
+
+        with self._lock:
+            day, used, tokens, now = _roll(self._state, rate, burst, time.time())
+            return used, tokens
+
+
+class DatabaseQuotaStore:
+    """Budget counters in the `upstream_budget` row called `name`, shared by
+    every process using the database.
+
+    `engine` is a function returning the SQLAlchemy engine. Each call locks
+    the row for one short transaction of its own, outside the caller's
+    session.
+    """
+
+    def __init__(self, engine, name='propublica'):
+        self.engine = engine
+        self.name = name
+
+    def take(self, limit, rate, burst):
+        with self.engine().begin() as conn:
+            conn.execute(text(
+                'INSERT INTO upstream_budget (name, day, used, tokens, updated_at) '
+                'VALUES (:name, :day, 0, :tokens, :now) ON CONFLICT (name) DO NOTHING'),
+                name=self.name, day=datetime.utcnow().date(), tokens=burst,
+                now=time.time())
+            row = conn.execute(text(
+                'SELECT day, used, tokens, updated_at FROM upstream_budget '
+                'WHERE name = :name FOR UPDATE'), name=self.name).fetchone()
+
+            state = _roll(tuple(row), rate, burst, time.time())
+            granted, wait, (day, used, tokens, now) = _spend(state, limit, rate)
+
+            conn.execute(text(
+                'UPDATE upstream_budget SET day = :day, used = :used, '
+                'tokens = :tokens, updated_at = :now WHERE name = :name'),
+                name=self.name, day=day, used=used, tokens=tokens, now=now)
+
+        return granted, wait
+
+    def usage(self, rate, burst):
+        with self.engine().connect() as conn:
+            row = conn.execute(text(
+                'SELECT day, used, tokens, updated_at FROM upstream_budget '
+                'WHERE name = :name'), name=self.name).fetchone()
+
+        day, used, tokens, now = _roll(row and tuple(row), rate, burst, time.time())
+        return used, tokens
+
+
+class QuotaScheduler:
+    """Grants upstream calls within `per_second` (bursting to `burst`) and
+    `daily_limit` (resetting at midnight UTC). A limit of 0 disables it.
+
+    The budget is counted in `store`, by default a `LocalQuotaStore`. The
+    granted, denied and stale counts in `metrics` are this process's.
+    """
+
+    def __init__(self, per_second=10, burst=20, daily_limit=5000,
+                 background_share=0.8, interactive_wait=0.5,
+                 background_wait=30, store=None):
+        self.per_second = per_second
+        self.burst = burst
+        self.daily_limit = daily_limit
+        self.background_share = background_share
+        self.waits = {INTERACTIVE: interactive_wait,
+                      BACKGROUND: background_wait}
+        self.store = store or LocalQuotaStore()
+
+        self._interactive_waiting = 0
+        self._cond = threading.Condition()
+        self._stats = {f"{outcome}_{priority}": 0
+                       for outcome in ('granted', 'denied')
+                       for priority in (INTERACTIVE, BACKGROUND)}
+        self._stats['served_stale'] = 0
+
+    def acquire(self, priority=None):
+        """Take one call from the budget, waiting up to this priority's wait.
+
+        Returns False if the budget is spent, or no token came in time.
+        """
+
+        priority = priority or current_priority()
+        deadline = time.monotonic() + self.waits[priority]
+        limit = self._limit(priority)
+
+        with self._cond:
+            if priority == INTERACTIVE:
+                self._interactive_waiting += 1
+        try:
+            while True:
+                # Background calls wait until no page view is queued here
+                wait = None
+                if priority == INTERACTIVE or self._interactive_waiting == 0:
+                    granted, wait = self.store.take(limit, self.per_second,
+                                                    self.burst)
+                    if granted:
+                        with self._cond:
+                            self._stats[f"granted_{priority}"] += 1
+                        return True
+                    if wait is None:
+                        break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with self._cond:
+                    self._cond.wait(min(remaining, wait or remaining))
+        finally:
+            if priority == INTERACTIVE:
+                with self._cond:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+        with self._cond:
+            self._stats[f"denied_{priority}"] += 1
+        return False
+
+    def low(self):
+        """True once the day's background share is used up: only page views
+        can still call upstream, so they should prefer stale data too
+        """
+
+        limit = self._limit(BACKGROUND)
+        used, tokens = self.store.usage(self.per_second, self.burst)
+        return bool(limit) and used >= limit
+
+    def record_stale(self):
+        """Count a call answered from stale data instead of upstream"""
+
+        with self._cond:
+            self._stats['served_stale'] += 1
+
+    def metrics(self):
+        """Budget left and calls granted, denied and served stale"""
+
+        used, tokens = self.store.usage(self.per_second, self.burst)
+
+        with self._cond:
+            metrics = dict(self._stats)
+        metrics['used_today'] = used
+        if self.daily_limit:
+            metrics['daily_limit'] = self.daily_limit
+            metrics['remaining_today'] = self.daily_limit - used
+        if self.per_second:
+            metrics['tokens'] = tokens
+
+        return metrics
+
+    def _limit(self, priority):
+        if priority == BACKGROUND:
+            return self.daily_limit * self.background_share
+        return self.daily_limit
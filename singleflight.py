@@ -0,0 +1,137 @@
+"""Coalesce concurrent identical calls into one in-flight call"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import green
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FileFlightStore:
+    """Extends single-flight across the worker processes of one host.
+
+    Each key has a file under `directory`. The process that holds its lock
+    (`flock`) makes the call and writes the JSON result into the file.
+    Processes that queued on the lock meanwhile read that result instead
+    of calling again, provided it was written after they started waiting.
+    Errors are not shared. Files untouched for `max_age` seconds are pruned.
+    """
+
+    def __init__(self, directory, max_age=600):
+        self.directory = directory
+        self.max_age = max_age
+        self._pruned_at = time.time()
+        os.makedirs(directory, exist_ok=True)
+
+    def do(self, key, func):
+        """Return `(result, shared)`, calling `func` unless another process
+        just did
+        """
+
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        started_at = time.time()
+
+        with open(os.path.join(self.directory, name), 'a+') as f:
+            # Waiting on the lock must not stall a gevent worker
+            green.run_blocking(fcntl.flock, f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_mtime >= started_at:
+                    f.seek(0)
+                    try:
+                        return json.load(f), True
+                    except ValueError:
+                        pass
+
+                result = func()
+
+                f.truncate(0)
+                json.dump(result, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        if started_at - self._pruned_at > self.max_age:
+            self.prune()
+
+        return result, False
+
+    def prune(self):
+        """Remove files of keys not fetched for `max_age` seconds"""
+
+        self._pruned_at = time.time()
+
+        for entry in os.scandir(self.directory):
+            try:
+                if self._pruned_at - entry.stat().st_mtime > self.max_age:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class SingleFlight:
+    """Run at most one call per key at a time in this process.
+
+    `do(key, func)` calls `func` unless a call for `key` is already in
+    flight, in which case it waits and returns that call's result (or
+    raises its exception). Nothing is cached: once a call finishes, the
+    next `do` for the key calls again.
+
+    With a `store` such as `FileFlightStore`, the one call made here is
+    also coalesced with calls in other processes.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.store is None:
+                call.result = func()
+            else:
+                call.result, shared = self.store.do(key, func)
+                if shared:
+                    with self._lock:
+                        self._stats['calls'] -= 1
+                        self._stats['shared'] += 1
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def metrics(self):
+        """Calls made, and calls answered by another call's result"""
+
+        with self._lock:
+            return dict(self._stats)
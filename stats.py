@@ -0,0 +1,186 @@
+"""Per-member vote statistics, aggregated over stored votes with NumPy"""
+
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, GovMembers, MemberVote, MemberVoteStats
+
+# Positions as int8 codes; 0 for none recorded, or one like 'Speaker'
+YES, NO, PRESENT, NOT_VOTING = 1, -1, 2, 3
+
+POSITIONS = {
+    'Yes': YES, 'Aye': YES, 'Yea': YES,
+    'No': NO, 'Nay': NO,
+    'Present': PRESENT,
+    'Not Voting': NOT_VOTING,
+}
+
+# Only members who are followed have votes stored, so a party's majority on
+# a roll call is counted only when at least this many other members of the
+# party have a yes or no vote stored for it
+MIN_PARTY_VOTERS = 10
+
+STAT_COLUMNS = ('total_votes', 'yes_votes', 'no_votes', 'present_votes',
+                'missed_votes', 'party_line_eligible', 'party_line_votes')
+
+# Computed by the database, so rows arrive as small ints rather than strings
+POSITION_CODE = db.case(POSITIONS, value=MemberVote.position, else_=0)
+# Unique per roll call, e.g. 1162000200 for '116-senate-2-200'
+ROLL_CALL_NUMBER = (MemberVote.congress * 10_000_000 +
+                    db.case([(MemberVote.chamber == 'house', 1_000_000)], else_=0) +
+                    MemberVote.session * 100_000 +
+                    MemberVote.roll_call)
+
+
+def aggregate(member, roll_call, code, party, members_count,
+              min_party_voters=MIN_PARTY_VOTERS):
+    """Count each member's votes over rows of parallel int arrays: who voted
+    (0 to `members_count` - 1), on which roll call, the position code, and
+    the voter's party (0 for none).
+
+    Returns a dict of `STAT_COLUMNS` arrays indexed by member. A yes or no
+    vote is on the party line when it matches how most *other* members of
+    the party voted on the roll call, as far as the rows tell. It only
+    counts when at least `min_party_voters` of them voted yes or no; ties
+    and members without a party don't count.
+    """
+
+    member = np.asarray(member, dtype=np.int64)
+    code = np.asarray(code, dtype=np.int8)
+    party = np.asarray(party, dtype=np.int64)
+    _, roll_call = np.unique(np.asarray(roll_call, dtype=np.int64), return_inverse=True)
+
+    yes = code == YES
+    no = code == NO
+
+    # Yes and no votes of each party on each roll call, less the voter's own
+    group = roll_call * (party.max(initial=0) + 1) + party
+    party_yes = np.bincount(group, weights=yes)[group] - yes
+    party_no = np.bincount(group, weights=no)[group] - no
+    majority = np.sign(party_yes - party_no).astype(np.int8)
+
+    eligible = ((yes | no) & (majority != 0) & (party != 0) &
+                (party_yes + party_no >= min_party_voters))
+
+    def count(mask):
+        return np.bincount(member, weights=mask, minlength=members_count).astype(np.int64)
+
+    return {
+        'total_votes': np.bincount(member, minlength=members_count).astype(np.int64),
+        'yes_votes': count(yes),
+        'no_votes': count(no),
+        'present_votes': count(code == PRESENT),
+        'missed_votes': count(code == NOT_VOTING),
+        'party_line_eligible': count(eligible),
+        'party_line_votes': count(eligible & (code == majority)),
+    }
+
+
+def load_positions(where):
+    """Stored positions matching `where`, as the member ids the rows refer
+    to by number and `aggregate`'s arrays
+    """
+
+    rows = db.session.execute(
+        db.select([MemberVote.member_id, ROLL_CALL_NUMBER, POSITION_CODE])
+        .where(db.and_(where, MemberVote.roll_call.isnot(None)))).fetchall()
+
+    numbers = {}
+    member = np.fromiter((numbers.setdefault(row[0], len(numbers)) for row in rows),
+                         dtype=np.int64, count=len(rows))
+    roll_call = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    code = np.fromiter((row[2] for row in rows), dtype=np.int8, count=len(rows))
+
+    member_ids = list(numbers)
+    parties = dict(db.session.query(GovMembers.id, GovMembers.party)
+                   .filter(GovMembers.id.in_(member_ids)))
+    party_numbers = {None: 0, '': 0}
+    member_party = np.array([party_numbers.setdefault(parties.get(member_id),
+                                                      len(party_numbers) - 1)
+                             for member_id in member_ids], dtype=np.int64)
+
+    return member_ids, member, roll_call, code, member_party[member]
+
+
+def changed_members():
+    """Ids of members with votes synced since their stats were computed"""
+
+    stats = MemberVoteStats
+    return [member_id for member_id, in
+            db.session.query(GovMembers.id)
+            .outerjoin(stats, stats.member_id == GovMembers.id)
+            .filter(GovMembers.votes_synced_through.isnot(None))
+            .filter(db.or_(stats.votes_through.is_(None),
+                           GovMembers.votes_synced_through != stats.votes_through))]
+
+
+def new_roll_calls(member_ids):
+    """Roll calls synced for `member_ids` since their stats were computed"""
+
+    stats = MemberVoteStats
+    return (db.session.query(MemberVote.vote_key)
+            .outerjoin(stats, stats.member_id == MemberVote.member_id)
+            .filter(MemberVote.member_id.in_(member_ids))
+            .filter(db.or_(stats.votes_through.is_(None),
+                           MemberVote.voted_at >= stats.votes_through)))
+
+
+def refresh_vote_stats(full=False, min_party_voters=MIN_PARTY_VOTERS):
+    """Recompute `member_vote_stats` for members whose votes changed.
+
+    A member's party-line figures depend on everyone else's positions on the
+    same roll calls, so besides members with newly synced votes, this redoes
+    every member who voted on one of those roll calls. Each batch is counted
+    in one pass by `aggregate`. With `full`, every member is redone, e.g.
+    after members change party or `min_party_voters` changes. Returns the
+    number of members updated.
+    """
+
+    if full:
+        where = db.true()
+        affected = None
+    else:
+        changed = changed_members()
+        if not changed:
+            return 0
+
+        # They and everyone else on their new roll calls
+        affected = set(changed)
+        affected.update(member_id for member_id, in
+                        db.session.query(MemberVote.member_id).distinct()
+                        .filter(MemberVote.vote_key.in_(new_roll_calls(changed).subquery())))
+
+        # Every position on the roll calls they voted on, so party
+        # majorities see all of them
+        where = MemberVote.vote_key.in_(
+            db.select([MemberVote.vote_key])
+            .where(MemberVote.member_id.in_(list(affected))))
+
+    member_ids, *positions = load_positions(where)
+    counts = aggregate(*positions, members_count=len(member_ids),
+                       min_party_voters=min_party_voters)
+
+    votes_through = dict(db.session.query(GovMembers.id, GovMembers.votes_synced_through)
+                         .filter(GovMembers.id.in_(member_ids)))
+    now = datetime.utcnow()
+    stat_rows = [
+        dict({column: int(counts[column][number]) for column in STAT_COLUMNS},
+             member_id=member_id, votes_through=votes_through.get(member_id),
+             updated_at=now)
+        for number, member_id in enumerate(member_ids)
+        if affected is None or member_id in affected
+    ]
+
+    if not stat_rows:
+        return 0
+
+    stmt = insert(MemberVoteStats.__table__).values(stat_rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['member_id'],
+        set_={column: stmt.excluded[column]
+              for column in stat_rows[0] if column != 'member_id'}))
+    db.session.commit()
+
+    return len(stat_rows)
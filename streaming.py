@@ -0,0 +1,86 @@
+"""Streamed template rendering for large pages"""
+
+from flask import (Response, current_app, get_flashed_messages, render_template,
+                   request, stream_with_context)
+from markupsafe import Markup
+
+from instrumentation import timed
+
+# Templates print `{{ stream_flush }}` where a streamed page should send what
+# it has so far; rendered as usual it is undefined and prints nothing
+STREAM_FLUSH = Markup('<!-- stream flush -->')
+
+# Closes the content container, body and page opened by base.html
+STREAM_ERROR_HTML = (
+    '<div class="alert alert-danger mt-3">Sorry! Something went wrong while '
+    'loading the rest of this page. Please try again.</div></div></body></html>'
+)
+
+
+def stream_template(template_name, **context):
+    """Like `render_template`, but send the page as it renders.
+
+    The page goes out in chunks of STREAM_BUFFER_SIZE template outputs, and
+    at each `stream_flush`: base.html has one before the content block, so
+    the head and navigation go first. An error before the first chunk is
+    raised as usual; once the response has started, it is logged and the
+    page is closed with an error notice.
+    """
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    context['stream_flush'] = STREAM_FLUSH
+
+    # Pop flashed messages now: the session cookie is sent before the body
+    get_flashed_messages(with_categories=True)
+
+    template = app.jinja_env.get_template(template_name)
+    stream = chunks(template.generate(context), app.config.get('STREAM_BUFFER_SIZE', 32))
+
+    # Only the first chunk is rendered before Server-Timing is sent
+    with timed('render'):
+        first = next(stream, '')
+
+    def generate():
+        yield first
+        try:
+            yield from stream
+        except Exception:
+            app.logger.exception('Error while streaming %s', template_name)
+            yield STREAM_ERROR_HTML
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+def chunks(events, size):
+    """Join a template's outputs into chunks of `size`, ending one early at
+    each `STREAM_FLUSH`
+    """
+
+    buffer = []
+
+    for event in events:
+        if event == STREAM_FLUSH:
+            if buffer:
+                yield ''.join(buffer)
+                buffer = []
+            continue
+
+        buffer.append(event)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_page(template_name, **context):
+    """Render with `stream_template` if the current route is configured to
+    stream (the STREAMED_ROUTES config set of endpoint names), else as usual.
+    """
+
+    if request.endpoint in current_app.config.get('STREAMED_ROUTES', ()):
+        return stream_template(template_name, **context)
+
+    return render_template(template_name, **context)
@@ -0,0 +1,267 @@
+"""Bulk sync of ProPublica data into the local database"""
+
+import logging
+import time
+from datetime import date, datetime
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, Bill, GovMembers, Likes, MemberVote
+from stats import refresh_vote_stats
+
+log = logging.getLogger(__name__)
+
+CHAMBERS = ('senate', 'house')
+VOTES_PER_PAGE = 20
+BILLS_PER_PAGE = 20
+BILL_TYPES = ('introduced', 'updated')
+
+
+def roster_rows(chamber, members):
+    """Map upstream roster entries onto `govmembers` columns"""
+
+    now = datetime.utcnow()
+
+    return [
+        {
+            'id': member['id'],
+            'first_name': member['first_name'],
+            'last_name': member['last_name'],
+            'party': member.get('party'),
+            'state': member.get('state'),
+            'chamber': chamber,
+            'in_office': member.get('in_office'),
+            'updated_at': now,
+        }
+        for member in members
+    ]
+
+
+def sync_rosters(client, chambers=CHAMBERS):
+    """Upsert the full roster of each chamber into `govmembers`.
+
+    Both rosters are fetched first and written in a single statement, so a
+    failed fetch leaves the table untouched. Returns the number of rows.
+    """
+
+    rows = {}
+    for chamber in chambers:
+        for row in roster_rows(chamber, client.members(chamber)):
+            # Members who moved chambers appear in both rosters; a statement
+            # may only upsert each id once, so keep the seat they hold now.
+            if row['id'] in rows and not row['in_office']:
+                continue
+            rows[row['id']] = row
+
+    rows = list(rows.values())
+    if not rows:
+        return 0
+
+    stmt = insert(GovMembers.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={column: stmt.excluded[column]
+              for column in rows[0] if column != 'id'}
+    )
+
+    db.session.execute(stmt)
+    db.session.commit()
+
+    return len(rows)
+
+
+def vote_key(vote):
+    """Identify a roll call, e.g. '116-senate-2-200'"""
+
+    return (f"{vote['congress']}-{vote['chamber'].lower()}-"
+            f"{vote['session']}-{vote['roll_call']}")
+
+
+def voted_at(vote):
+    return datetime.strptime(f"{vote['date']} {vote.get('time') or '00:00:00'}",
+                             '%Y-%m-%d %H:%M:%S')
+
+
+def member_vote_key(vote):
+    """The `MemberVote.key` an upstream vote is stored under"""
+
+    return voted_at(vote), vote_key(vote)
+
+
+def vote_rows(member_id, votes):
+    """Map upstream `votes.json` entries onto `member_votes` columns"""
+
+    rows = []
+    for vote in votes:
+        bill = vote.get('bill') or {}
+        rows.append({
+            'member_id': member_id,
+            'vote_key': vote_key(vote),
+            'voted_at': voted_at(vote),
+            'chamber': vote['chamber'].lower(),
+            'congress': int(vote['congress']),
+            'session': int(vote['session']),
+            'roll_call': int(vote['roll_call']),
+            'position': vote.get('position'),
+            'question': vote.get('question'),
+            'description': vote.get('description'),
+            'result': vote.get('result'),
+            'bill_id': bill.get('bill_id'),
+            'bill_title': bill.get('title'),
+            'bill_latest_action': bill.get('latest_action'),
+        })
+
+    return rows
+
+
+def sync_member_votes(client, member, max_pages=25):
+    """Pull the member's votes newer than their high-water mark.
+
+    Pages back from the most recent vote until reaching one already stored,
+    or `max_pages` pages on a member's first sync; `votes_complete` records
+    whether that got to their first vote. Returns the number of new rows.
+    """
+
+    high_water = member.votes_synced_through
+    rows = []
+    complete = False
+
+    for page in range(max_pages):
+        votes = client.member_votes(member.id, offset=page * VOTES_PER_PAGE)
+        page_rows = vote_rows(member.id, votes)
+
+        rows.extend(row for row in page_rows
+                    if high_water is None or row['voted_at'] >= high_water)
+
+        reached_stored = (high_water is not None and page_rows and
+                          page_rows[-1]['voted_at'] < high_water)
+        if reached_stored or len(votes) < VOTES_PER_PAGE:
+            complete = len(votes) < VOTES_PER_PAGE
+            break
+
+    if not rows:
+        return 0
+
+    if high_water is None:
+        member.votes_complete = complete
+
+    stmt = insert(MemberVote.__table__).values(rows)
+    result = db.session.execute(stmt.on_conflict_do_nothing())
+    member.votes_synced_through = max(row['voted_at'] for row in rows)
+    db.session.commit()
+
+    return result.rowcount
+
+
+def followed_members():
+    """Members that at least one user follows; only their votes are synced"""
+
+    return (GovMembers.query
+            .join(Likes, Likes.item_id == GovMembers.id)
+            .distinct()
+            .all())
+
+
+def sync_followed_votes(client, max_pages=25):
+    """Sync vote history for every followed member, then their vote stats.
+
+    A failure for one member is logged and does not stop the others.
+    Returns the total number of new rows.
+    """
+
+    total = 0
+
+    for member in followed_members():
+        try:
+            total += sync_member_votes(client, member, max_pages=max_pages)
+        except Exception:
+            db.session.rollback()
+            log.exception('Vote sync for %s failed', member.id)
+
+    try:
+        refresh_vote_stats()
+    except Exception:
+        db.session.rollback()
+        log.exception('Vote stats refresh failed')
+
+    return total
+
+
+def run_vote_sync_worker(client, interval, max_pages=25):
+    """Sync followed members' votes every `interval` seconds, forever"""
+
+    while True:
+        started = time.monotonic()
+        count = sync_followed_votes(client, max_pages=max_pages)
+        log.info('Synced %d new votes', count)
+
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def bill_rows(bills):
+    """Map upstream bill entries onto `bills` columns"""
+
+    now = datetime.utcnow()
+    rows = {}
+
+    for bill in bills:
+        rows[bill['bill_id']] = {
+            'bill_id': bill['bill_id'],
+            'congress': int(bill['bill_id'].rsplit('-', 1)[1]),
+            'short_title': bill.get('short_title'),
+            'title': bill.get('title'),
+            'summary': bill.get('summary'),
+            'primary_subject': bill.get('primary_subject'),
+            'introduced_date': parse_date(bill.get('introduced_date')),
+            'payload': bill,
+            'updated_at': now,
+        }
+
+    return list(rows.values())
+
+
+def upsert_bills(bills):
+    """Insert or refresh upstream bill entries in the search index"""
+
+    rows = bill_rows(bills)
+    if not rows:
+        return 0
+
+    stmt = insert(Bill.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['bill_id'],
+        set_={column: stmt.excluded[column]
+              for column in rows[0] if column != 'bill_id'}
+    )
+
+    db.session.execute(stmt)
+    db.session.commit()
+
+    return len(rows)
+
+
+def load_bills(client, bill_types=BILL_TYPES, max_pages=50):
+    """Page through the recent bill lists and index every bill.
+
+    Returns the number of rows written.
+    """
+
+    total = 0
+
+    for bill_type in bill_types:
+        for page in range(max_pages):
+            bills = client.recent_bills(bill_type,
+                                        offset=page * BILLS_PER_PAGE)
+            total += upsert_bills(bills)
+
+            if len(bills) < BILLS_PER_PAGE:
+                break
+
+    return total
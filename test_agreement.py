@@ -0,0 +1,113 @@
+"""Member agreement matrix tests"""
+
+# run these tests like:
+#    python -m unittest test_agreement.py
+
+from app import create_app, agreement_matrix  # nopep8
+from unittest import TestCase
+
+import numpy as np
+
+from agreement import Agreement, AgreementMatrix, tallies
+from models import db, GovMembers
+from test_vote_stats import add_votes
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False, "AGREEMENT_MIN_SHARED": 1})
+
+db.create_all()
+
+
+class TalliesTestCase(TestCase):
+    """Test agreement counts from a positions block"""
+
+    def test_tallies(self):
+        positions = np.array([[1, 1, -1, 0],
+                              [1, -1, -1, 1],
+                              [0, 0, 0, 0]], dtype=np.int8)
+        shared, net = tallies(positions)
+
+        self.assertEqual(shared.tolist(), [[3, 3, 0], [3, 4, 0], [0, 0, 0]])
+        agreement = Agreement(['A', 'B', 'C'], shared, net)
+        self.assertEqual(agreement.between('A', 'B'), (2, 3))
+        self.assertEqual(agreement.between('A', 'C'), (0, 0))
+        self.assertIsNone(agreement.between('A', 'D'))
+
+    def test_similar(self):
+        positions = np.array([[1, 1, 1, 1],
+                              [1, 1, 1, -1],
+                              [-1, -1, 1, 1],
+                              [1, 0, 0, 0]], dtype=np.int8)
+        agreement = Agreement(['A', 'B', 'C', 'D'], *tallies(positions))
+
+        self.assertEqual(agreement.similar('A'), [('D', 1, 1), ('B', 3, 4), ('C', 2, 4)])
+        self.assertEqual(agreement.similar('A', least=True, limit=1), [('C', 2, 4)])
+        self.assertEqual(agreement.similar('A', min_shared=2), [('B', 3, 4), ('C', 2, 4)])
+
+
+class AgreementMatrixTestCase(TestCase):
+    """Test building the matrix from stored votes and updating it"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        agreement_matrix.clear()
+
+        self.sanders = GovMembers(id='S000033', first_name='Bernard',
+                                  last_name='Sanders', party='ID')
+        self.schatz = GovMembers(id='S001194', first_name='Brian',
+                                 last_name='Schatz', party='D')
+        self.mcconnell = GovMembers(id='M000355', first_name='Mitch',
+                                    last_name='McConnell', party='R')
+        db.session.add_all([self.sanders, self.schatz, self.mcconnell])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_incremental_matches_full_build(self):
+        matrix = AgreementMatrix(check_every=0)
+        add_votes(self.sanders, ['Yes', 'Yes', 'No'])
+        add_votes(self.schatz, ['Yes', 'No', 'No'])
+
+        self.assertEqual(matrix.get().between('S000033', 'S001194'), (2, 3))
+        self.assertNotIn('M000355', matrix.get())
+
+        # New roll calls, and a newly synced member's history
+        add_votes(self.sanders, ['No', 'Not Voting'], first_roll_call=4)
+        add_votes(self.schatz, ['No', 'Yes'], first_roll_call=4)
+        add_votes(self.mcconnell, ['No', 'Yes', 'Yes', 'Yes', 'Yes'])
+
+        incremental = matrix.get()
+        full = AgreementMatrix().get()
+
+        self.assertEqual(incremental.between('S000033', 'S001194'), (3, 4))
+        self.assertEqual(incremental.between('S000033', 'M000355'), (1, 4))
+        for a in ('S000033', 'S001194', 'M000355'):
+            for b in ('S000033', 'S001194', 'M000355'):
+                self.assertEqual(incremental.between(a, b), full.between(a, b))
+
+    def test_pages(self):
+        add_votes(self.sanders, ['Yes', 'Yes', 'No'])
+        add_votes(self.schatz, ['Yes', 'No', 'No'])
+        add_votes(self.mcconnell, ['No', 'No', 'Yes'])
+
+        res = self.client.get('/api/v1/members/S000033/similar?order=least')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(member['id'], member['agreed'], member['shared'])
+                          for member in res.get_json()['members']],
+                         [('M000355', 0, 3), ('S001194', 2, 3)])
+
+        res = self.client.get('/api/v1/members/S000033/agreement/S001194')
+        self.assertEqual(res.get_json()['agreed'], 2)
+
+        res = self.client.get('/compare/S000033/S001194')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Brian Schatz', res.get_data(as_text=True))
+
+        self.assertEqual(self.client.get('/compare/P000197').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/members/P000197/similar').status_code, 404)
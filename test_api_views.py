@@ -0,0 +1,178 @@
+"""JSON API view tests"""
+
+# run these tests like:
+#    python -m unittest test_api_views.py
+
+from app import create_app, api_cache, member_index, page_cache, propublica  # nopep8
+from propublica import ProPublicaError, QuotaExhausted, UpstreamTimeout
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, GovMembers, Likes, User
+from sync import sync_member_votes
+from test_member_vote_model import FakeClient
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+class ApiViewsTestCase(TestCase):
+    """Test roster responses, conditional GETs and vote pages"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        api_cache.backend.clear()
+        page_cache.backend.clear()
+        member_index.clear()
+
+        db.session.add_all([
+            GovMembers(id='S000033', first_name='Bernard', last_name='Sanders',
+                       party='ID', state='VT', chamber='senate', in_office=True),
+            GovMembers(id='M000355', first_name='Mitch', last_name='McConnell',
+                       party='R', state='KY', chamber='senate', in_office=True),
+        ])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_roster(self):
+        res = self.client.get('/api/v1/rosters/senate?state=vt')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['members'], [{
+            'id': 'S000033', 'first_name': 'Bernard', 'last_name': 'Sanders',
+            'party': 'ID', 'state': 'VT', 'in_office': True,
+        }])
+        self.assertIn('max-age', res.headers['Cache-Control'])
+
+    def test_if_none_match(self):
+        etag = self.client.get('/api/v1/rosters/senate').headers['ETag']
+
+        res = self.client.get('/api/v1/rosters/senate',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        res = self.client.get('/api/v1/rosters/senate',
+                              headers={'If-None-Match': '"stale"'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_unknown_chamber(self):
+        res = self.client.get('/api/v1/rosters/council')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.get_json(), {'error': 'Not found'})
+
+    def test_member_search(self):
+        db.session.add(GovMembers(id='P000197', first_name='Nancy', last_name='Pelosi',
+                                  party='D', state='CA', chamber='house', in_office=True))
+        db.session.commit()
+
+        res = self.client.get('/api/v1/members/search?q=mit')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['members'], [{
+            'id': 'M000355', 'first_name': 'Mitch', 'last_name': 'McConnell',
+            'party': 'R', 'state': 'KY', 'in_office': True, 'chamber': 'senate',
+        }])
+
+        res = self.client.get('/api/v1/members/search?q=n')
+        self.assertEqual([member['chamber'] for member in res.get_json()['members']],
+                         ['house'])
+
+        res = self.client.get('/api/v1/members/search')
+        self.assertEqual(res.status_code, 400)
+
+    def follow(self, member_id):
+        user = User(email='tester@test.com', username='tester', password='x')
+        db.session.add(user)
+        db.session.flush()
+        Likes.follow(user.id, [member_id])
+        db.session.commit()
+        return user.id
+
+    def test_member_votes_cursors(self):
+        self.follow('S000033')
+        sync_member_votes(FakeClient(25), GovMembers.query.get('S000033'))
+
+        first = self.client.get('/api/v1/members/S000033/votes').get_json()
+        self.assertEqual(first['votes'][0]['roll_call'], 25)
+        self.assertIsNone(first['newer'])
+
+        second = self.client.get(
+            f"/api/v1/members/S000033/votes?cursor={first['older']}").get_json()
+        self.assertEqual([vote['roll_call'] for vote in second['votes']],
+                         [5, 4, 3, 2, 1])
+        self.assertIsNone(second['older'])
+
+        back = self.client.get(
+            f"/api/v1/members/S000033/votes?cursor={second['newer']}").get_json()
+        self.assertEqual(back['votes'], first['votes'])
+
+    def test_member_votes_past_synced(self):
+        self.follow('S000033')
+        # The first sync stops 40 votes back
+        sync_member_votes(FakeClient(100), GovMembers.query.get('S000033'), max_pages=2)
+        # and 5 more have been cast since the last one
+        upstream = FakeClient(105)
+
+        def roll_calls(page):
+            # upstream has them as strings
+            return [int(vote['roll_call']) for vote in page['votes']]
+
+        with patch.object(propublica, 'member_votes', upstream.member_votes):
+            pages = [self.client.get('/api/v1/members/S000033/votes').get_json()]
+            while pages[-1]['older'] and len(pages) < 10:
+                pages.append(self.client.get(
+                    f"/api/v1/members/S000033/votes?cursor={pages[-1]['older']}").get_json())
+
+            # Every vote once, synced ones first
+            self.assertEqual(sum((roll_calls(page) for page in pages), []),
+                             list(range(100, 0, -1)))
+
+            # Back from upstream to the last synced page
+            back = self.client.get(
+                f"/api/v1/members/S000033/votes?cursor={pages[2]['newer']}").get_json()
+            self.assertEqual(roll_calls(back), roll_calls(pages[1]))
+            self.assertEqual(back['older'], pages[1]['older'])
+
+    def test_member_votes_unfollowed(self):
+        user_id = self.follow('S000033')
+        sync_member_votes(FakeClient(25), GovMembers.query.get('S000033'))
+        Likes.unfollow(user_id, ['S000033'])
+        db.session.commit()
+
+        # No longer synced, so upstream has the latest
+        with patch.object(propublica, 'member_votes', FakeClient(30).member_votes):
+            res = self.client.get('/api/v1/members/S000033/votes').get_json()
+        self.assertEqual(res['votes'][0]['roll_call'], '30')
+
+    def test_unsynced_roster_upstream_down(self):
+        # No house members synced, so both go upstream
+        with patch.object(propublica, 'members', side_effect=ProPublicaError('down')):
+            roster = self.client.get('/api/v1/rosters/house')
+            search = self.client.get('/api/v1/members/search?q=pel')
+
+        for res in (roster, search):
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('error', res.get_json())
+
+    def test_upstream_error_statuses(self):
+        with patch.object(propublica, 'member_votes', side_effect=UpstreamTimeout('slow')):
+            votes = self.client.get('/api/v1/members/X000001/votes')
+        with patch.object(propublica, 'bill', side_effect=QuotaExhausted('spent')):
+            bill = self.client.get('/api/v1/bills/hr9998-116')
+        with patch.object(propublica, 'search_bills', side_effect=ProPublicaError('down')):
+            search = self.client.get('/api/v1/bills/search?q=nothinglocal')
+
+        for res, status in ((votes, 504), (bill, 503), (search, 502)):
+            self.assertEqual(res.status_code, status)
+            self.assertIn('error', res.get_json())
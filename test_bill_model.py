@@ -0,0 +1,71 @@
+"""Bill model and search index tests"""
+
+# run these tests like:
+#    python -m unittest test_bill_model.py
+
+from app import create_app, propublica  # nopep8
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Bill
+from propublica import UpstreamTimeout
+from sync import upsert_bills
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+class BillModelTestCase(TestCase):
+    """Test full-text search over indexed bills"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        upsert_bills([
+            {'bill_id': 'hr1-116', 'short_title': 'For the People Act of 2019',
+             'title': 'To expand Americans\' access to the ballot box in federal elections',
+             'primary_subject': 'Government Operations and Politics',
+             'summary': 'Addresses voter access and election integrity.',
+             'introduced_date': '2019-01-03'},
+            {'bill_id': 's1-116', 'short_title': 'Strengthening America\'s Security Act',
+             'title': 'To make improvements to certain defense programs',
+             'primary_subject': 'International Affairs',
+             'summary': 'Includes provisions on election security grants.',
+             'introduced_date': '2019-01-03'},
+            {'bill_id': 'hr748-116', 'short_title': 'CARES Act',
+             'title': 'Middle Class Health Benefits Tax Repeal Act',
+             'primary_subject': 'Taxation', 'summary': None,
+             'introduced_date': 'not a date'},
+        ])
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_search_ranks_title_matches_first(self):
+        bills = Bill.search('election')
+        self.assertEqual([b.bill_id for b in bills], ['hr1-116', 's1-116'])
+
+        self.assertEqual([b.bill_id for b in Bill.search('ballot')], ['hr1-116'])
+
+    def test_search_stems_words(self):
+        self.assertEqual([b.bill_id for b in Bill.search('taxes')], ['hr748-116'])
+
+    def test_upsert_refreshes_bill(self):
+        upsert_bills([{'bill_id': 'hr748-116', 'short_title': 'CARES Act',
+                       'title': 'Coronavirus Aid, Relief, and Economic Security Act'}])
+
+        self.assertEqual(Bill.search('taxes'), [])
+        self.assertEqual(Bill.query.get('hr748-116').payload['short_title'],
+                         'CARES Act')
+
+    def test_search_page_upstream_timeout(self):
+        client = app.test_client()
+        with patch.object(propublica, 'search_bills', side_effect=UpstreamTimeout('slow')):
+            res = client.get('/search/bill?search-form-input=nothinglocal')
+
+        self.assertEqual(res.status_code, 504)
@@ -0,0 +1,104 @@
+"""Read replica routing and statement timeout tests"""
+
+# run these tests like:
+#    python -m unittest test_db_routing.py
+
+import time
+from unittest import TestCase
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, CURR_USER_KEY, PRIMARY_UNTIL_KEY  # nopep8
+from models import db, use_primary, statement_timeout, REPLICA, User, GovMembers
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+class DbRoutingTestCase(TestCase):
+    """Test which engine a session's statements use, and their time limits"""
+
+    def setUp(self):
+        # The replica is the same database through its own engine
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA: "postgresql:///voter-test"}
+        self.context = app.app_context()
+        self.context.push()
+
+        db.drop_all()
+        db.create_all()
+        db.session.add(GovMembers(id='S000033', first_name='Bernard', last_name='Sanders',
+                                  party='ID', state='VT', chamber='senate', in_office=True))
+        db.session.commit()
+        db.session.remove()
+
+        self.primary = db.get_engine(app)
+        self.replica = db.get_engine(app, bind=REPLICA)
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+        self.context.pop()
+        app.config['SQLALCHEMY_BINDS'] = {}
+
+    def bind(self, query):
+        return db.session.get_bind(clause=query.statement)
+
+    def test_reads_from_replica_until_a_write(self):
+        query = GovMembers.query.filter_by(id='S000033')
+        self.assertIs(self.bind(query), self.replica)
+        self.assertEqual(query.one().last_name, 'Sanders')
+
+        # Locking reads need the primary
+        self.assertIs(self.bind(query.with_for_update()), self.primary)
+
+        db.session.add(GovMembers(id='M000355', first_name='Mitch', last_name='McConnell',
+                                  party='R', state='KY', chamber='senate', in_office=True))
+        db.session.flush()
+
+        # Its own, uncommitted, write is visible
+        self.assertIs(self.bind(query), self.primary)
+        self.assertEqual(GovMembers.query.count(), 2)
+
+        db.session.commit()
+        self.assertIs(self.bind(query), self.primary)
+
+        # A new session starts on the replica again
+        db.session.remove()
+        self.assertIs(self.bind(query), self.replica)
+
+    def test_use_primary(self):
+        use_primary()
+        self.assertIs(self.bind(GovMembers.query), self.primary)
+
+    def test_no_replica_configured(self):
+        app.config['SQLALCHEMY_BINDS'] = {}
+        self.assertIs(self.bind(GovMembers.query), self.primary)
+
+    def test_statement_timeout(self):
+        timeout = db.session.execute('SHOW statement_timeout').scalar()
+        self.assertEqual(timeout, '15s')
+
+        with self.assertRaises(OperationalError):
+            with statement_timeout(50):
+                db.session.execute('SELECT pg_sleep(0.5)')
+        db.session.rollback()
+
+        with statement_timeout(0):
+            self.assertEqual(db.session.execute('SHOW statement_timeout').scalar(), '0')
+        self.assertEqual(db.session.execute('SHOW statement_timeout').scalar(), '15s')
+
+    def test_likes_read_from_primary_for_a_while(self):
+        user = User.signup('tester', 'tester@test.com', 'password')
+        db.session.commit()
+        user_id = user.id
+        db.session.remove()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        client.get('/users/like/S000033/delete')
+        with client.session_transaction() as sess:
+            self.assertGreater(sess[PRIMARY_UNTIL_KEY], time.time())
@@ -0,0 +1,109 @@
+"""Bill and nomination detail cache tests"""
+
+# run these tests like:
+#    python -m unittest test_detail_cache.py
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from cache import TTLCache, LRUBackend, DiskBackend, TieredBackend
+from app import detail_is_final, detail_ttl  # nopep8
+
+
+def blobs(directory):
+    return sorted(name for entry in os.scandir(directory) if entry.is_dir()
+                  for name in os.listdir(entry.path))
+
+
+class DetailCacheTestCase(TestCase):
+    """Test the disk tier, the memory tier in front of it, and status-aware TTLs"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.disk = DiskBackend(self.directory, max_bytes=10_000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disk_round_trip_shared_by_content(self):
+        bill = {'bill_id': 'hr1-116', 'summary': 'For the People Act ' * 50}
+
+        self.disk.set('detail:hr1-116', bill, 100.0)
+        self.disk.set('detail:hr1-116-copy', dict(bill), 200.0)
+
+        self.assertEqual(self.disk.get('detail:hr1-116'), (bill, 100.0))
+        self.assertEqual(len(blobs(self.directory)), 1)
+
+        entries, size = self.disk.size()
+        self.assertEqual(entries, 2)
+        # compressed well below the ~1kB of JSON
+        self.assertLess(size, 200)
+
+        # Another worker sees it
+        other = DiskBackend(self.directory)
+        self.assertEqual(other.get('detail:hr1-116-copy'), (bill, 200.0))
+
+    def test_replaced_and_deleted_files_are_removed(self):
+        self.disk.set('detail:s1-116', {'active': True}, 1.0)
+        self.disk.set('detail:s1-116', {'active': False}, 2.0)
+        self.assertEqual(len(blobs(self.directory)), 1)
+
+        self.disk.delete('detail:s1-116')
+        self.assertIsNone(self.disk.get('detail:s1-116'))
+        self.assertEqual(blobs(self.directory), [])
+
+    def test_least_recently_read_evicted(self):
+        for n in range(10):
+            # incompressible, so each file is ~2kB
+            self.disk.set(f"detail:hr{n}-116", os.urandom(1000).hex(), time.time())
+            self.disk.get('detail:hr0-116')
+
+        self.assertIsNotNone(self.disk.get('detail:hr0-116'))
+        self.assertIsNone(self.disk.get('detail:hr1-116'))
+        self.assertLessEqual(self.disk.size()[1], 10_000)
+        self.assertEqual(len(blobs(self.directory)), self.disk.size()[0])
+
+    def test_memory_tier_in_front(self):
+        tiers = TieredBackend(LRUBackend(maxsize=1), self.disk)
+        tiers.set('detail:hr1-116', ['bill', {'congress': '116'}], 1.0)
+        tiers.set('detail:hr2-116', ['bill', {'congress': '116'}], 1.0)
+
+        tiers.get('detail:hr2-116')
+        tiers.get('detail:hr1-116')
+        tiers.get('detail:hr1-116')
+        tiers.get('detail:hr3-116')
+
+        metrics = tiers.metrics()
+        self.assertEqual((metrics['memory_hits'], metrics['disk_hits'],
+                          metrics['misses']), (2, 1, 1))
+        self.assertEqual(metrics['disk_entries'], 2)
+
+    def test_ttl_by_status(self):
+        ttl = detail_ttl(60, 3600)
+        cache = TTLCache(LRUBackend(), ttl=ttl, max_stale=0)
+
+        active = ['bill', {'congress': '116', 'enacted': None}]
+        enacted = ['bill', {'congress': '116', 'enacted': '2020-03-27'}]
+        self.assertEqual(ttl(active), 60)
+        self.assertEqual(ttl(enacted), 3600)
+
+        cache.backend.set('active', active, time.time() - 120)
+        cache.backend.set('enacted', enacted, time.time() - 120)
+        calls = []
+
+        cache.get('active', lambda: calls.append('active') or active)
+        cache.get('enacted', lambda: calls.append('enacted') or enacted)
+        self.assertEqual(calls, ['active'])
+
+    def test_final_details(self):
+        self.assertTrue(detail_is_final('bill', {'congress': '116', 'vetoed': '2020-05-06'}))
+        self.assertTrue(detail_is_final('bill', {'congress': '115'}))
+        self.assertTrue(detail_is_final('bill', {
+            'congress': '116', 'latest_major_action': 'Failed of passage in Senate.'}))
+        self.assertFalse(detail_is_final('bill', {
+            'congress': '116', 'latest_major_action': 'Received in the Senate.'}))
+        self.assertTrue(detail_is_final('nomination', {'status': 'Confirmed'}))
+        self.assertFalse(detail_is_final('nomination', {'status': 'Referred to Committee'}))
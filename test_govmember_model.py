@@ -0,0 +1,115 @@
+"""GovMembers model and roster sync tests"""
+
+# run these tests like:
+#    python -m unittest test_govmember_model.py
+
+from app import create_app, get_roster  # nopep8
+from unittest import TestCase
+
+from models import db, upgrade_schema, GovMembers, Likes
+from sync import sync_rosters
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+# The tables as first released, before roster sync
+ORIGINAL_SCHEMA = """
+CREATE TABLE users (id SERIAL PRIMARY KEY, email TEXT NOT NULL UNIQUE,
+                    username TEXT NOT NULL UNIQUE, password TEXT NOT NULL);
+CREATE TABLE govmembers (id VARCHAR PRIMARY KEY, first_name VARCHAR NOT NULL,
+                         last_name VARCHAR NOT NULL);
+CREATE TABLE likes (id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+                    item_id VARCHAR REFERENCES govmembers (id) ON DELETE CASCADE);
+"""
+
+
+class FakeClient:
+    """Stands in for ProPublicaClient with fixed rosters"""
+
+    def __init__(self, rosters):
+        self.rosters = rosters
+
+    def members(self, chamber):
+        return self.rosters[chamber]
+
+
+class GovMemberModelTestCase(TestCase):
+    """Test roster sync into govmembers"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.client = FakeClient({
+            'senate': [
+                {'id': 'S000033', 'first_name': 'Bernard', 'last_name': 'Sanders',
+                 'party': 'ID', 'state': 'VT', 'in_office': True},
+                {'id': 'M000355', 'first_name': 'Mitch', 'last_name': 'McConnell',
+                 'party': 'R', 'state': 'KY', 'in_office': True},
+            ],
+            'house': [
+                {'id': 'P000197', 'first_name': 'Nancy', 'last_name': 'Pelosi',
+                 'party': 'D', 'state': 'CA', 'in_office': True},
+            ],
+        })
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_sync_inserts_rosters(self):
+        self.assertEqual(sync_rosters(self.client), 3)
+
+        pelosi = GovMembers.query.get('P000197')
+        self.assertEqual(pelosi.chamber, 'house')
+        self.assertEqual(pelosi.state, 'CA')
+
+    def test_sync_updates_liked_member(self):
+        db.session.add(GovMembers(id='S000033', first_name='Bernie',
+                                  last_name='Sanders'))
+        db.session.commit()
+
+        sync_rosters(self.client)
+
+        sanders = GovMembers.query.get('S000033')
+        self.assertEqual(sanders.first_name, 'Bernard')
+        self.assertEqual(sanders.chamber, 'senate')
+        self.assertEqual(GovMembers.query.count(), 3)
+
+    def test_roster_filters(self):
+        sync_rosters(self.client)
+
+        senate = get_roster('senate')
+        self.assertEqual([m.id for m in senate], ['M000355', 'S000033'])
+
+        kentucky = get_roster('senate', state='ky')
+        self.assertEqual([m.id for m in kentucky], ['M000355'])
+
+        self.assertEqual(get_roster('senate', party='D'), [])
+
+    def test_upgrade_original_schema(self):
+        db.drop_all()
+        db.session.execute(ORIGINAL_SCHEMA)
+        db.session.execute("INSERT INTO govmembers VALUES ('S000033', 'Bernie', 'Sanders')")
+        db.session.execute("INSERT INTO users VALUES (1, 'a@test.com', 'a', 'x')")
+        db.session.execute("INSERT INTO likes (user_id, item_id) "
+                           "VALUES (1, 'S000033'), (1, 'S000033')")
+        db.session.commit()
+
+        upgrade_schema()
+        # and again, as every release does
+        upgrade_schema()
+
+        sync_rosters(self.client)
+        sanders = GovMembers.query.get('S000033')
+        self.assertEqual((sanders.first_name, sanders.chamber, sanders.state),
+                         ('Bernard', 'senate', 'VT'))
+        self.assertIsNone(sanders.votes_synced_through)
+
+        # Duplicate follows collapsed, and following again is a no-op
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(Likes.follow(1, ['S000033']), 0)
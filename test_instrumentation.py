@@ -0,0 +1,91 @@
+"""Request timing and metrics tests"""
+
+# run these tests like:
+#    python -m unittest test_instrumentation.py
+
+from app import create_app, api_cache  # nopep8
+from unittest import TestCase
+
+from instrumentation import Histogram, RequestTimings, _current, timed
+from models import db, GovMembers
+from propublica import ProPublicaClient
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+class HistogramTestCase(TestCase):
+    """Test bucketing and the text format"""
+
+    def test_render(self):
+        histogram = Histogram('test_seconds', 'Test.', 'kind', buckets=(0.1, 1.0))
+        histogram.observe('db', 0.05)
+        histogram.observe('db', 0.5)
+        histogram.observe('db', 5)
+
+        lines = histogram.render()
+
+        self.assertIn('test_seconds_bucket{kind="db",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{kind="db",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{kind="db",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{kind="db"} 3', lines)
+        self.assertIn('test_seconds_sum{kind="db"} 5.55', lines)
+
+
+class RequestTimingTestCase(TestCase):
+    """Test the Server-Timing header and /metrics"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        api_cache.backend.clear()
+
+        db.session.add(
+            GovMembers(id='S000033', first_name='Bernard', last_name='Sanders',
+                       party='ID', state='VT', chamber='senate', in_office=True))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_server_timing(self):
+        res = self.client.get('/api/v1/rosters/senate')
+
+        timing = res.headers['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        self.assertNotIn('upstream', timing)
+
+    def test_metrics(self):
+        self.client.get('/api/v1/rosters/senate')
+
+        res = self.client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        body = res.get_data(as_text=True)
+        self.assertIn('informed_voter_span_seconds_count{kind="db"}', body)
+        self.assertIn('informed_voter_request_seconds_count{endpoint="members_data.api_roster"}',
+                      body)
+        self.assertIn('informed_voter_password_hashing{measure="queue_wait_seconds"}', body)
+
+    def test_gather_counts_towards_request(self):
+        client = ProPublicaClient('test-key', pool_size=2)
+
+        def call():
+            with timed('upstream'):
+                return 'member'
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            client.gather({'a': call, 'b': call}, timeout=2)
+        finally:
+            _current.reset(token)
+
+        self.assertEqual(timings.spans['upstream'][1], 2)
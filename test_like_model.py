@@ -3,15 +3,16 @@
 # run these tests like:
 #    python -m unittest test_like_model.py
 
-from app import app, CURR_USER_KEY  # nopep8
+from app import create_app, identity_cache, CURR_USER_KEY, IDENTITY_VERSION_KEY  # nopep8
 import os
 from unittest import TestCase
 from sqlalchemy import exc
 
+from identity import LazyUser
 from models import db, User, Likes, GovMembers
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///voter-test"
-app.config["SQLALCHEMY_ECHO"] = False
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
 
 # import app
 
@@ -70,3 +71,97 @@ class UserModelTestCase(TestCase):
         l = Likes.query.filter(Likes.user_id == uid).all()
         self.assertEqual(len(l), 1)
         self.assertEqual(l[0].item_id, m1.id)
+
+    def test_follow_is_idempotent(self):
+        u = User.signup("follower@testit.com", "follower", "qwerty")
+        u.id = 7777
+        db.session.add(GovMembers(id="F000001", first_name="Bernard",
+                                  last_name="Sanders"))
+        db.session.commit()
+
+        new_member = {"id": "F000002", "first_name": "Nancy",
+                      "last_name": "Pelosi"}
+
+        self.assertEqual(Likes.follow(7777, ["F000001", new_member]), 2)
+        self.assertEqual(Likes.follow(7777, ["F000001", new_member, "X0"]), 0)
+        db.session.commit()
+
+        self.assertEqual(Likes.query.filter_by(user_id=7777).count(), 2)
+        self.assertEqual(GovMembers.query.get("F000002").last_name, "Pelosi")
+
+    def test_unfollow(self):
+        u = User.signup("unfollower@testit.com", "unfollower", "qwerty")
+        u.id = 8888
+        db.session.add(GovMembers(id="U000001", first_name="Bernard",
+                                  last_name="Sanders"))
+        db.session.commit()
+
+        Likes.follow(8888, ["U000001"])
+        db.session.commit()
+
+        self.assertEqual(Likes.unfollow(8888, ["U000001"]), 1)
+        self.assertEqual(Likes.unfollow(8888, ["U000001"]), 0)
+        db.session.commit()
+
+        self.assertEqual(u.likes, [])
+
+    def test_duplicate_like_rejected(self):
+        u = User.signup("dup@testit.com", "duplicate", "qwerty")
+        u.id = 9999
+        db.session.add(GovMembers(id="D000001", first_name="Bernard",
+                                  last_name="Sanders"))
+        db.session.commit()
+
+        db.session.add_all([Likes(user_id=9999, item_id="D000001"),
+                            Likes(user_id=9999, item_id="D000001")])
+
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
+
+    def logged_in_client(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def follows(self, client, user_id):
+        with client.session_transaction() as sess:
+            version = sess.get(IDENTITY_VERSION_KEY, 0)
+        return LazyUser(user_id, version, identity_cache).liked_member_ids
+
+    def test_devices_see_own_follows(self):
+        u = User.signup("devices@testit.com", "devices", "qwerty")
+        u.id = 5555
+        db.session.add_all([GovMembers(id="V000001", first_name="Bernard",
+                                       last_name="Sanders"),
+                            GovMembers(id="V000002", first_name="Mitch",
+                                       last_name="McConnell")])
+        db.session.commit()
+
+        phone, laptop = self.logged_in_client(5555), self.logged_in_client(5555)
+
+        phone.post('/users/likes', json={'follow': ['V000001']})
+        self.assertEqual(self.follows(phone, 5555), {'V000001'})
+
+        laptop.post('/users/likes', json={'follow': ['V000002']})
+        self.assertEqual(self.follows(laptop, 5555), {'V000001', 'V000002'})
+
+    def test_deleted_account_logged_out(self):
+        u = User.signup("deleted@testit.com", "deleted", "qwerty")
+        u.id = 4444
+        db.session.add(GovMembers(id="W000001", first_name="Bernard",
+                                  last_name="Sanders"))
+        db.session.commit()
+
+        client = self.logged_in_client(4444)
+        self.assertEqual(self.follows(client, 4444), frozenset())
+
+        # Deleted through another worker, whose cache this one does not see
+        db.session.delete(u)
+        db.session.commit()
+
+        res = client.post('/users/likes', json={'follow': ['W000001']})
+        self.assertEqual(res.status_code, 401)
+        with client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
+        self.assertIsNone(identity_cache.get(4444, 0))
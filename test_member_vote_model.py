@@ -0,0 +1,89 @@
+"""MemberVote model and vote sync tests"""
+
+# run these tests like:
+#    python -m unittest test_member_vote_model.py
+
+from app import create_app  # nopep8
+from unittest import TestCase
+
+from models import db, GovMembers, MemberVote
+from sync import sync_member_votes
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+def make_vote(roll_call):
+    """Upstream-shaped vote; higher roll calls are more recent"""
+
+    return {
+        'chamber': 'Senate', 'congress': '116', 'session': '2',
+        'roll_call': str(roll_call),
+        'date': '2020-09-%02d' % (roll_call // 10 + 1),
+        'time': '12:%02d:00' % (roll_call % 10),
+        'bill': {'bill_id': f"s{roll_call}-116", 'title': 'A bill'},
+        'description': 'On Passage', 'result': 'Passed', 'position': 'Yes',
+    }
+
+
+class FakeClient:
+    """Stands in for ProPublicaClient, serving votes newest first"""
+
+    def __init__(self, latest):
+        self.latest = latest
+        self.calls = 0
+
+    def member_votes(self, member_id, offset=0):
+        self.calls += 1
+        newest = self.latest - offset
+        return [make_vote(n) for n in range(newest, max(newest - 20, 0), -1)]
+
+
+class MemberVoteModelTestCase(TestCase):
+    """Test incremental vote sync and keyset pagination"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.member = GovMembers(id='S000033', first_name='Bernard',
+                                 last_name='Sanders')
+        db.session.add(self.member)
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_sync_is_incremental(self):
+        self.assertEqual(sync_member_votes(FakeClient(50), self.member), 50)
+
+        client = FakeClient(55)
+        self.assertEqual(sync_member_votes(client, self.member), 5)
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(MemberVote.query.count(), 55)
+        self.assertTrue(self.member.votes_complete)
+
+    def test_first_sync_capped(self):
+        self.assertEqual(sync_member_votes(FakeClient(100), self.member, max_pages=2), 40)
+        self.assertFalse(self.member.votes_complete)
+
+    def test_keyset_pages(self):
+        sync_member_votes(FakeClient(45), self.member)
+
+        first, newer, older = MemberVote.page('S000033')
+        self.assertEqual([v.roll_call for v in first][:2], [45, 44])
+        self.assertIsNone(newer)
+
+        second, newer, older = MemberVote.page('S000033', before=older)
+        self.assertEqual(second[0].roll_call, 25)
+
+        last, _, older = MemberVote.page('S000033', before=older)
+        self.assertEqual([v.roll_call for v in last], [5, 4, 3, 2, 1])
+        self.assertIsNone(older)
+
+        back, _, _ = MemberVote.page('S000033', after=newer)
+        self.assertEqual(back[0].roll_call, 45)
@@ -0,0 +1,101 @@
+"""Cursor pagination tests"""
+
+# run these tests like:
+#    python -m unittest test_pagination.py
+
+from unittest import TestCase
+
+from cache import TTLCache, LRUBackend
+from pagination import (PAGE_SIZE, UpstreamPager, decode_cursor, encode_cursor,
+                        offset_cursor)
+
+
+class FakeList:
+    """An upstream list of `size` rows, paged by offset"""
+
+    def __init__(self, size):
+        self.rows = list(range(size))
+        self.fetched = []
+
+    def fetch(self, offset):
+        self.fetched.append(offset)
+        return self.rows[offset:offset + PAGE_SIZE]
+
+
+class PaginationTestCase(TestCase):
+    """Test cursors and paging upstream lists with prefetch"""
+
+    def setUp(self):
+        self.submitted = []
+        self.pager = UpstreamPager(TTLCache(LRUBackend(), ttl=300),
+                                   self.submitted.append)
+
+    def run_prefetches(self):
+        while self.submitted:
+            self.submitted.pop(0)()
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor({'before': ['2020-09-24T18:00:00', '116-s-200']})
+
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor),
+                         {'before': ['2020-09-24T18:00:00', '116-s-200']})
+
+    def test_bad_cursor(self):
+        for cursor in (None, '', 'not a cursor', encode_cursor([1, 2]) + '!',
+                       'W10'):
+            self.assertEqual(decode_cursor(cursor), {})
+
+    def test_first_page_starts_at_zero(self):
+        upstream = FakeList(50)
+        page = self.pager.page('list', upstream.fetch)
+
+        self.assertEqual(page.items, list(range(20)))
+        self.assertIsNone(page.prev_cursor)
+        self.assertEqual(upstream.fetched, [0])
+
+    def test_next_page_is_prefetched(self):
+        upstream = FakeList(50)
+
+        page = self.pager.page('list', upstream.fetch)
+        self.assertEqual(len(self.submitted), 1)
+        self.run_prefetches()
+        self.assertEqual(upstream.fetched, [0, 20])
+
+        second = self.pager.page('list', upstream.fetch, page.next_cursor)
+        self.assertEqual(second.items, list(range(20, 40)))
+        self.assertEqual(upstream.fetched, [0, 20])
+
+        first = self.pager.page('list', upstream.fetch, second.prev_cursor)
+        self.assertEqual(first.items, page.items)
+
+    def test_last_page(self):
+        upstream = FakeList(45)
+
+        third = self.pager.page('list', upstream.fetch, offset_cursor(40))
+        self.assertEqual(third.items, [40, 41, 42, 43, 44])
+        self.assertIsNone(third.next_cursor)
+        self.assertEqual(self.submitted, [])
+
+    def test_full_last_page_loses_next_once_prefetched(self):
+        upstream = FakeList(40)
+
+        second = self.pager.page('list', upstream.fetch, offset_cursor(20))
+        self.assertIsNotNone(second.next_cursor)
+        self.run_prefetches()
+
+        second = self.pager.page('list', upstream.fetch, offset_cursor(20))
+        self.assertIsNone(second.next_cursor)
+
+    def test_failed_prefetch_is_dropped(self):
+        def fetch(offset):
+            if offset:
+                raise ValueError('upstream down')
+            return list(range(20))
+
+        page = self.pager.page('list', fetch)
+        self.run_prefetches()
+
+        self.assertIsNotNone(page.next_cursor)
+        with self.assertRaises(ValueError):
+            self.pager.page('list', fetch, page.next_cursor)
@@ -0,0 +1,82 @@
+"""Password hasher tests"""
+
+# run these tests like:
+#    python -m unittest test_password_hasher.py
+
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from hashing import PasswordHasher, HashingOverloaded, hash_rounds
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test pooled bcrypt hashing, load shedding and rehash detection"""
+
+    def test_hash_and_check_on_pool(self):
+        hasher = PasswordHasher(rounds=4, workers=1)
+        hashed = hasher.generate_password_hash('rolltide')
+
+        self.assertEqual(hash_rounds(hashed), 4)
+        self.assertTrue(hasher.check_password_hash(hashed, 'rolltide'))
+        self.assertFalse(hasher.check_password_hash(hashed, 'wrong'))
+        self.assertEqual(hasher.metrics()['hashes'], 3)
+
+    def test_empty_password(self):
+        hasher = PasswordHasher(rounds=4, workers=0)
+
+        with self.assertRaises(ValueError):
+            hasher.generate_password_hash('')
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(rounds=4, workers=0)
+        hashed = hasher.generate_password_hash('rolltide')
+
+        self.assertFalse(hasher.needs_rehash(hashed))
+        hasher.rounds = 5
+        self.assertTrue(hasher.needs_rehash(hashed))
+
+    def test_sheds_load_when_queue_is_full(self):
+        hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+
+        # two hashes already running or queued
+        hasher._slots.acquire()
+        hasher._slots.acquire()
+
+        with self.assertRaises(HashingOverloaded):
+            hasher.generate_password_hash('rolltide')
+
+        hasher._slots.release()
+        self.assertTrue(hasher.generate_password_hash('rolltide'))
+        self.assertEqual(hasher.metrics()['rejected'], 1)
+
+    def test_green_hashes_queue_for_workers(self):
+        hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+        running = []
+        overlapped = []
+
+        def run_blocking(func, *args):
+            running.append(func)
+            overlapped.append(len(running) > 1)
+            time.sleep(0.1)
+            running.remove(func)
+            return func(*args)
+
+        with patch('green.is_patched', return_value=True), \
+                patch('green.run_blocking', side_effect=run_blocking):
+            threads = [threading.Thread(target=hasher.generate_password_hash,
+                                        args=('rolltide',)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.02)
+
+            # one hashing and one queued fill the bounds
+            with self.assertRaises(HashingOverloaded):
+                hasher.generate_password_hash('rolltide')
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(overlapped, [False, False])
+        self.assertEqual(hasher.metrics()['hashes'], 2)
@@ -0,0 +1,86 @@
+"""ProPublica client tests"""
+
+# run these tests like:
+#    python -m unittest test_propublica_client.py
+
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+from app import upstream_error_status  # nopep8
+from propublica import ProPublicaClient, ProPublicaError, NotFound, UpstreamTimeout
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+    def json(self):
+        return self.body
+
+
+class ProPublicaClientTestCase(TestCase):
+    """Test concurrent fan-out of upstream calls"""
+
+    def setUp(self):
+        self.client = ProPublicaClient('test-key', pool_size=4)
+
+    def test_gather_runs_calls_concurrently(self):
+        def slow(value):
+            time.sleep(0.2)
+            return value
+
+        start = time.monotonic()
+        results, errors = self.client.gather({
+            'member': lambda: slow('member'),
+            'votes': lambda: slow('votes'),
+        }, timeout=2)
+
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual(results, {'member': 'member', 'votes': 'votes'})
+        self.assertEqual(errors, {})
+
+    def test_gather_partial_failure(self):
+        def broken():
+            raise ProPublicaError('upstream down')
+
+        results, errors = self.client.gather({
+            'member': lambda: 'member',
+            'votes': broken,
+        }, timeout=2)
+
+        self.assertEqual(results, {'member': 'member'})
+        self.assertIsInstance(errors['votes'], ProPublicaError)
+
+    def test_gather_deadline(self):
+        results, errors = self.client.gather({
+            'member': lambda: 'member',
+            'votes': lambda: time.sleep(1),
+        }, timeout=0.1)
+
+        self.assertEqual(results, {'member': 'member'})
+        self.assertIsInstance(errors['votes'], UpstreamTimeout)
+
+    def test_error_kinds(self):
+        def error(**response):
+            with patch('requests.Session.get', **response):
+                try:
+                    self.client.member('X000000')
+                except ProPublicaError as e:
+                    return type(e), upstream_error_status(e)
+
+        self.assertEqual(error(return_value=FakeResponse(404, {})), (NotFound, 404))
+        self.assertEqual(error(return_value=FakeResponse(200, {
+            'status': 'ERROR', 'errors': [{'error': 'Record not found'}]})), (NotFound, 404))
+        self.assertEqual(error(return_value=FakeResponse(500, {})), (ProPublicaError, 502))
+        self.assertEqual(error(side_effect=requests.ReadTimeout('slow')),
+                         (UpstreamTimeout, 504))
+        self.assertEqual(error(side_effect=requests.ConnectionError('down')),
+                         (ProPublicaError, 502))
@@ -0,0 +1,156 @@
+"""Upstream quota scheduler tests"""
+
+# run these tests like:
+#    python -m unittest test_quota.py
+
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from urllib3.exceptions import MaxRetryError
+
+from cache import LRUBackend, TTLCache
+from models import UpstreamBudget
+from propublica import BudgetedRetry, ProPublicaClient, QuotaExhausted
+from quota import (QuotaScheduler, DatabaseQuotaStore, INTERACTIVE, BACKGROUND,
+                   background, current_priority)
+from test_propublica_client import FakeResponse
+
+engine = create_engine('postgresql:///voter-test')
+UpstreamBudget.__table__.create(engine, checkfirst=True)
+
+
+class QuotaSchedulerTestCase(TestCase):
+    """Test the token bucket, daily budget and priorities"""
+
+    def test_burst_then_rate(self):
+        quota = QuotaScheduler(per_second=20, burst=2, daily_limit=0,
+                               interactive_wait=0)
+
+        self.assertTrue(quota.acquire(INTERACTIVE))
+        self.assertTrue(quota.acquire(INTERACTIVE))
+        self.assertFalse(quota.acquire(INTERACTIVE))
+
+        time.sleep(0.06)
+        self.assertTrue(quota.acquire(INTERACTIVE))
+
+    def test_interactive_waits_for_token(self):
+        quota = QuotaScheduler(per_second=20, burst=1, daily_limit=0,
+                               interactive_wait=0.5)
+        quota.acquire(INTERACTIVE)
+
+        start = time.monotonic()
+        self.assertTrue(quota.acquire(INTERACTIVE))
+        self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_daily_share(self):
+        quota = QuotaScheduler(per_second=0, daily_limit=10,
+                               background_share=0.8)
+
+        with background():
+            granted = sum(quota.acquire() for _ in range(10))
+
+        self.assertEqual(granted, 8)
+        self.assertTrue(quota.low())
+        self.assertTrue(quota.acquire(INTERACTIVE))
+        self.assertTrue(quota.acquire(INTERACTIVE))
+        self.assertFalse(quota.acquire(INTERACTIVE))
+        self.assertEqual(quota.metrics()['remaining_today'], 0)
+
+    def test_background_yields_to_interactive(self):
+        quota = QuotaScheduler(per_second=10, burst=1, daily_limit=0,
+                               interactive_wait=1, background_wait=1)
+        quota.acquire(INTERACTIVE)
+        order = []
+
+        def take(priority):
+            quota.acquire(priority)
+            order.append(priority)
+
+        waiting = threading.Thread(target=take, args=(BACKGROUND,))
+        waiting.start()
+        time.sleep(0.02)
+        take(INTERACTIVE)
+        waiting.join()
+
+        self.assertEqual(order, [INTERACTIVE, BACKGROUND])
+
+    def test_shared_between_processes(self):
+        engine.execute("DELETE FROM upstream_budget WHERE name = 'test'")
+        web, worker = (QuotaScheduler(per_second=0, daily_limit=10,
+                                      store=DatabaseQuotaStore(lambda: engine, 'test'))
+                       for _ in range(2))
+
+        with background():
+            granted = sum(worker.acquire() for _ in range(10))
+
+        self.assertEqual(granted, 8)
+        self.assertTrue(web.low())
+        self.assertFalse(web.acquire(BACKGROUND))
+        self.assertTrue(web.acquire(INTERACTIVE))
+        self.assertTrue(web.acquire(INTERACTIVE))
+        self.assertFalse(web.acquire(INTERACTIVE))
+        self.assertEqual(worker.metrics()['remaining_today'], 0)
+
+    def test_shared_rate(self):
+        engine.execute("DELETE FROM upstream_budget WHERE name = 'test'")
+        web, worker = (QuotaScheduler(per_second=1, burst=2, daily_limit=0,
+                                      interactive_wait=0, background_wait=0,
+                                      store=DatabaseQuotaStore(lambda: engine, 'test'))
+                       for _ in range(2))
+
+        self.assertTrue(worker.acquire(BACKGROUND))
+        self.assertTrue(worker.acquire(BACKGROUND))
+        self.assertFalse(web.acquire(INTERACTIVE))
+
+    def test_retries_are_charged(self):
+        quota = QuotaScheduler(per_second=0, daily_limit=2)
+        retry = BudgetedRetry(total=2, status_forcelist=(503,))
+        retry.quota = quota
+
+        response = type('Response', (), {'status': 503,
+                                         'get_redirect_location': lambda self: None})()
+        retry = retry.increment('GET', '/members.json', response=response)
+        self.assertEqual(quota.metrics()['used_today'], 1)
+
+        quota.acquire()
+        with self.assertRaises(MaxRetryError):
+            retry.increment('GET', '/members.json', response=response)
+
+    def test_refresh_is_background(self):
+        cache = TTLCache(LRUBackend(), ttl=0)
+        cache.set('key', 'stale')
+        priorities = []
+        refreshed = threading.Event()
+
+        def loader():
+            priorities.append(current_priority())
+            refreshed.set()
+            return 'fresh'
+
+        self.assertEqual(cache.get('key', loader), 'stale')
+        refreshed.wait(1)
+        self.assertEqual(priorities, [BACKGROUND])
+
+
+class QuotaClientTestCase(TestCase):
+    """Test that the client degrades to stale results"""
+
+    def setUp(self):
+        self.quota = QuotaScheduler(per_second=0, daily_limit=1)
+        self.client = ProPublicaClient('test-key', quota=self.quota)
+
+    def test_stale_when_over_budget(self):
+        with patch('requests.Session.get',
+                   return_value=FakeResponse(200, {'status': 'OK',
+                                                   'results': [{'bill_id': 'hr1-116'}]})) as get:
+            self.assertEqual(self.client.bill('hr1'), {'bill_id': 'hr1-116'})
+            self.assertEqual(self.client.bill('hr1'), {'bill_id': 'hr1-116'})
+
+            with self.assertRaises(QuotaExhausted):
+                self.client.bill('hr2')
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(self.quota.metrics()['served_stale'], 1)
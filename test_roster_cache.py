@@ -0,0 +1,81 @@
+"""Roster cache tests"""
+
+# run these tests like:
+#    python -m unittest test_roster_cache.py
+
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from cache import TTLCache, LRUBackend, SQLiteBackend
+
+
+class RosterCacheTestCase(TestCase):
+    """Test TTL and stale-while-revalidate behaviour"""
+
+    def setUp(self):
+        self.calls = 0
+        self.cache = TTLCache(LRUBackend(maxsize=2), ttl=60)
+
+    def loader(self):
+        self.calls += 1
+        return [f"member-{self.calls}"]
+
+    def test_miss_then_hit(self):
+        self.assertEqual(self.cache.get('senate', self.loader), ['member-1'])
+        self.assertEqual(self.cache.get('senate', self.loader), ['member-1'])
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_served_while_refreshing(self):
+        refreshed = threading.Event()
+
+        def slow_loader():
+            refreshed.wait(5)
+            return ['fresh']
+
+        self.cache.backend.set('house', ['stale'], time.time() - 120)
+
+        self.assertEqual(self.cache.get('house', slow_loader), ['stale'])
+        refreshed.set()
+
+        for _ in range(50):
+            if self.cache.backend.get('house')[0] == ['fresh']:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.get('house', slow_loader), ['fresh'])
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        def broken_loader():
+            raise RuntimeError('upstream down')
+
+        self.cache.max_stale = 0
+        self.cache.backend.set('house', ['stale'], time.time() - 120)
+
+        self.assertEqual(self.cache.get('house', broken_loader), ['stale'])
+
+    def test_lru_eviction(self):
+        backend = LRUBackend(maxsize=2)
+        backend.set('a', 1, 0)
+        backend.set('b', 2, 0)
+        backend.get('a')
+        backend.set('c', 3, 0)
+
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), (1, 0))
+
+    def test_sqlite_backend(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        backend = SQLiteBackend(path)
+        backend.set('senate', [{'id': 'S000033'}], 10.0)
+
+        self.assertEqual(SQLiteBackend(path).get('senate'),
+                         ([{'id': 'S000033'}], 10.0))
+
+        backend.delete('senate')
+        self.assertIsNone(backend.get('senate'))
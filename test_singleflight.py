@@ -0,0 +1,83 @@
+"""Single-flight coalescing tests"""
+
+# run these tests like:
+#    python -m unittest test_singleflight.py
+
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from singleflight import SingleFlight, FileFlightStore
+
+
+def run_concurrently(funcs):
+    results = [None] * len(funcs)
+
+    def run(i):
+        try:
+            results[i] = funcs[i]()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(funcs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class SingleFlightTestCase(TestCase):
+    """Test that concurrent calls for a key share one call"""
+
+    def setUp(self):
+        self.calls = 0
+
+    def slow_fetch(self, value='bill'):
+        self.calls += 1
+        time.sleep(0.2)
+        return {'bill_id': value}
+
+    def test_concurrent_calls_coalesce(self):
+        flights = SingleFlight()
+
+        results = run_concurrently(
+            [lambda: flights.do('hr1', self.slow_fetch)] * 8)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'bill_id': 'bill'}] * 8)
+        self.assertEqual(flights.metrics(), {'calls': 1, 'shared': 7})
+
+    def test_distinct_keys_and_later_calls(self):
+        flights = SingleFlight()
+
+        run_concurrently([lambda: flights.do('hr1', self.slow_fetch),
+                          lambda: flights.do('hr2', self.slow_fetch)])
+        flights.do('hr1', self.slow_fetch)
+
+        self.assertEqual(self.calls, 3)
+
+    def test_error_shared(self):
+        flights = SingleFlight()
+
+        def broken():
+            time.sleep(0.2)
+            raise ValueError('upstream down')
+
+        results = run_concurrently([lambda: flights.do('hr1', broken)] * 3)
+
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    def test_file_store_coalesces_across_processes(self):
+        # flock locks belong to the open file, so two stores in one process
+        # contend like two workers would
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [SingleFlight(FileFlightStore(directory)) for _ in range(4)]
+
+            results = run_concurrently(
+                [lambda w=w: w.do('hr1', self.slow_fetch) for w in workers])
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'bill_id': 'bill'}] * 4)
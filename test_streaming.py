@@ -0,0 +1,86 @@
+"""Streamed page rendering tests"""
+
+# run these tests like:
+#    python -m unittest test_streaming.py
+
+from app import create_app, roster_fragments  # nopep8
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, GovMembers
+from pagination import DeferredPage, Page
+from streaming import STREAM_ERROR_HTML, stream_template
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+class StreamingTestCase(TestCase):
+    """Test that configured routes stream the same page"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        roster_fragments.backend.clear()
+
+        db.session.add(
+            GovMembers(id='P000197', first_name='Nancy', last_name='Pelosi',
+                       party='D', state='CA', chamber='house', in_office=True))
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.streamed_routes = app.config['STREAMED_ROUTES']
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        app.config['STREAMED_ROUTES'] = self.streamed_routes
+        return res
+
+    def test_streamed_roster(self):
+        res = self.client.get('/search/congress')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Pelosi', res.data)
+        self.assertTrue(res.data.rstrip().endswith(b'</html>'))
+
+    def test_same_page_unstreamed(self):
+        streamed = self.client.get('/search/congress').data
+
+        app.config['STREAMED_ROUTES'] = set()
+        res = self.client.get('/search/congress')
+
+        self.assertEqual(res.data, streamed)
+
+    def test_rows_render_mid_stream(self):
+        with patch('app.get_roster', side_effect=RuntimeError('roster unavailable')):
+            res = self.client.get('/search/congress')
+            body = res.data
+
+        # The head went out before the rows failed; the page is closed off
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'<nav', body)
+        self.assertNotIn(b'Pelosi', body)
+        self.assertTrue(body.endswith(STREAM_ERROR_HTML.encode()))
+
+    def test_votes_load_after_first_chunk(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return Page([])
+
+        with app.test_request_context('/search/member/P000197'):
+            res = stream_template('search/officials_voting.html',
+                                  page=DeferredPage(load),
+                                  member_id='P000197',
+                                  member_contact_data={'first_name': 'Nancy',
+                                                       'last_name': 'Pelosi',
+                                                       'roles': [{}]})
+            self.assertEqual(loads, [])
+
+            body = ''.join(res.response)
+            self.assertEqual(loads, [1])
+            self.assertIn('Voting records', body)
@@ -0,0 +1,98 @@
+"""Member typeahead index tests"""
+
+# run these tests like:
+#    python -m unittest test_typeahead.py
+
+from unittest import TestCase
+
+from typeahead import MemberIndex, PrefixIndex, words
+
+MEMBERS = [
+    {'id': 'S000033', 'first_name': 'Bernard', 'last_name': 'Sanders',
+     'state': 'VT', 'in_office': True},
+    {'id': 'S001194', 'first_name': 'Brian', 'last_name': 'Schatz',
+     'state': 'HI', 'in_office': True},
+    {'id': 'L000570', 'first_name': 'Ben Ray', 'last_name': 'Luján',
+     'state': 'NM', 'in_office': True},
+    {'id': 'V000128', 'first_name': 'Chris', 'last_name': 'Van Hollen',
+     'state': 'MD', 'in_office': True},
+    {'id': 'L000174', 'first_name': 'Patrick', 'last_name': 'Leahy',
+     'state': 'VT', 'in_office': True},
+    {'id': 'S000030', 'first_name': 'Paul', 'last_name': 'Sarbanes',
+     'state': 'MD', 'in_office': False},
+]
+
+
+def ids(members):
+    return [member['id'] for member in members]
+
+
+class PrefixIndexTestCase(TestCase):
+    """Test matching and ranking of typed prefixes"""
+
+    def setUp(self):
+        self.index = PrefixIndex(MEMBERS)
+
+    def test_words(self):
+        self.assertEqual(words('  Luján, Ben-Ray '), ['lujan', 'ben', 'ray'])
+        self.assertEqual(words(None), [])
+
+    def test_last_name_before_first_name(self):
+        # by first name only, so by last name among them
+        self.assertEqual(ids(self.index.search('b')), ['L000570', 'S000033', 'S001194'])
+        self.assertEqual(ids(self.index.search('s')),
+                         ['S000033', 'S001194', 'S000030'])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(ids(self.index.search('ber san')), ['S000033'])
+        self.assertEqual(ids(self.index.search('ber schatz')), [])
+        self.assertEqual(ids(self.index.search('hollen')), ['V000128'])
+
+    def test_states_match_whole(self):
+        self.assertEqual(ids(self.index.search('vt')), ['L000174', 'S000033'])
+        self.assertEqual(ids(self.index.search('v')), ['V000128'])
+
+    def test_id_and_accents(self):
+        self.assertEqual(ids(self.index.search('s001194')), ['S001194'])
+        self.assertEqual(ids(self.index.search('LUJ')), ['L000570'])
+
+    def test_limit_and_empty(self):
+        self.assertEqual(len(self.index.search('s', limit=2)), 2)
+        self.assertEqual(self.index.search(''), [])
+        self.assertEqual(self.index.search('zz'), [])
+
+
+class MemberIndexTestCase(TestCase):
+    """Test rebuilding the index when the rosters change"""
+
+    def test_rebuilt_on_new_version(self):
+        index = MemberIndex(check_every=0)
+        roster = {'version': 1, 'members': MEMBERS[:1]}
+        loads = []
+
+        def load():
+            loads.append(roster['version'])
+            return roster['members']
+
+        def search(query):
+            return ids(index.get(lambda: roster['version'], load).search(query))
+
+        self.assertEqual(search('sanders'), ['S000033'])
+        self.assertEqual(search('schatz'), [])
+        self.assertEqual(loads, [1])
+
+        roster.update(version=2, members=MEMBERS)
+        self.assertEqual(search('schatz'), ['S001194'])
+        self.assertEqual(loads, [1, 2])
+
+    def test_version_checked_at_most_every_check_every(self):
+        index = MemberIndex(check_every=60)
+        checks = []
+
+        def version():
+            checks.append(1)
+            return len(checks)
+
+        for _ in range(3):
+            index.get(version, lambda: MEMBERS)
+        self.assertEqual(len(checks), 1)
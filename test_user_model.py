@@ -2,7 +2,7 @@
 
 # run these tests like:
 #    python -m unittest test_user_model.py
-from app import app  # nopep8
+from app import create_app  # nopep8
 
 import os
 from unittest import TestCase
@@ -10,9 +10,10 @@ from sqlalchemy import exc
 
 
 from models import db, User, Likes
+from hashing import hasher, hash_rounds
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///voter-test"
-app.config["SQLALCHEMY_ECHO"] = False
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
 
 # Create tables and delete data in each test
 
@@ -123,3 +124,15 @@ class UserModelTestCase(TestCase):
         self.assertFalse(User.authenticate(
             self.test_user1.username, 'notrightpassword'
         ))
+
+    def test_rehash_on_login(self):
+        rounds = hasher.rounds
+        hasher.rounds = rounds - 1
+
+        try:
+            test_user = User.authenticate(self.test_user1.username, 'password1')
+        finally:
+            hasher.rounds = rounds
+
+        self.assertEqual(hash_rounds(test_user.password), rounds - 1)
+        self.assertTrue(hasher.check_password_hash(test_user.password, 'password1'))
@@ -0,0 +1,133 @@
+"""Member vote statistics tests"""
+
+# run these tests like:
+#    python -m unittest test_vote_stats.py
+
+from app import create_app  # nopep8
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, GovMembers, MemberVote, MemberVoteStats
+from stats import NO, NOT_VOTING, PRESENT, YES, aggregate, refresh_vote_stats
+
+app = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql:///voter-test",
+                  "SQLALCHEMY_ECHO": False})
+
+db.create_all()
+
+
+def add_votes(member, positions, first_roll_call=1):
+    """Store `positions` on consecutive roll calls and advance the member's
+    high-water mark, as sync.sync_member_votes does
+    """
+
+    for number, position in enumerate(positions, start=first_roll_call):
+        db.session.add(MemberVote(member_id=member.id, vote_key=f"116-senate-2-{number}",
+                                  voted_at=datetime(2020, 9, 1, 12, number),
+                                  chamber='senate', congress=116, session=2,
+                                  roll_call=number, position=position))
+    member.votes_synced_through = datetime(2020, 9, 1, 12, first_roll_call + len(positions) - 1)
+    db.session.commit()
+
+
+class AggregateTestCase(TestCase):
+    """Test counting positions over all members at once"""
+
+    def test_counts(self):
+        # Member 0 votes on roll calls 1 to 3, member 1 on 1 and 2
+        counts = aggregate([0, 0, 0, 1, 1], [1, 2, 3, 1, 2],
+                           [YES, NOT_VOTING, PRESENT, NO, NO],
+                           [1, 1, 1, 2, 2], members_count=3)
+
+        self.assertEqual(counts['total_votes'].tolist(), [3, 2, 0])
+        self.assertEqual(counts['yes_votes'].tolist(), [1, 0, 0])
+        self.assertEqual(counts['no_votes'].tolist(), [0, 2, 0])
+        self.assertEqual(counts['present_votes'].tolist(), [1, 0, 0])
+        self.assertEqual(counts['missed_votes'].tolist(), [1, 0, 0])
+
+    def test_party_line_excludes_own_vote(self):
+        counts = aggregate([0, 1, 2, 4, 0, 3], [1, 1, 1, 1, 2, 2],
+                           [YES, YES, YES, NO, YES, YES],
+                           [1, 1, 1, 1, 1, 0], members_count=5, min_party_voters=1)
+
+        # Roll call 1: members 0 to 2 go with the other two of them, 4
+        # against all three. Roll call 2: member 0 has no party colleague
+        # voting, 3 has no party.
+        self.assertEqual(counts['party_line_eligible'].tolist(), [1, 1, 1, 0, 1])
+        self.assertEqual(counts['party_line_votes'].tolist(), [1, 1, 1, 0, 0])
+
+    def test_party_line_needs_enough_party_voters(self):
+        # Roll call 1: members 0 to 3 of one party; roll call 2: just 0 and 1
+        counts = aggregate([0, 1, 2, 3, 0, 1], [1, 1, 1, 1, 2, 2],
+                           [YES, YES, YES, NO, NO, YES],
+                           [1, 1, 1, 1, 1, 1], members_count=4, min_party_voters=3)
+
+        self.assertEqual(counts['party_line_eligible'].tolist(), [1, 1, 1, 1])
+        self.assertEqual(counts['party_line_votes'].tolist(), [1, 1, 1, 0])
+
+    def test_no_rows(self):
+        counts = aggregate([], [], [], [], members_count=0)
+        self.assertEqual(counts['total_votes'].tolist(), [])
+
+
+class RefreshVoteStatsTestCase(TestCase):
+    """Test the summary table and its incremental refresh"""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.sanders = GovMembers(id='S000033', first_name='Bernard',
+                                  last_name='Sanders', party='D')
+        self.schatz = GovMembers(id='S001194', first_name='Brian',
+                                 last_name='Schatz', party='D')
+        self.leahy = GovMembers(id='L000174', first_name='Patrick',
+                                last_name='Leahy', party='D')
+        db.session.add_all([self.sanders, self.schatz, self.leahy])
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_refresh(self):
+        add_votes(self.sanders, ['Yes', 'No', 'Not Voting', 'Yes'])
+        add_votes(self.schatz, ['Yes', 'Yes', 'Yes', 'Yes'])
+
+        self.assertEqual(refresh_vote_stats(min_party_voters=1), 2)
+
+        stats = MemberVoteStats.query.get('S000033')
+        self.assertEqual((stats.total_votes, stats.yes_votes, stats.no_votes,
+                          stats.missed_votes), (4, 2, 1, 1))
+        self.assertEqual(stats.missed_rate, 0.25)
+        self.assertEqual((stats.party_line_votes, stats.party_line_eligible), (2, 3))
+        self.assertIsNone(MemberVoteStats.query.get('L000174'))
+
+        # Nothing new
+        self.assertEqual(refresh_vote_stats(min_party_voters=1), 0)
+
+    def test_new_votes_redo_members_on_the_same_roll_calls(self):
+        add_votes(self.sanders, ['Yes', 'Yes'])
+        add_votes(self.schatz, ['Yes', 'Yes'])
+        self.assertEqual(refresh_vote_stats(min_party_voters=1), 2)
+        schatz = MemberVoteStats.query.get('S001194')
+        self.assertEqual((schatz.party_line_votes, schatz.party_line_eligible), (2, 2))
+
+        # Leahy's vote on roll call 2 ties Schatz's colleagues there
+        add_votes(self.leahy, ['No'], first_roll_call=2)
+        self.assertEqual(refresh_vote_stats(min_party_voters=1), 3)
+
+        db.session.expire_all()
+        schatz = MemberVoteStats.query.get('S001194')
+        self.assertEqual((schatz.party_line_votes, schatz.party_line_eligible), (1, 1))
+        leahy = MemberVoteStats.query.get('L000174')
+        self.assertEqual((leahy.total_votes, leahy.party_line_votes,
+                          leahy.party_line_eligible), (1, 0, 1))
+
+    def test_full_refresh(self):
+        add_votes(self.sanders, ['Yes'])
+        refresh_vote_stats(min_party_voters=1)
+
+        self.assertEqual(refresh_vote_stats(min_party_voters=1), 0)
+        self.assertEqual(refresh_vote_stats(full=True, min_party_voters=1), 1)
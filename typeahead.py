@@ -0,0 +1,133 @@
+"""In-memory prefix index for member name lookup as the user types"""
+
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+
+# (exact, prefix) score of a query word matching a word of each field. A
+# state only matches whole, so 'v' does not list every member from VT or VA.
+FIELD_SCORES = {
+    'id': (100, 30),
+    'last_name': (60, 50),
+    'first_name': (45, 40),
+    'state': (20, 0),
+}
+
+
+def words(text):
+    """Lowercased, accent-free words of `text`, e.g. 'Luján' -> ['lujan']"""
+
+    if not text:
+        return []
+
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ''.join(c if c.isalnum() else ' ' for c in text).split()
+
+
+class PrefixIndex:
+    """Members by every word of their id, names and state.
+
+    The distinct words are kept in one sorted list, so the words starting
+    with a query word are one `bisect` range. A member matches a query when
+    each query word starts some word of theirs; they score the best field
+    score of each query word, summed. Ties go to sitting members, then by
+    last and first name.
+    """
+
+    def __init__(self, members):
+        self.members = list(members)
+
+        postings = {}
+        for number, member in enumerate(self.members):
+            for field, (exact, prefix) in FIELD_SCORES.items():
+                for word in words(member.get(field)):
+                    scores = postings.setdefault(word, {})
+                    best_exact, best_prefix = scores.get(number, (0, 0))
+                    scores[number] = (max(best_exact, exact), max(best_prefix, prefix))
+
+        self._words = sorted(postings)
+        self._postings = [tuple(postings[word].items()) for word in self._words]
+
+        by_name = sorted(range(len(self.members)), key=lambda number: (
+            not self.members[number].get('in_office', True),
+            words(self.members[number].get('last_name')),
+            words(self.members[number].get('first_name'))))
+        self._order = [0] * len(self.members)
+        for position, number in enumerate(by_name):
+            self._order[number] = position
+
+    def search(self, query, limit=10):
+        """The `limit` best matches for `query`, best first"""
+
+        scores = None
+
+        for word in words(query):
+            word_scores = {}
+            start = bisect.bisect_left(self._words, word)
+            end = bisect.bisect_left(self._words, word + '\uffff', start)
+
+            for position in range(start, end):
+                exact = self._words[position] == word
+                for number, (exact_score, prefix_score) in self._postings[position]:
+                    score = exact_score if exact else prefix_score
+                    if score > word_scores.get(number, 0):
+                        word_scores[number] = score
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {number: score + word_scores[number]
+                          for number, score in scores.items() if number in word_scores}
+
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (
+            -item[1], self._order[item[0]]))
+        return [self.members[number] for number, score in best]
+
+
+class MemberIndex:
+    """The current `PrefixIndex`, rebuilt when the rosters change.
+
+    At most every `check_every` seconds a request asks `version()` whether
+    the rosters changed and, if so, builds a new index from `load()` and
+    swaps it in with one assignment. Requests meanwhile keep searching the
+    old index; only the very first build makes anyone wait.
+    """
+
+    def __init__(self, check_every=30):
+        self.check_every = check_every
+        self._current = None
+        self._lock = threading.Lock()
+
+    def get(self, version, load):
+        current = self._current
+        if current is not None and time.monotonic() - current[2] < self.check_every:
+            return current[1]
+
+        if not self._lock.acquire(blocking=current is None):
+            # Another request is already checking; search what we have
+            return current[1]
+
+        try:
+            current = self._current
+            if current is not None and time.monotonic() - current[2] < self.check_every:
+                return current[1]
+
+            latest = version()
+            index = (current[1] if current is not None and current[0] == latest
+                     else PrefixIndex(load()))
+            self._current = (latest, index, time.monotonic())
+            return index
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._current = None